@@ -0,0 +1,73 @@
+"""
+Benchmark of the nightly elevation chart rendering: a new figure for every night
+(elevation_chart) against one ElevationChart reused for all nights.
+
+    python benchmarks/elevation_chart.py --nights 20 --targets 30  (with pyObsFind installed)
+"""
+import argparse
+import io
+import time
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+from obsfind.plotting import ElevationChart, elevation_chart, marker_list
+
+
+def synthetic_night(night:pd.Timestamp, targets:list[str], rng:np.random.Generator, step:str='15min'):
+    """
+    Twilight times and ephemeris of a 12 hour night, with each target rising and setting
+    at a random time (elevations above 30 degrees only, as after the cuts).
+    """
+    sun_set  = night + pd.Timedelta(hours=22)
+    twilight = pd.Series({'night'             : night,
+                          'sun_set'           : sun_set,
+                          'civil_set'         : sun_set + pd.Timedelta(minutes=30),
+                          'nautical_set'      : sun_set + pd.Timedelta(minutes=60),
+                          'astronomical_set'  : sun_set + pd.Timedelta(minutes=90),
+                          'astronomical_rise' : sun_set + pd.Timedelta(hours=10, minutes=30),
+                          'nautical_rise'     : sun_set + pd.Timedelta(hours=11),
+                          'civil_rise'        : sun_set + pd.Timedelta(hours=11, minutes=30),
+                          'sun_rise'          : sun_set + pd.Timedelta(hours=12),
+                          'lunar_illum'       : 50.0})
+    times  = pd.date_range(sun_set, twilight['sun_rise'], freq=step)
+    hours  = (times - sun_set) / pd.Timedelta(hours=1)
+    pieces = []
+    for target in targets + ['Moon']:
+        elevation = 30 + 60 * np.sin(np.pi * (hours - rng.uniform(-6, 6)) / 12)
+        visible   = elevation > 30
+        pieces.append(pd.DataFrame({'datetime'  : times[visible],
+                                    'elevation' : elevation[visible],
+                                    'target'    : target}))
+    return twilight, pd.concat(pieces, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark elevation chart rendering')
+    parser.add_argument('--nights', type=int, default=20, help='Number of nights to render. Default: 20')
+    parser.add_argument('--targets', type=int, default=30, help='Number of targets per night (max 84). Default: 30')
+    args = parser.parse_args()
+
+    rng     = np.random.default_rng(0)
+    targets = [f'{i:05d}' for i in range(args.targets)]
+    nights  = [synthetic_night(pd.Timestamp('2025-08-07') + pd.Timedelta(days=i), targets, rng) for i in range(args.nights)]
+    target_plot_info = marker_list(targets + ['Moon'])
+
+    start = time.perf_counter()
+    for twilight, eph_night in nights:
+        elevation_chart(twilight.copy(), eph_night, target_plot_info, 30, png_buffer=io.BytesIO())
+    new_figure = (time.perf_counter() - start) / args.nights
+
+    start = time.perf_counter()
+    chart = ElevationChart(target_plot_info, 30)
+    for twilight, eph_night in nights:
+        chart.render(twilight.copy(), eph_night, png_buffer=io.BytesIO())
+    chart.close()
+    reused = (time.perf_counter() - start) / args.nights
+
+    print(f'{args.nights} nights, {args.targets} targets')
+    print(f'New figure per night : {new_figure*1000:7.1f} ms/night')
+    print(f'Reused ElevationChart: {reused*1000:7.1f} ms/night ({new_figure/reused:.2f}x)')
+
+if __name__ == '__main__':
+    main()
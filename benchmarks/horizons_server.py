@@ -0,0 +1,185 @@
+"""
+Local stand-in for the JPL Horizons API, for benchmarks that do not depend on the
+network or on JPL's load. Pass its URL to the pipeline with --horizons-url.
+
+Modes
+    synthetic : Answers every query with a synthetic ephemeris (see synthetic.py).
+    record    : Passes queries on to the upstream server and saves the responses.
+    replay    : Answers queries with the saved responses (404 for queries not recorded).
+
+Responses are saved in the recordings directory, one file per query named by a hash
+of its parameters, so a run recorded once against JPL can be replayed for any number
+of benchmark runs. To test clients, the server can also add latency to every response
+and answer the first attempts of each query with a transient error (503).
+
+    python benchmarks/horizons_server.py synthetic --port 8765  (with pyObsFind installed)
+    python -m obsfind.run targets.txt 2025-08-07 2025-08-14 --horizons-url http://127.0.0.1:8765/api/horizons.api
+"""
+import argparse
+import contextlib
+import hashlib
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import requests
+from synthetic import horizons_response
+
+
+MODES           = ['synthetic', 'record', 'replay']
+UPSTREAM_URL    = 'https://ssd.jpl.nasa.gov/api/horizons.api'
+API_PATH        = '/api/horizons.api'
+RECORDINGS_DIR  = Path(__file__).parent / 'recordings'
+
+
+def query_key(params:dict) -> str:
+    """Name of the recording of a query: a hash of its parameters, in any order."""
+    text = '&'.join(f'{key}={params[key]}' for key in sorted(params))
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class HorizonsHandler(BaseHTTPRequestHandler):
+    """Answers Horizons API GET requests according to the mode of the server."""
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != API_PATH:
+            self.send_error(404, f'Only {API_PATH} is served')
+            return
+        params  = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        server  = self.server
+        key     = query_key(params)
+        path    = server.recordings / f'{key}.txt'
+        started = time.perf_counter()
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.attempts[key] = attempt = server.attempts.get(key, 0) + 1
+
+        if attempt <= server.failures:
+            self.send_error(503, 'Injected transient failure')
+            self.record(params, 503, started)
+            return
+        if server.mode == 'synthetic':
+            body = horizons_response(params)
+        elif server.mode == 'record':
+            response = server.upstream_session.get(server.upstream, params=params, timeout=120)
+            if response.status_code != 200:
+                self.send_error(response.status_code, 'Upstream error')
+                self.record(params, response.status_code, started)
+                return
+            body = response.text
+            path.write_text(body)
+        elif path.exists():
+            body = path.read_text()
+        else:
+            self.send_error(404, 'Query not recorded')
+            self.record(params, 404, started)
+            return
+
+        data = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.record(params, 200, started)
+
+    def record(self, params:dict, status:int, started:float):
+        """Appends a request to the log of the server, if it keeps one."""
+        if self.server.log is not None:
+            with self.server.lock:
+                self.server.log.append({'params': params, 'status': status,
+                                        'start': started, 'end': time.perf_counter()})
+
+    def log_message(self, format, *args):
+        # Quiet, there is a request for every target and site
+        pass
+
+
+def make_server(mode:str='synthetic', recordings:Path=RECORDINGS_DIR, upstream:str=UPSTREAM_URL,
+                port:int=0, latency:float=0, failures:int=0, log:list=None) -> ThreadingHTTPServer:
+    """
+    Creates a stand-in server on the local host, not yet serving.
+
+    Inputs
+        mode       : One of MODES (default: 'synthetic').
+        recordings : Directory of the recorded responses (record and replay modes).
+        upstream   : URL of the Horizons API to record from (default: JPL).
+        port       : Port to listen on (default: 0, any free port).
+        latency    : Delay before each response (seconds, default: 0).
+        failures   : Number of attempts of each query answered with a 503 error (default: 0).
+        log        : Optional list each request is appended to, as a dictionary with its
+                     'params', response 'status', and 'start' and 'end' times (perf_counter).
+
+    Output
+        ThreadingHTTPServer object.
+    """
+    if mode not in MODES:
+        raise ValueError(f'Unknown mode {mode}')
+    server = ThreadingHTTPServer(('127.0.0.1', port), HorizonsHandler)
+    server.daemon_threads = True
+    server.mode       = mode
+    server.recordings = Path(recordings)
+    server.upstream   = upstream
+    server.latency    = latency
+    server.failures   = failures
+    server.log        = log
+    server.attempts   = {}
+    server.lock       = threading.Lock()
+    if mode == 'record':
+        server.recordings.mkdir(parents=True, exist_ok=True)
+        server.upstream_session = requests.Session()
+    return server
+
+
+def server_url(server:ThreadingHTTPServer) -> str:
+    """URL of the Horizons API of a stand-in server, to use as --horizons-url."""
+    return f'http://127.0.0.1:{server.server_address[1]}{API_PATH}'
+
+
+@contextlib.contextmanager
+def running_server(mode:str='synthetic', recordings:Path=RECORDINGS_DIR, upstream:str=UPSTREAM_URL, port:int=0,
+                   latency:float=0, failures:int=0, log:list=None):
+    """
+    Runs a stand-in server in a background thread for the duration of a with block.
+    Inputs as make_server.
+
+    Output
+        URL of the Horizons API of the server.
+    """
+    server = make_server(mode, recordings, upstream, port, latency, failures, log)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server_url(server)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the JPL Horizons API')
+    parser.add_argument('mode', choices=MODES, help='synthetic, record or replay')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on. Default: 8765')
+    parser.add_argument('--recordings', type=str, default=str(RECORDINGS_DIR),
+                        help=f'Directory of the recorded responses. Default: {RECORDINGS_DIR}')
+    parser.add_argument('--upstream', type=str, default=UPSTREAM_URL,
+                        help=f'Horizons API to record from. Default: {UPSTREAM_URL}')
+    parser.add_argument('--latency', type=float, default=0, help='Delay before each response (seconds). Default: 0')
+    parser.add_argument('--failures', type=int, default=0,
+                        help='Number of attempts of each query answered with a 503 error, to test retries. Default: 0')
+    args = parser.parse_args()
+
+    server = make_server(args.mode, args.recordings, args.upstream, args.port, args.latency, args.failures)
+    print(f'Serving {args.mode} Horizons responses at {server_url(server)}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
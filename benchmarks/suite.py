@@ -0,0 +1,181 @@
+"""
+Benchmark of the pipeline stages on synthetic targets, with the Horizons queries answered
+by a local stand-in server (see horizons_server.py) instead of JPL:
+
+    ephemeris : create_horizon_dataframe
+    cuts      : limit_cuts
+    elevation : make_elevation_charts_pdf
+    summary   : make_summary_charts_pdf
+
+Each stage is timed --repeat times and the results are appended as one JSON line to
+--output, with the version, the parameters and the peak memory of the run. The previous
+result with the same parameters, if any, is shown alongside for comparison.
+
+    python benchmarks/suite.py --targets 200 --nights 7 --step 15min  (with pyObsFind installed)
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from importlib import metadata
+from pathlib import Path
+import pandas as pd
+from astropy.time import Time
+from horizons_server import RECORDINGS_DIR, running_server
+from obsfind.ephemeris import create_horizon_dataframe, get_twilight_times, limit_cuts
+from obsfind.profiling import max_rss_mb
+from obsfind.read_inputs import create_date_list
+from obsfind.summaries import summarize_nights
+
+
+STAGES = ['ephemeris', 'cuts', 'elevation', 'summary']
+
+
+def version() -> str:
+    """Version of pyObsFind, with the git commit of the source tree when there is one."""
+    try:
+        version = metadata.version('pyObsFind')
+    except metadata.PackageNotFoundError:
+        version = 'unknown'
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent, check=True).stdout.strip()
+        version += f'+{commit}'
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return version
+
+
+def timed(func, *args, **kwargs):
+    """Calls func(*args, **kwargs), returning its result and the time it took (seconds)."""
+    start  = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run_stages(args, horizons_url:str) -> dict:
+    """Runs the stages once, returning the time of each stage and the sizes of their outputs."""
+    from obsfind.create_output import make_elevation_charts_pdf, make_summary_charts_pdf
+    from obsfind.plotting import marker_list
+
+    end       = pd.Timestamp(args.start) + pd.Timedelta(days=args.nights - 1)
+    date_list = create_date_list(Time(args.start), Time(end.strftime('%Y-%m-%d')))
+    twilight  = get_twilight_times(args.mpc_code, date_list)
+    targets   = [str(10000 + i) for i in range(args.targets)]
+    times, rows = {}, {}
+
+    (eph_df, twilight), times['ephemeris'] = timed(create_horizon_dataframe, twilight, args.mpc_code, targets,
+                                                   workers=args.workers, horizons_url=horizons_url, step=args.step)
+    rows['ephemeris'] = len(eph_df)
+    if args.stages == ['ephemeris']:
+        return {'seconds': times, 'rows': rows}
+
+    (eph_cut, twilight), times['cuts'] = timed(limit_cuts, eph_df, args.mag_limit, args.elevation_limit,
+                                               args.time_visible_limit, twilight, args.step)
+    rows['cuts'] = len(eph_cut)
+    del eph_df
+    plot_info = marker_list(list(eph_cut.target.unique()))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            summaries = summarize_nights(eph_cut, twilight)
+            if 'elevation' in args.stages:
+                _, times['elevation'] = timed(make_elevation_charts_pdf, eph_cut, twilight, plot_info,
+                                              args.elevation_limit, args.mpc_code, jobs=args.jobs, summaries=summaries)
+            if 'summary' in args.stages:
+                night_summaries = summaries[summaries['target'] != 'Moon'].copy()
+                _, times['summary'] = timed(make_summary_charts_pdf, night_summaries, plot_info)
+                rows['summary'] = len(night_summaries)
+        finally:
+            os.chdir(cwd)
+    return {'seconds': times, 'rows': rows}
+
+
+def previous_result(path:Path, params:dict) -> dict:
+    """Last result of the results file with the same parameters, if any."""
+    if not path.exists():
+        return None
+    previous = None
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('params') == params:
+                previous = record
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the pipeline stages on synthetic targets')
+    parser.add_argument('--targets', type=int, default=100, help='Number of targets. Default: 100')
+    parser.add_argument('--nights', type=int, default=7, help='Number of nights. Default: 7')
+    parser.add_argument('--step', type=str, default='15min', help='Step of the ephemerides. Default: 15min')
+    parser.add_argument('--start', type=str, default='2025-08-07', help='First night (YYYY-MM-DD). Default: 2025-08-07')
+    parser.add_argument('--mpc-code', type=str, default='809', help='MPC code of the site. Default: 809')
+    parser.add_argument('--mag-limit', type=float, default=22.0, help='Magnitude limit. Default: 22')
+    parser.add_argument('--elevation-limit', type=float, default=30.0, help='Elevation limit (degrees). Default: 30')
+    parser.add_argument('--time-visible-limit', type=float, default=1.0, help='Time visible limit (hours). Default: 1')
+    parser.add_argument('--workers', type=int, default=8, help='Horizons query workers. Default: 8')
+    parser.add_argument('--jobs', type=int, default=1, help='Chart rendering processes. Default: 1')
+    parser.add_argument('--repeat', type=int, default=3, help='Times each stage is run. Default: 3')
+    parser.add_argument('--stages', type=str, nargs='+', choices=STAGES, default=STAGES,
+                        help='Stages to time (the ephemeris and cuts are run for the later stages). Default: all')
+    parser.add_argument('--server', choices=['synthetic', 'replay'], default='synthetic',
+                        help='Horizons stand-in mode. Default: synthetic')
+    parser.add_argument('--recordings', type=str, default=str(RECORDINGS_DIR),
+                        help='Directory of the recorded responses (replay). Default: benchmarks/recordings')
+    parser.add_argument('--output', type=str, default='benchmark_results.jsonl',
+                        help='Results file, one JSON line per run. Default: benchmark_results.jsonl')
+    args = parser.parse_args()
+
+    params = {key: getattr(args, key) for key in ['targets', 'nights', 'step', 'start', 'mpc_code', 'mag_limit',
+                                                  'elevation_limit', 'time_visible_limit', 'workers', 'jobs',
+                                                  'server']}
+    params['stages'] = [stage for stage in STAGES if stage in args.stages]
+    runs = []
+    with running_server(args.server, args.recordings) as url:
+        # Untimed run first, so the synthetic Sun and Moon and the imports are not counted
+        run_stages(argparse.Namespace(**{**vars(args), 'stages': ['ephemeris']}), url)
+        for i in range(args.repeat):
+            runs.append(run_stages(args, url))
+            print(f'Run {i+1}/{args.repeat}: ' + ', '.join(f'{stage} {seconds:.3f} s'
+                                                           for stage, seconds in runs[-1]['seconds'].items()))
+
+    stages = {}
+    for stage in runs[0]['seconds']:
+        seconds = [run['seconds'][stage] for run in runs]
+        stages[stage] = {'seconds' : seconds,
+                         'min'     : min(seconds),
+                         'median'  : statistics.median(seconds),
+                         'rows'    : runs[0]['rows'].get(stage)}
+    rss    = max_rss_mb()
+    record = {'date'       : datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+              'version'    : version(),
+              'python'     : platform.python_version(),
+              'pandas'     : pd.__version__,
+              'platform'   : platform.platform(),
+              'params'     : params,
+              'stages'     : stages,
+              'max_rss_mb' : round(rss, 1) if rss is not None else None}
+
+    output   = Path(args.output)
+    previous = previous_result(output, params)
+    with open(output, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+    print(f"{'stage':<10} {'rows':>10} {'median (s)':>11} {'min (s)':>9}" + (f" {'previous':>9}" if previous else ''))
+    for stage, result in stages.items():
+        line = f"{stage:<10} {result['rows'] or '':>10} {result['median']:>11.3f} {result['min']:>9.3f}"
+        if previous and stage in previous['stages']:
+            line += f" {previous['stages'][stage]['median']:>9.3f}  ({previous['version']})"
+        print(line)
+    print(f"Peak memory {record['max_rss_mb']} MB, results appended to {output.resolve()}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+Synthetic ephemerides in the layout of JPL Horizons, for benchmarking the pipeline
+without a Horizons connection: as DataFrames (synthetic_ephemeris) and as Horizons API
+text responses (horizons_response), served by horizons_server.py.
+
+Each target is a deterministic function of its name: a position drifting at a fixed
+rate, a magnitude and a phase angle, seen from the site with the Sun and Moon of
+obsfind.almanac. The target '301' is the Moon. Sizes are set by the number of targets,
+the date range and the step of the queries.
+
+    python benchmarks/synthetic.py 10000 --mpc-code 809 --start 2025-08-07 --nights 2  (with pyObsFind installed)
+"""
+import argparse
+import functools
+import zlib
+import numpy as np
+import pandas as pd
+from obsfind import almanac
+from obsfind.sites import get_site, site_latitude
+
+
+MOON_ID = '301'
+COLUMNS = ['datetime_str', 'datetime_jd', 'solar_presence', 'lunar_presence', 'RA', 'DEC', 'airmass', 'magextinct',
+           'V', 'surfbright', 'alpha', 'lunar_elong', 'lunar_illum', 'Sky_motion', 'Sky_mot_PA', 'RelVel-ANG']
+# Horizons column headers of COLUMNS, for quantities 1,8,9,24,25,47 in CSV format with both calendar formats
+HEADERS = ['Date__(UT)__HR:MN', 'Date_________JDUT', '', '', 'R.A._(ICRF)', 'DEC_(ICRF)', 'a-mass', 'mag_ex',
+           'APmag', 'S-brt', 'S-T-O', 'T-O-M', 'MN_Illu%', 'Sky_motion', 'Sky_mot_PA', 'RelVel-ANG']
+EXTINCTION = 0.2  # Extinction coefficient (mag per airmass)
+
+
+def target_parameters(name:str) -> dict:
+    """Random but fixed parameters of a target, seeded by its name."""
+    rng = np.random.default_rng(zlib.crc32(name.encode()))
+    return {'ra'    : rng.uniform(0, 360),        # Position at J2000.0 (degrees)
+            'dec'   : rng.uniform(-40, 40),
+            'rate'  : rng.uniform(0.01, 1.5),     # Sky motion (arcsec/min)
+            'pa'    : rng.uniform(0, 360),        # Position angle of the motion (degrees)
+            'V'     : rng.uniform(14, 23),        # Mean magnitude
+            'alpha' : rng.uniform(2, 30),         # Mean phase angle (degrees)
+            'vel'   : rng.uniform(-20, 20)}       # Radial velocity (km/s)
+
+
+def parse_step(step:str) -> int:
+    """Step of a query in minutes, from a Horizons step such as '15min', '15m' or '1h'."""
+    step = step.strip().strip('"\'').lower()
+    number = int(''.join(c for c in step if c.isdigit()) or 1)
+    return number * 60 if step.rstrip('s').endswith(('h', 'hour')) else number
+
+
+@functools.lru_cache(maxsize=16)
+def sky(mpc_code:str, start:str, stop:str, step_minutes:int) -> dict:
+    """
+    Times of a query and what all targets share at those times: the sidereal time, the
+    altitude of the Sun, and the position, altitude and illumination of the Moon.
+    """
+    site  = get_site(mpc_code)
+    lat   = site_latitude(site)
+    times = pd.date_range(pd.Timestamp(start), pd.Timestamp(stop), freq=f'{step_minutes}min')
+    jd    = almanac.datetime_to_jd(times.to_numpy().astype('datetime64[ns]'))
+    lst   = almanac.local_sidereal_time(jd, site['Longitude'])
+    sun   = almanac.sun_position(jd)
+    moon  = almanac.moon_position(jd)
+    elong = almanac.angle_between(sun, moon)
+    return {'times'      : times,
+            'jd'         : jd,
+            'lst'        : lst,
+            'lat'        : lat,
+            'sun_alt'    : almanac.sun_altitude(jd, site['Longitude'], lat),
+            'moon'       : moon / np.linalg.norm(moon, axis=-1, keepdims=True),
+            'moon_alt'   : altitude(*almanac.radec(moon), lst, lat),
+            'moon_illum' : 50 * (1 - np.cos(np.deg2rad(elong)))}
+
+
+def altitude(ra:np.ndarray, dec:np.ndarray, lst:np.ndarray, lat:float) -> np.ndarray:
+    """Altitude (degrees) of equatorial positions (degrees) at local sidereal times (radians)."""
+    ha, dec, lat = lst - np.deg2rad(ra), np.deg2rad(dec), np.deg2rad(lat)
+    return np.rad2deg(np.arcsin(np.sin(lat)*np.sin(dec) + np.cos(lat)*np.cos(dec)*np.cos(ha)))
+
+
+def synthetic_ephemeris(name:str, mpc_code:str, start:str, stop:str, step_minutes:int=15,
+                        skip_daylight:bool=True) -> pd.DataFrame:
+    """
+    Ephemeris of a synthetic target, with the columns of a Horizons query of
+    obsfind.ephemeris.HORIZONS_QUANTITIES before they are parsed (COLUMNS, times as
+    strings and missing values as 'n.a.').
+
+    Inputs
+        name          : Target name ('301' for the Moon).
+        mpc_code      : MPC code of the site.
+        start, stop   : Time range ('YYYY-MM-DD HH:MM').
+        step_minutes  : Step (default: 15).
+        skip_daylight : Leave out the times when the Sun is up, as Horizons' SKIP_DAYLT.
+
+    Output
+        DataFrame with the ephemeris.
+    """
+    s = sky(mpc_code, start, stop, step_minutes)
+    days = s['jd'] - s['jd'][0]
+    if name == MOON_ID:
+        ra, dec = almanac.radec(s['moon'])
+        params  = {'rate': 0.5, 'pa': 90.0, 'V': -10.0, 'alpha': 90.0, 'vel': 0.0}
+        alpha   = 180 - 1.8 * s['moon_illum']
+        lunar_elong = np.full(len(days), np.nan)
+    else:
+        params  = target_parameters(name)
+        drift   = params['rate'] * 60 * 24 / 3600 * days   # Degrees moved since the start
+        dec     = np.clip(params['dec'] + drift * np.cos(np.deg2rad(params['pa'])), -89, 89)
+        ra      = (params['ra'] + drift * np.sin(np.deg2rad(params['pa'])) / np.cos(np.deg2rad(dec))) % 360
+        alpha   = params['alpha'] + 2 * np.sin(2 * np.pi * days / 30)
+        r, d    = np.deg2rad(ra), np.deg2rad(dec)
+        target  = np.stack([np.cos(d)*np.cos(r), np.cos(d)*np.sin(r), np.sin(d)], axis=-1)
+        lunar_elong = almanac.angle_between(target, s['moon'])
+
+    alt     = altitude(ra, dec, s['lst'], s['lat'])
+    airmass = np.where(alt > 0, 1 / np.sin(np.deg2rad(np.maximum(alt, 1e-3))), np.nan)
+    V       = params['V'] + 0.03 * alpha
+    eph = pd.DataFrame({'datetime_str'   : s['times'].strftime('%Y-%b-%d %H:%M'),
+                        'datetime_jd'    : s['jd'],
+                        'solar_presence' : np.select([s['sun_alt'] > -0.833, s['sun_alt'] > -6, s['sun_alt'] > -12,
+                                                      s['sun_alt'] > -18], ['*', 'C', 'N', 'A'], ''),
+                        'lunar_presence' : np.where(s['moon_alt'] > 0, 'm', ''),
+                        'RA'             : ra,
+                        'DEC'            : dec,
+                        'airmass'        : airmass,
+                        'magextinct'     : EXTINCTION * airmass,
+                        'V'              : V,
+                        'surfbright'     : V + 5,
+                        'alpha'          : alpha,
+                        'lunar_elong'    : lunar_elong,
+                        'lunar_illum'    : s['moon_illum'],
+                        'Sky_motion'     : np.full(len(days), params['rate']),
+                        'Sky_mot_PA'     : np.full(len(days), params['pa']),
+                        'RelVel-ANG'     : np.full(len(days), params['vel'])})
+    if skip_daylight:
+        eph = eph[s['sun_alt'] <= -0.833].reset_index(drop=True)
+    return eph
+
+
+def horizons_text(name:str, eph:pd.DataFrame) -> str:
+    """
+    Formats an ephemeris from synthetic_ephemeris as a Horizons API text response (CSV format).
+    """
+    header = ['*' * 79,
+              f'Target body name: {name} (synthetic)'.ljust(50) + '{source: synthetic}',
+              'Center body name: Earth (399)'.ljust(50) + '{source: synthetic}',
+              '*' * 79]
+    if eph.empty:
+        return '\n'.join(header + [f'    No ephemeris for target "{name}" meets the criteria', '']) + '\n'
+
+    fields = [eph['datetime_str'].to_numpy(), np.char.mod('%.9f', eph['datetime_jd'].to_numpy()),
+              eph['solar_presence'].str.pad(1).to_numpy(), eph['lunar_presence'].str.pad(1).to_numpy()]
+    for col, fmt in [('RA', '%.5f'), ('DEC', '%.5f'), ('airmass', '%.3f'), ('magextinct', '%.3f'), ('V', '%.3f'),
+                     ('surfbright', '%.3f'), ('alpha', '%.4f'), ('lunar_elong', '%.1f'), ('lunar_illum', '%.4f'),
+                     ('Sky_motion', '%.7f'), ('Sky_mot_PA', '%.3f'), ('RelVel-ANG', '%.7f')]:
+        values = eph[col].to_numpy(dtype=float)
+        fields.append(np.where(np.isnan(values), 'n.a.', np.char.mod(fmt, np.nan_to_num(values))))
+    rows = [' ' + ', '.join(row) + ',' for row in zip(*fields)]
+
+    return '\n'.join(header
+                     + [' ' + ', '.join(HEADERS) + ',', '*' * 79, '$$SOE']
+                     + rows
+                     + ['$$EOE', '*' * 79, '']) + '\n'
+
+
+def query_target(command:str) -> str:
+    """Target name of a Horizons COMMAND parameter (e.g. '"DES=2000001;"' or '"Ceres;"')."""
+    command = command.strip().strip('"\'').split(';')[0].strip()
+    return command.split('=', 1)[1] if '=' in command else command
+
+
+def horizons_response(params:dict) -> str:
+    """
+    Horizons API text response of a synthetic target to the parameters of a query, as sent
+    by astroquery (COMMAND, CENTER, START_TIME, STOP_TIME, STEP_SIZE and SKIP_DAYLT). The
+    quantities are always those of obsfind.ephemeris.HORIZONS_QUANTITIES.
+    """
+    unquote = lambda value: value.strip().strip('"\'')
+    name = query_target(params['COMMAND'])
+    eph  = synthetic_ephemeris(name, unquote(params['CENTER']).split('@')[0], unquote(params['START_TIME']),
+                               unquote(params['STOP_TIME']), parse_step(params['STEP_SIZE']),
+                               params.get('SKIP_DAYLT', 'NO') == 'YES')
+    return horizons_text(name, eph)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print the Horizons response of a synthetic target')
+    parser.add_argument('target', type=str, help=f'Target name ({MOON_ID} for the Moon)')
+    parser.add_argument('--mpc-code', type=str, default='809', help='MPC code of the site. Default: 809')
+    parser.add_argument('--start', type=str, default='2025-08-07', help='First night (YYYY-MM-DD). Default: 2025-08-07')
+    parser.add_argument('--nights', type=int, default=1, help='Number of nights. Default: 1')
+    parser.add_argument('--step', type=str, default='15min', help='Step (e.g. 15min, 1h). Default: 15min')
+    args = parser.parse_args()
+
+    start = pd.Timestamp(args.start) + pd.Timedelta(hours=12)
+    stop  = start + pd.Timedelta(days=args.nights)
+    print(horizons_text(args.target, synthetic_ephemeris(args.target, args.mpc_code, start.strftime('%Y-%m-%d %H:%M'),
+                                                         stop.strftime('%Y-%m-%d %H:%M'), parse_step(args.step))))
+
+if __name__ == '__main__':
+    main()
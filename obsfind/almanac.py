@@ -0,0 +1,297 @@
+import numpy as np
+
+
+# Constants
+J2000        = 2451545.0          # Julian date of J2000.0
+AU_KM        = 149597870.7        # Astronomical unit (km)
+EARTH_RADIUS = 6378.137           # Earth equatorial radius (km)
+C_AU_DAY     = 173.1446326846693  # Speed of light (au/day)
+OBLIQUITY    = 23.4392911         # Obliquity of the ecliptic at J2000.0 (degrees)
+
+
+def datetime_to_jd(times) -> np.ndarray:
+    """
+    Converts datetimes to Julian dates.
+
+    Inputs
+        times : Array-like of datetimes (anything numpy can convert to datetime64).
+
+    Output
+        Array of Julian dates.
+    """
+    times = np.asarray(times, dtype='datetime64[ns]')
+    return (times - np.datetime64('2000-01-01T12:00:00', 'ns')) / np.timedelta64(1, 'D') + J2000
+
+
+def ecliptic_to_equatorial(xyz:np.ndarray, obliquity:float=OBLIQUITY) -> np.ndarray:
+    """
+    Rotates ecliptic cartesian coordinates (..., 3) to equatorial coordinates.
+    """
+    eps = np.deg2rad(obliquity)
+    x, y, z = xyz[..., 0], xyz[..., 1], xyz[..., 2]
+    return np.stack([x,
+                     y*np.cos(eps) - z*np.sin(eps),
+                     y*np.sin(eps) + z*np.cos(eps)], axis=-1)
+
+
+def precession_matrix(jd:np.ndarray) -> np.ndarray:
+    """
+    IAU 1976 precession matrices from the J2000.0 equator and equinox to the mean
+    equator and equinox of date.
+
+    Inputs
+        jd : Array of Julian dates.
+
+    Output
+        Array (..., 3, 3) of rotation matrices.
+    """
+    T = (np.asarray(jd, dtype=float) - J2000) / 36525
+    arcsec = np.pi / (180*3600)
+    zeta  = (2306.2181*T + 0.30188*T**2 + 0.017998*T**3) * arcsec
+    z     = (2306.2181*T + 1.09468*T**2 + 0.018203*T**3) * arcsec
+    theta = (2004.3109*T - 0.42665*T**2 - 0.041833*T**3) * arcsec
+    cz, sz, cZ, sZ, ct, st = np.cos(zeta), np.sin(zeta), np.cos(z), np.sin(z), np.cos(theta), np.sin(theta)
+    return np.stack([np.stack([ cZ*ct*cz - sZ*sz, -cZ*ct*sz - sZ*cz, -cZ*st], axis=-1),
+                     np.stack([ sZ*ct*cz + cZ*sz, -sZ*ct*sz + cZ*cz, -sZ*st], axis=-1),
+                     np.stack([ st*cz,            -st*sz,             ct    ], axis=-1)], axis=-2)
+
+
+def to_date(xyz:np.ndarray, jd:np.ndarray) -> np.ndarray:
+    """
+    Precesses J2000.0 equatorial vectors (..., T, 3) to the mean equinox of the dates jd (T,).
+    """
+    return np.einsum('...ij,...j->...i', precession_matrix(jd), xyz)
+
+
+def to_j2000(xyz:np.ndarray, jd:np.ndarray) -> np.ndarray:
+    """
+    Precesses equatorial vectors (..., T, 3) of the mean equinox of the dates jd (T,) to J2000.0.
+    """
+    return np.einsum('...ji,...j->...i', precession_matrix(jd), xyz)
+
+
+def sun_position(jd:np.ndarray) -> np.ndarray:
+    """
+    Geocentric J2000.0 equatorial position of the Sun, from the low precision formulae of
+    the Astronomical Almanac (about 0.01 degrees between 1950 and 2050).
+
+    Inputs
+        jd : Array of Julian dates.
+
+    Output
+        Array (..., 3) with the position of the Sun in au.
+    """
+    n = np.asarray(jd) - J2000
+    L = np.deg2rad(280.460 + 0.9856474*n)
+    g = np.deg2rad(357.528 + 0.9856003*n)
+    lam = L + np.deg2rad(1.915*np.sin(g) + 0.020*np.sin(2*g))
+    R   = 1.00014 - 0.01671*np.cos(g) - 0.00014*np.cos(2*g)
+    eps = OBLIQUITY - 0.0000004*n
+    ecl = np.stack([R*np.cos(lam), R*np.sin(lam), np.zeros_like(lam)], axis=-1)
+    return to_j2000(ecliptic_to_equatorial(ecl, eps), jd)
+
+
+def moon_position(jd:np.ndarray) -> np.ndarray:
+    """
+    Geocentric J2000.0 equatorial position of the Moon, from the low precision formulae of
+    the Astronomical Almanac (about 0.3 degrees).
+
+    Inputs
+        jd : Array of Julian dates.
+
+    Output
+        Array (..., 3) with the position of the Moon in au.
+    """
+    T = (np.asarray(jd) - J2000) / 36525
+    d = lambda a, b: np.deg2rad(a + b*T)
+    lam = np.deg2rad(218.32 + 481267.881*T
+                     + 6.29*np.sin(d(135.0, 477198.87)) - 1.27*np.sin(d(259.3, -413335.36))
+                     + 0.66*np.sin(d(235.7, 890534.22)) + 0.21*np.sin(d(269.9, 954397.74))
+                     - 0.19*np.sin(d(357.5, 35999.05))  - 0.11*np.sin(d(186.5, 966404.03)))
+    bet = np.deg2rad(5.13*np.sin(d(93.3, 483202.02)) + 0.28*np.sin(d(228.2, 960400.89))
+                     - 0.28*np.sin(d(318.3, 6003.15)) - 0.17*np.sin(d(217.6, -407332.21)))
+    par = np.deg2rad(0.9508 + 0.0518*np.cos(d(134.9, 477198.85)) + 0.0095*np.cos(d(259.2, -413335.38))
+                     + 0.0078*np.cos(d(235.7, 890534.23)) + 0.0028*np.cos(d(269.9, 954397.70)))
+    dist = EARTH_RADIUS / AU_KM / np.sin(par)
+    ecl = np.stack([dist*np.cos(bet)*np.cos(lam), dist*np.cos(bet)*np.sin(lam), dist*np.sin(bet)], axis=-1)
+    eps = OBLIQUITY - 0.0130042*T
+    return to_j2000(ecliptic_to_equatorial(ecl, eps), jd)
+
+
+def local_sidereal_time(jd:np.ndarray, lon:float) -> np.ndarray:
+    """
+    Local mean sidereal time, taking UT1 = UTC.
+
+    Inputs
+        jd  : Array of Julian dates (UT).
+        lon : East longitude of the site (degrees).
+
+    Output
+        Array of local sidereal times (radians).
+    """
+    gmst = 280.46061837 + 360.98564736629*(np.asarray(jd) - J2000)
+    return np.deg2rad(np.mod(gmst + lon, 360))
+
+
+def observer_position(jd:np.ndarray, lon:float, rho_cos_phi:float, rho_sin_phi:float) -> np.ndarray:
+    """
+    Geocentric J2000.0 equatorial position of an observatory, from its MPC parallax constants.
+
+    Inputs
+        jd          : Array of Julian dates (UT).
+        lon         : East longitude of the site (degrees).
+        rho_cos_phi : MPC parallax constant rho*cos(phi').
+        rho_sin_phi : MPC parallax constant rho*sin(phi').
+
+    Output
+        Array (..., 3) with the position of the observatory in au.
+    """
+    lst = local_sidereal_time(jd, lon)
+    r   = EARTH_RADIUS / AU_KM
+    xyz = np.stack([r*rho_cos_phi*np.cos(lst), r*rho_cos_phi*np.sin(lst),
+                    np.full_like(lst, r*rho_sin_phi)], axis=-1)
+    return to_j2000(xyz, jd)
+
+
+def radec(xyz:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Right ascension and declination (degrees) of equatorial cartesian vectors (..., 3).
+    """
+    x, y, z = xyz[..., 0], xyz[..., 1], xyz[..., 2]
+    ra  = np.rad2deg(np.arctan2(y, x)) % 360
+    dec = np.rad2deg(np.arctan2(z, np.hypot(x, y)))
+    return ra, dec
+
+
+def altitude(xyz:np.ndarray, jd:np.ndarray, lst:np.ndarray, lat:float) -> np.ndarray:
+    """
+    Altitude above the horizon (degrees) of topocentric J2000.0 equatorial vectors (..., T, 3).
+
+    Inputs
+        xyz : Topocentric equatorial vectors.
+        jd  : Array (T,) of Julian dates (UT).
+        lst : Array (T,) of local sidereal times (radians).
+        lat : Latitude of the site (degrees).
+    """
+    ra, dec = radec(to_date(xyz, jd))
+    ha  = lst - np.deg2rad(ra)
+    dec = np.deg2rad(dec)
+    lat = np.deg2rad(lat)
+    return np.rad2deg(np.arcsin(np.sin(lat)*np.sin(dec) + np.cos(lat)*np.cos(dec)*np.cos(ha)))
+
+
+def angle_between(u:np.ndarray, v:np.ndarray) -> np.ndarray:
+    """
+    Angle (degrees) between two arrays of vectors (..., 3).
+    """
+    cross = np.linalg.norm(np.cross(u, v), axis=-1)
+    dot   = np.sum(u*v, axis=-1)
+    return np.rad2deg(np.arctan2(cross, dot))
+
+
+def sun_altitude(jd:np.ndarray, lon:float, lat:float) -> np.ndarray:
+    """
+    Geometric altitude (degrees) of the centre of the Sun, ignoring the solar parallax.
+
+    Inputs
+        jd  : Array of Julian dates (UT).
+        lon : East longitude of the site (degrees).
+        lat : Latitude of the site (degrees).
+    """
+    jd    = np.asarray(jd, dtype=float)
+    flat  = jd.ravel()
+    alt   = altitude(sun_position(flat), flat, local_sidereal_time(flat, lon), lat)
+    return alt.reshape(jd.shape)
+
+
+def refraction(apparent_alt, pressure:float=1010, temperature:float=15) -> np.ndarray:
+    """
+    Atmospheric refraction (degrees) at low apparent altitudes, from the formula used by
+    pyephem below 15 degrees, which vanishes about 8 degrees below the horizon.
+
+    Inputs
+        apparent_alt : Apparent altitude (degrees).
+        pressure     : Atmospheric pressure (mbar, default: 1010).
+        temperature  : Temperature (C, default: 15).
+    """
+    a = np.asarray(apparent_alt, dtype=float)
+    r = (0.1594 + 0.0196*a + 0.00002*a**2)*pressure / ((1 + 0.505*a + 0.0845*a**2)*(273 + temperature))
+    return np.maximum(r, 0)
+
+
+def sun_semidiameter(jd:np.ndarray) -> np.ndarray:
+    """
+    Apparent semidiameter of the Sun (degrees).
+    """
+    return 959.63/3600 / np.linalg.norm(sun_position(jd), axis=-1)
+
+
+def sun_altitude_grid(jd_start:np.ndarray, lon:float, lat:float, span:float=2.0,
+                      step:float=10/1440) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Samples the altitude of the Sun on a regular grid after each start date, to search
+    for crossings with sun_crossings.
+
+    Inputs
+        jd_start : Array (N,) of Julian dates (UT) to start each grid from.
+        lon      : East longitude of the site (degrees).
+        lat      : Latitude of the site (degrees).
+        span     : Length of the grid (days, default: 2).
+        step     : Grid step (days, default: 10 minutes).
+
+    Output
+        Arrays (N, M) of Julian dates and altitudes of the Sun (degrees).
+    """
+    grid = np.asarray(jd_start, dtype=float)[:, None] + np.arange(0, span + step/2, step)[None, :]
+    return grid, sun_altitude(grid, lon, lat)
+
+
+def sun_crossings(grid:np.ndarray, alt:np.ndarray, lon:float, lat:float, horizon, rising:bool,
+                  after:np.ndarray=None, span:float=1.0, iterations:int=4) -> np.ndarray:
+    """
+    First time that the centre of the Sun crosses an altitude, for all rows of a grid
+    from sun_altitude_grid at once. The first bracketed crossing on the grid is refined
+    by regula falsi (well below a second after a few iterations). Crossings in the same
+    direction are at least 20 minutes apart, longer than the grid step, so none is missed.
+
+    Inputs
+        grid       : Array (N, M) of Julian dates.
+        alt        : Array (N, M) of altitudes of the Sun on the grid (degrees).
+        lon        : East longitude of the site (degrees).
+        lat        : Latitude of the site (degrees).
+        horizon    : Altitude of the crossing (degrees), a scalar or an array (N,).
+        rising     : True for the Sun rising above the altitude, False for setting below it.
+        after      : Array (N,) of Julian dates to search from (default: start of the grid).
+        span       : Length of the search window (days, default: 1).
+        iterations : Number of refinement iterations (default: 4).
+
+    Output
+        Array (N,) of Julian dates of the crossings, NaN where there is none in the window.
+    """
+    horizon = np.broadcast_to(np.asarray(horizon, dtype=float), grid.shape[:1])
+    after   = grid[:, 0] if after is None else np.asarray(after, dtype=float)
+    diff    = alt - horizon[:, None]
+
+    if rising:
+        cross = (diff[:, :-1] < 0) & (diff[:, 1:] >= 0)
+    else:
+        cross = (diff[:, :-1] >= 0) & (diff[:, 1:] < 0)
+    with np.errstate(invalid='ignore'):  # NaN search starts
+        cross &= (grid[:, 1:] > after[:, None]) & (grid[:, :-1] < after[:, None] + span)
+    found = cross.any(axis=1)
+    k     = cross.argmax(axis=1)
+    rows  = np.arange(len(grid))
+
+    t0, t1 = grid[rows, k], grid[rows, k+1]
+    a0, a1 = diff[rows, k], diff[rows, k+1]
+    with np.errstate(divide='ignore', invalid='ignore'):  # Rows without a crossing
+        for _ in range(iterations):
+            t = t0 - a0*(t1 - t0)/(a1 - a0)
+            a = sun_altitude(t, lon, lat) - horizon
+            # Keep the crossing bracketed
+            left = np.sign(a) == np.sign(a0)
+            t0, a0 = np.where(left, t, t0), np.where(left, a, a0)
+            t1, a1 = np.where(left, t1, t), np.where(left, a1, a)
+        t = t0 - a0*(t1 - t0)/(a1 - a0)
+
+    return np.where(found, t, np.nan)
@@ -0,0 +1,332 @@
+import argparse
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+import pandas as pd
+from .outfmt import logger, console, error_exit
+
+
+# Configure default cache parameters
+DEFAULT_CACHE_DIR    = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'obsfind'
+DEFAULT_MAX_BYTES    = 1024**3  # Size limit before least recently used entries are evicted
+DEFAULT_MAX_AGE_DAYS = 30       # Entries older than this are fetched again (orbit solutions change)
+
+# Start of the error astroquery raises when Horizons has no ephemeris in the range (nothing visible)
+NO_EPHEMERIS = 'Horizons Error: No ephemeris for target'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key         TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    target      TEXT NOT NULL,
+    mpc_code    TEXT NOT NULL,
+    step        TEXT NOT NULL,
+    quantities  TEXT NOT NULL,
+    start       TEXT NOT NULL,
+    stop        TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    created     REAL NOT NULL,
+    last_access REAL NOT NULL,
+    data        BLOB NOT NULL
+)
+'''
+
+
+class EphemerisCache:
+    """
+    Persistent on-disk cache of Horizons ephemerides, stored in a SQLite database so
+    that several processes can share it safely.
+
+    Entries are keyed by kind ('obj' or 'moon'), target, MPC code, step and quantities,
+    and remember the time range they cover. A query for a longer range only fetches
+    the missing sub-ranges and stitches them onto the cached data, as long as they fall
+    on the time grid of the cached rows. Ranges where nothing is visible are cached as
+    empty ephemerides, so they are not queried again until the entry expires. The least
+    recently used entries are evicted once the cache grows over max_bytes.
+    """
+
+    def __init__(self, cache_dir:Path=None, max_bytes:int=DEFAULT_MAX_BYTES, max_age_days:float=DEFAULT_MAX_AGE_DAYS):
+        self.path         = Path(cache_dir or DEFAULT_CACHE_DIR) / 'ephemeris.sqlite'
+        self.max_bytes    = max_bytes
+        self.max_age_days = max_age_days
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._transaction() as con:
+            con.execute(SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        # One connection per transaction, so the cache can be used from several threads
+        con = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                yield con
+                con.execute('COMMIT')
+            except BaseException:
+                con.execute('ROLLBACK')
+                raise
+        finally:
+            con.close()
+
+    @staticmethod
+    def make_key(kind:str, target:str, mpc_code:str, step:str, quantities:str) -> str:
+        return hashlib.sha1('|'.join([kind, target, mpc_code, step, quantities]).encode()).hexdigest()
+
+    def _read(self, key:str):
+        with self._transaction() as con:
+            row = con.execute('SELECT start, stop, created, data FROM entries WHERE key=?', (key,)).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[2] > self.max_age_days * 86400:
+                con.execute('DELETE FROM entries WHERE key=?', (key,))
+                return None
+            con.execute('UPDATE entries SET last_access=? WHERE key=?', (time.time(), key))
+        return pd.Timestamp(row[0]), pd.Timestamp(row[1]), row[2], pickle.loads(row[3])
+
+    def _write(self, key:str, meta:tuple, start:pd.Timestamp, stop:pd.Timestamp, eph:pd.DataFrame, created:float=None):
+        blob = pickle.dumps(eph, protocol=pickle.HIGHEST_PROTOCOL)
+        now  = time.time()
+        with self._transaction() as con:
+            con.execute('INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?,?,?,?,?,?,?)',
+                        (key, *meta, start.isoformat(), stop.isoformat(), len(blob), created or now, now, blob))
+            self._evict(con, self.max_bytes)
+
+    @staticmethod
+    def _evict(con:sqlite3.Connection, max_bytes:int) -> int:
+        # Delete least recently used entries until the total size is below max_bytes
+        total = con.execute('SELECT COALESCE(SUM(size),0) FROM entries').fetchone()[0]
+        removed = 0
+        for key, size in con.execute('SELECT key, size FROM entries ORDER BY last_access').fetchall():
+            if total <= max_bytes:
+                break
+            con.execute('DELETE FROM entries WHERE key=?', (key,))
+            total   -= size
+            removed += 1
+        return removed
+
+    def fetch(self, kind:str, target:str, mpc_code:str, epochs:dict, quantities:str, query) -> pd.DataFrame:
+        """
+        Returns the ephemeris of a target for the epochs range, querying only the parts
+        of the range that are not in the cache.
+
+        Inputs
+            kind       : 'obj' or 'moon'.
+            target     : Name of the target.
+            mpc_code   : MPC code for the observatory.
+            epochs     : Dictionary with 'start', 'stop', and 'step' keys for the time range.
+            quantities : Horizons quantities of the query.
+            query      : Function taking an epochs dictionary and returning the ephemeris
+                         DataFrame for that range. A ValueError starting with NO_EPHEMERIS
+                         means nothing is visible, other errors are passed on and nothing
+                         is cached.
+
+        Output
+            DataFrame with ephemerides for the target in the epochs range (empty if
+            nothing is visible).
+        """
+        meta  = (kind, target, mpc_code, epochs['step'], quantities)
+        key   = self.make_key(*meta)
+        start = pd.Timestamp(epochs['start'])
+        stop  = pd.Timestamp(epochs['stop'])
+
+        entry = self._read(key)
+        if entry is not None:
+            # The range after the cached rows is queried from the cached stop
+            starts = [start, entry[1]] if stop > entry[1] else [start]
+        # Nothing usable in cache (a disjoint range, or one on another time grid): query and replace
+        if entry is None or stop < entry[0] or start > entry[1] or not self._on_grid(epochs['step'], entry[0], *starts):
+            eph = self._query(query, epochs)
+            self._write(key, meta, start, stop, eph)
+            return eph
+
+        cache_start, cache_stop, created, eph = entry
+        pieces = [eph]
+        if start < cache_start:
+            pieces.append(self._query_range(query, epochs, start, cache_start))
+        if stop > cache_stop:
+            pieces.append(self._query_range(query, epochs, cache_stop, stop))
+        pieces = [p for p in pieces if not p.empty]
+
+        if len(pieces) > 1 or start < cache_start or stop > cache_stop:
+            logger.debug(f'Extending cached ephemeris of {target}')
+            if pieces:
+                eph = (pd.concat(pieces)
+                       .drop_duplicates(subset='datetime_str')
+                       .sort_values(by='datetime_str')
+                       .reset_index(drop=True))
+            self._write(key, meta, min(start, cache_start), max(stop, cache_stop), eph, created)
+        else:
+            logger.debug(f'Using cached ephemeris of {target}')
+
+        if eph.empty:
+            return eph
+        mask = (eph['datetime_str'] >= start) & (eph['datetime_str'] <= stop)
+        return eph[mask].reset_index(drop=True)
+
+    @staticmethod
+    def _on_grid(step:str, origin:pd.Timestamp, *times:pd.Timestamp) -> bool:
+        # Horizons epochs start at the query start, so queries starting at times are on the
+        # grid of the cached rows (starting at origin) only a whole number of steps from it
+        try:
+            step = pd.Timedelta(step)
+        except ValueError:
+            return False
+        return all((t - origin) % step == pd.Timedelta(0) for t in times)
+
+    @staticmethod
+    def _query_range(query, epochs:dict, start:pd.Timestamp, stop:pd.Timestamp) -> pd.DataFrame:
+        # Ranges overlap the cached range by one step, duplicates are dropped when stitching
+        sub_epochs = {'start' : start.strftime('%Y-%m-%d %H:%M'),
+                      'stop'  : stop.strftime('%Y-%m-%d %H:%M'),
+                      'step'  : epochs['step']}
+        return EphemerisCache._query(query, sub_epochs)
+
+    @staticmethod
+    def _query(query, epochs:dict) -> pd.DataFrame:
+        try:
+            return query(epochs)
+        except ValueError as err:
+            # Nothing visible in the range, any other error is passed on
+            if not str(err).startswith(NO_EPHEMERIS):
+                raise
+            return pd.DataFrame()
+
+    def stats(self) -> dict:
+        """
+        Summary of the cache contents.
+
+        Output
+            Dictionary with the number of entries, total size and per-site entry counts.
+        """
+        with self._transaction() as con:
+            n, size, oldest, newest = con.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size),0), MIN(last_access), MAX(last_access) FROM entries').fetchone()
+            sites = dict(con.execute('SELECT mpc_code, COUNT(*) FROM entries GROUP BY mpc_code').fetchall())
+        return {'path'        : str(self.path),
+                'entries'     : n,
+                'size_bytes'  : size,
+                'max_bytes'   : self.max_bytes,
+                'sites'       : sites,
+                'oldest_access': oldest,
+                'newest_access': newest}
+
+    def prune(self, max_bytes:int=None, older_than_days:float=None, target:str=None) -> int:
+        """
+        Removes entries from the cache.
+
+        Inputs
+            max_bytes       : Evict least recently used entries until the cache is below this size.
+            older_than_days : Remove entries not used in this many days.
+            target          : Remove all entries for this target.
+
+        Output
+            Number of entries removed.
+        """
+        removed = 0
+        with self._transaction() as con:
+            if target is not None:
+                removed += con.execute('DELETE FROM entries WHERE target=?', (target,)).rowcount
+            if older_than_days is not None:
+                cutoff = time.time() - older_than_days * 86400
+                removed += con.execute('DELETE FROM entries WHERE last_access<?', (cutoff,)).rowcount
+            if max_bytes is not None:
+                removed += self._evict(con, max_bytes)
+        return removed
+
+    def clear(self) -> int:
+        """Removes all entries, returning the number removed."""
+        with self._transaction() as con:
+            return con.execute('DELETE FROM entries').rowcount
+
+
+def parse_args() -> argparse.Namespace:
+    '''
+    Parse command line arguments for the cache management script.
+
+    Returns:
+        Parsed command line arguments.
+    '''
+    parser = argparse.ArgumentParser(description='Manage the pyObsFind ephemeris cache')
+    parser.add_argument('--cache-dir', type=Path,
+                        help=f'Cache directory. Default: {DEFAULT_CACHE_DIR}')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('stats', help='Show cache statistics')
+    sub.add_parser('clear', help='Remove all cache entries')
+
+    prune = sub.add_parser('prune', help='Remove cache entries')
+    prune.add_argument('--max-size', type=float,
+                       help='Evict least recently used entries until the cache is below this size [MB]')
+    prune.add_argument('--older-than', type=float,
+                       help='Remove entries not used in this many days')
+    prune.add_argument('--target', type=str,
+                       help='Remove all entries for this target')
+
+    warm = sub.add_parser('warm', help='Fetch the ephemerides of a target list into the cache')
+    warm.add_argument('target_file', type=Path, help='Path to the target file')
+    warm.add_argument('start_date', type=str, help='Initial date (YYYY-MM-DD)')
+    warm.add_argument('end_date', type=str, help='Final date (YYYY-MM-DD, inclusive)')
+    warm.add_argument('-mpc', '--mpc-code', type=str, default='809',
+                      help='Location for observation site: default = 809')
+    warm.add_argument('-w', '--workers', type=int, default=1,
+                      help='Number of concurrent Horizons queries. Default: 1')
+    warm.add_argument('--horizons-url', type=str,
+                      help='URL to send Horizons API queries to instead of JPL')
+    warm.add_argument('--sbdb-url', type=str,
+                      help='URL to look target names up at instead of the JPL SBDB API')
+    warm.add_argument('--step', type=str, default='15min',
+                      help='Ephemeris step, as passed to the main script (e.g. 15min, 60min). Default: 15min')
+
+    return parser.parse_args()
+
+
+def main():
+    args  = parse_args()
+    cache = EphemerisCache(args.cache_dir)
+
+    if args.command == 'stats':
+        stats = cache.stats()
+        console.print(f"Cache: {stats['path']}")
+        console.print(f"Entries: {stats['entries']}")
+        console.print(f"Size: {stats['size_bytes']/1024**2:.1f} / {stats['max_bytes']/1024**2:.0f} MB")
+        for site, n in sorted(stats['sites'].items()):
+            console.print(f"  {site}: {n} entries")
+
+    elif args.command == 'clear':
+        logger.info(f'Removed {cache.clear()} entries')
+
+    elif args.command == 'prune':
+        max_bytes = int(args.max_size * 1024**2) if args.max_size is not None else None
+        if max_bytes is None and args.older_than is None and args.target is None:
+            error_exit('Nothing to prune: use --max-size, --older-than or --target')
+        logger.info(f'Removed {cache.prune(max_bytes, args.older_than, args.target)} entries')
+
+    elif args.command == 'warm':
+        from astropy.time import Time
+        from .read_inputs import read_target_list, create_date_list, parse_step
+        from .ephemeris import horizons_epochs, fetch_ephemerides
+        from .names import name_index
+        if not args.target_file.is_file():
+            error_exit(f'Cannot find {args.target_file}')
+        try:
+            # Entries are keyed by the step as the main script normalises it (e.g. 1h is 60min)
+            step = parse_step(args.step)
+        except ValueError as err:
+            error_exit(f'--step {err}')
+        target_list = read_target_list(args.target_file)
+        date_list   = create_date_list(Time(args.start_date, format='iso'), Time(args.end_date, format='iso'))
+        epochs      = horizons_epochs(date_list[0].to_datetime(), date_list[-1].to_datetime(), step)
+        fetch_ephemerides(target_list, args.mpc_code, epochs, workers=args.workers,
+                          horizons_url=args.horizons_url, cache=cache,
+                          names=name_index(args.cache_dir, args.horizons_url, args.sbdb_url))
+        logger.info(f'Cache warmed for {len(target_list)} targets from {args.mpc_code}')
+
+    return
+
+if __name__ == '__main__':
+    main()
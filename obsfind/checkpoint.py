@@ -0,0 +1,138 @@
+import json
+import os
+import pickle
+from pathlib import Path
+from .outfmt import logger
+
+
+# Stages of a run, in order. Each but the last saves its output for the later stages
+CHECKPOINT_STAGES  = ['twilight', 'ephemeris', 'cuts', 'summaries', 'render']
+CHECKPOINT_VERSION = 1
+RUN_MANIFEST       = 'manifest.json'
+
+
+class RunCheckpoints:
+    """
+    Checkpoints of the stages of a run in a run directory, so that a run can be resumed
+    from its last completed stage, or run again from any stage, without computing the
+    earlier stages again. The output of each stage (by site) is pickled, which keeps the
+    DataFrame types, and the manifest records the inputs of the run and the stages
+    completed.
+
+    Checkpoints made with other inputs (settings, targets or dates) are not used. Saving a
+    stage drops the later stages from the completed ones, as they no longer follow from it.
+
+    Inputs
+        run_dir : Directory of the checkpoints.
+        inputs  : Inputs of the run that the stage outputs depend on (JSON serializable).
+    """
+
+    def __init__(self, run_dir:Path, inputs:dict):
+        self.run_dir   = Path(run_dir)
+        self.inputs    = json.loads(json.dumps(inputs))
+        self.completed = []
+        self.reusable  = False
+        manifest = self._read_manifest()
+        if manifest is not None:
+            self.reusable = manifest.get('version') == CHECKPOINT_VERSION and manifest.get('inputs') == self.inputs
+            if self.reusable:
+                self.completed = [stage for stage in manifest['completed'] if stage in CHECKPOINT_STAGES]
+            else:
+                logger.warning(f'Checkpoints in {self.run_dir} were made with other inputs, they will be replaced')
+
+    def _read_manifest(self) -> dict:
+        path = self.run_dir / RUN_MANIFEST
+        if not path.is_file():
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as err:
+            logger.warning(f'Cannot read {path} ({err}), ignoring the checkpoints')
+            return None
+
+    def _write_manifest(self):
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        manifest = {'version'   : CHECKPOINT_VERSION,
+                    'inputs'    : self.inputs,
+                    'completed' : self.completed}
+        tmp_path = self.run_dir / f'{RUN_MANIFEST}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, self.run_dir / RUN_MANIFEST)
+
+    def path(self, stage:str) -> Path:
+        """Path of the checkpoint of a stage."""
+        return self.run_dir / f'{stage}.pkl'
+
+    def resume_stage(self) -> str:
+        """Stage after the last completed one (None if the run is complete)."""
+        if not self.completed:
+            return CHECKPOINT_STAGES[0]
+        last = max(CHECKPOINT_STAGES.index(stage) for stage in self.completed)
+        return CHECKPOINT_STAGES[last+1] if last+1 < len(CHECKPOINT_STAGES) else None
+
+    def has(self, stage:str) -> bool:
+        """True if the stage was completed with the same inputs and its checkpoint exists."""
+        return stage in self.completed and (stage == 'render' or self.path(stage).is_file())
+
+    def load(self, stage:str):
+        """Output of a completed stage."""
+        with open(self.path(stage), 'rb') as f:
+            data = pickle.load(f)
+        logger.info(f'Loaded the {stage} stage from {self.path(stage)}')
+        return data
+
+    def save(self, stage:str, data=None):
+        """
+        Marks a stage as completed, saving its output (written to a temporary file first, so
+        an interrupted save leaves the previous checkpoint).
+        """
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        if data is not None:
+            tmp_path = self.path(stage).with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path(stage))
+        index = CHECKPOINT_STAGES.index(stage)
+        self.completed = [s for s in CHECKPOINT_STAGES[:index] if s in self.completed] + [stage]
+        self._write_manifest()
+        logger.debug(f'Checkpoint of the {stage} stage saved to {self.run_dir}')
+
+
+def required_checkpoints(stage:str) -> list[str]:
+    """Stages whose checkpoints a stage starts from: the stage before it, and the cuts for render."""
+    index = CHECKPOINT_STAGES.index(stage)
+    if index == 0:
+        return []
+    return [CHECKPOINT_STAGES[index-1], 'cuts'] if stage == 'render' else [CHECKPOINT_STAGES[index-1]]
+
+
+def start_stage(checkpoints:RunCheckpoints, resume:bool, from_stage:str) -> str:
+    """
+    Stage a run starts from: from_stage, the stage after the last completed one with
+    resume, or the first stage. With --stream the cuts are made as the ephemerides arrive,
+    so there is no raw ephemeris checkpoint to start the cuts from.
+
+    Inputs
+        checkpoints : RunCheckpoints of the run.
+        resume      : Continue from the last completed stage, or from an earlier stage if
+                      the checkpoints it needs are missing.
+        from_stage  : Optional stage to start from, whose checkpoints must exist (ValueError otherwise).
+
+    Output
+        Name of the stage (None if resuming a complete run).
+    """
+    if from_stage is not None:
+        missing = [s for s in required_checkpoints(from_stage) if not checkpoints.has(s)]
+        if missing:
+            raise ValueError(f'Cannot start from the {from_stage} stage: no checkpoint of the {missing[0]} stage '
+                             f'in {checkpoints.run_dir} for these inputs')
+        return from_stage
+    if not resume:
+        return CHECKPOINT_STAGES[0]
+
+    stage = checkpoints.resume_stage()
+    while stage is not None and not all(checkpoints.has(s) for s in required_checkpoints(stage)):
+        stage = CHECKPOINT_STAGES[CHECKPOINT_STAGES.index(stage)-1]
+    return stage
@@ -0,0 +1,279 @@
+import numpy as np
+import pandas as pd
+from . import almanac
+from .outfmt import logger
+from .read_inputs import DEFAULT_MAG_LIMIT, DEFAULT_ELEVATION_LIMIT, DEFAULT_TIME_VISIBLE
+
+
+# Window constraints: setting -> (ephemeris quantity, sign of the margin, applies to the moon).
+# The margin (quantity - limit)*sign is positive while the constraint is met.
+WINDOW_CONSTRAINTS = {
+    'elevation_limit' : ('elevation',   +1, True),   # Minimum elevation (degrees)
+    'min_moon_sep'    : ('lunar_elong', +1, False),  # Minimum separation from the moon (degrees)
+    'max_sky_motion'  : ('Sky_motion',  -1, False),  # Maximum rate of motion (arcsec/min)
+    'max_hour_angle'  : ('hour_angle',  -1, False),  # Maximum absolute hour angle (hours)
+}
+EXEMPT = 1e9  # Margin of a constraint that does not apply to a row (the moon); missing values get -EXEMPT
+
+
+class Constraints:
+    """
+    Declarative set of observability constraints, applied to an ephemeris in a single
+    vectorized pass.
+
+    The magnitude limit removes rows. The window constraints (WINDOW_CONSTRAINTS) define
+    when a target is observable: each is a margin that is interpolated linearly between
+    samples, so that its crossings are found to a fraction of the step, and a target is
+    observable where all margins are positive. A (target, night) is kept if it is
+    observable for at least t_vis_limit hours, and for at least min_dark_hours of them
+    between astronomical twilights. The moon is only subject to the magnitude, elevation
+    and time limits, so that it stays on the charts.
+
+    Inputs
+        mag_limit       : Maximum magnitude.
+        elevation_limit : Minimum elevation (degrees).
+        t_vis_limit     : Minimum time observable per night (hours).
+        min_moon_sep    : Optional minimum separation from the moon (degrees).
+        max_sky_motion  : Optional maximum rate of motion on the sky (arcsec/min).
+        max_hour_angle  : Optional maximum absolute hour angle (hours).
+        min_dark_hours  : Optional minimum time observable in astronomical darkness (hours).
+    """
+
+    def __init__(self, mag_limit:float=DEFAULT_MAG_LIMIT, elevation_limit:float=DEFAULT_ELEVATION_LIMIT,
+                 t_vis_limit:float=DEFAULT_TIME_VISIBLE, min_moon_sep:float=None, max_sky_motion:float=None,
+                 max_hour_angle:float=None, min_dark_hours:float=None):
+        self.mag_limit       = mag_limit
+        self.elevation_limit = elevation_limit
+        self.t_vis_limit     = t_vis_limit
+        self.min_moon_sep    = min_moon_sep
+        self.max_sky_motion  = max_sky_motion
+        self.max_hour_angle  = max_hour_angle
+        self.min_dark_hours  = min_dark_hours
+
+    def settings(self) -> dict:
+        """The constraints as a dictionary (JSON serializable)."""
+        return dict(vars(self))
+
+    def __repr__(self):
+        return f"Constraints({', '.join(f'{k}={v}' for k, v in self.settings().items() if v is not None)})"
+
+    def margins(self, eph:pd.DataFrame, longitude:float=None) -> np.ndarray:
+        """
+        Margins of the window constraints for each row.
+
+        Inputs
+            eph       : DataFrame with ephemerides.
+            longitude : East longitude of the site (degrees), needed for the hour angle.
+
+        Output
+            Array (constraints, rows) of margins, positive where the constraint is met.
+        """
+        is_moon = (eph['target'] == 'Moon').to_numpy()
+        margins = []
+        for setting, (quantity, sign, moon) in WINDOW_CONSTRAINTS.items():
+            limit = getattr(self, setting)
+            if limit is None:
+                continue
+            if quantity == 'elevation':
+                # Samples below the horizon have no elevation, take them to be on the horizon
+                values = eph['elevation'].fillna(0).to_numpy()
+            elif quantity == 'hour_angle':
+                if longitude is None:
+                    raise ValueError('The hour angle constraint needs the site longitude')
+                values = np.abs(hour_angle(eph, longitude))
+            elif quantity in eph.columns:
+                values = eph[quantity].to_numpy()
+            else:
+                # The moon's own ephemeris has no lunar elongation or rate of motion
+                values = np.full(len(eph), np.nan)
+            margin = (values - limit) * sign
+            margin = np.where(np.isnan(margin), -EXEMPT, margin)
+            if not moon:
+                margin = np.where(is_moon, EXEMPT, margin)
+            margins.append(margin)
+        return np.stack(margins)
+
+    def observable_hours(self, eph:pd.DataFrame, twilight_times:pd.DataFrame, step:str,
+                         longitude:float=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Hours each target is observable each night. The margins are extrapolated from the
+        first and last samples of the night to sunset and sunrise. Samples more than a step
+        apart (rows removed by the magnitude limit) each count for half a step on the side
+        of the gap.
+
+        Inputs
+            eph            : DataFrame with ephemerides, sorted by target and time, with 'night' column.
+            twilight_times : DataFrame with twilight times for each night.
+            step           : Step of the ephemerides (e.g. '15min').
+            longitude      : East longitude of the site (degrees), needed for the hour angle.
+
+        Output
+            cell       : Index of the (target, night) of each row.
+            hours      : Hours observable, for each (target, night).
+            dark_hours : Hours observable between astronomical twilights, for each (target, night).
+        """
+        step_hours = pd.Timedelta(step) / pd.Timedelta(hours=1)
+        target = eph['target'].cat.codes.to_numpy() if hasattr(eph['target'], 'cat') else pd.factorize(eph['target'])[0]
+        night  = eph['night'].to_numpy()
+        t      = (eph['datetime'] - eph['night']).to_numpy() / np.timedelta64(1, 'h')
+        m      = self.margins(eph, longitude)
+
+        # Twilight times of the night of each row, in hours from the start of the night
+        idx = pd.Index(twilight_times['night']).get_indexer(eph['night'])
+        def since_night(col):
+            return (twilight_times[col].to_numpy(dtype='datetime64[ns]')[idx] - night) / np.timedelta64(1, 'h')
+        t_set, t_rise = since_night('sun_set'), since_night('sun_rise')
+        dark = (since_night('astronomical_set'), since_night('astronomical_rise')) if self.min_dark_hours is not None else None
+
+        # Consecutive samples of the same target and night
+        same = np.zeros(len(eph), dtype=bool)
+        same[:-1] = (target[1:] == target[:-1]) & (night[1:] == night[:-1])
+        dt = np.append(np.diff(t), np.inf)
+        adjacent = same & (dt <= 1.5*step_hours)
+        prev_same     = np.insert(same[:-1], 0, False)
+        prev_adjacent = np.insert(adjacent[:-1], 0, False)
+
+        # Between adjacent samples
+        m_next = np.append(m[:, 1:], np.zeros((len(m), 1), dtype=m.dtype), axis=1)
+        hours, dark_hours = observable_segments(m, m_next, t, np.where(adjacent, dt, 0), dark)
+
+        # Slopes of the segments after and before each sample (flat for isolated samples)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope_next = np.where(adjacent, (m_next - m) / dt, 0)
+        slope_prev = np.insert(slope_next[:, :-1], 0, 0, axis=1)
+
+        # Before the first sample of a run: to sunset, or half a step at a gap
+        left = np.where(prev_same, step_hours/2, np.clip(t - t_set, 0, step_hours))
+        h, d = observable_segments(m - slope_next*left, m, t - left, left, dark)
+        hours += np.where(~prev_adjacent, h, 0)
+        dark_hours += np.where(~prev_adjacent, d, 0)
+
+        # After the last sample of a run: to sunrise, or half a step at a gap
+        right = np.where(same, step_hours/2, np.clip(t_rise - t, 0, step_hours))
+        h, d = observable_segments(m, m + slope_prev*right, t, right, dark)
+        hours += np.where(~adjacent, h, 0)
+        dark_hours += np.where(~adjacent, d, 0)
+
+        # Sum over the rows of each (target, night)
+        cell = np.cumsum(~prev_same) - 1
+        return cell, np.bincount(cell, weights=hours), np.bincount(cell, weights=dark_hours)
+
+    def apply(self, eph:pd.DataFrame, twilight_times:pd.DataFrame, step:str, longitude:float=None) -> pd.DataFrame:
+        """
+        Applies the constraints to each target, which only depend on the target's own
+        ephemeris, so they can also be applied one target at a time.
+
+        Inputs
+            eph            : DataFrame with ephemerides, with 'night' column.
+            twilight_times : DataFrame with twilight times for each night.
+            step           : Step of the ephemerides (e.g. '15min').
+            longitude      : East longitude of the site (degrees), needed for the hour angle.
+
+        Output
+            DataFrame with the rows of the target nights meeting the constraints, sorted by
+            target and time, with 'Mag' and 'duration_hours' columns.
+        """
+        # Create mag value
+        if 'Tmag' in eph.columns: #This won't be the case if there are 0 comets
+            eph['Mag'] = eph['Tmag']
+            eph['Mag'] = eph['Mag'].mask((eph['Tmag'].isna()) | (eph['Tmag'] == 0), eph['V'])
+        else:
+            eph['Mag'] = eph['V']
+        # Apply the magnitude limit
+        eph = eph[eph['Mag'] < self.mag_limit]
+        if not is_sorted(eph):
+            eph = eph.sort_values(by=['target', 'datetime'])
+        eph = eph.reset_index(drop=True)
+        if eph.empty:
+            return eph.assign(duration_hours=pd.Series(dtype=float))
+
+        cell, hours, dark_hours = self.observable_hours(eph, twilight_times, step, longitude)
+        keep_cell = (hours > 0) & (hours >= self.t_vis_limit)
+        if self.min_dark_hours is not None:
+            moon_cell = np.zeros(len(hours), dtype=bool)
+            moon_cell[cell] = (eph['target'] == 'Moon').to_numpy()
+            keep_cell &= (dark_hours >= self.min_dark_hours) | moon_cell
+        keep = keep_cell[cell]
+
+        eph = eph[keep].reset_index(drop=True)
+        eph['duration_hours'] = hours[cell[keep]]
+        return eph
+
+    def cut(self, eph:pd.DataFrame, twilight_times:pd.DataFrame, step:str,
+            longitude:float=None) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Applies the constraints (see apply), then drops the nights without targets.
+
+        Output
+            eph and twilight_times after the cuts.
+        """
+        return drop_empty_nights(self.apply(eph, twilight_times, step, longitude), twilight_times)
+
+
+def observable_segments(m_start:np.ndarray, m_end:np.ndarray, t_start:np.ndarray, length:np.ndarray,
+                        dark:tuple=None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Time linearly varying margins are all positive over segments.
+
+    Inputs
+        m_start : Margins at the start of the segments (constraints, segments).
+        m_end   : Margins at the end of the segments (constraints, segments).
+        t_start : Start times of the segments (hours).
+        length  : Lengths of the segments (hours).
+        dark    : Optional (start, end) times of darkness for each segment (hours).
+
+    Output
+        Time with all margins positive, and the part of it in darkness (zero without dark).
+    """
+    # Fraction of each segment where each margin is positive, an interval as it is linear
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cross = m_start / (m_start - m_end)
+    lo = np.where(m_start >= 0, 0, np.where(m_end >= 0, cross, 1)).max(axis=0)
+    hi = np.where(m_end >= 0, 1, np.where(m_start >= 0, cross, 0)).min(axis=0)
+    hours = np.maximum(hi - lo, 0) * length
+    if dark is None:
+        return hours, np.zeros_like(hours)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dark_lo = np.clip((dark[0] - t_start) / length, 0, 1)
+        dark_hi = np.clip((dark[1] - t_start) / length, 0, 1)
+    dark_hours = np.maximum(np.minimum(hi, dark_hi) - np.maximum(lo, dark_lo), 0) * length
+    return hours, np.where(length > 0, dark_hours, 0)
+
+
+def hour_angle(eph:pd.DataFrame, longitude:float) -> np.ndarray:
+    """
+    Hour angle of each row (hours, -12 to 12), from its time and RA. The J2000 RA is used
+    without precession, which is accurate to a few minutes of time.
+
+    Inputs
+        eph       : DataFrame with ephemerides, with 'datetime' and 'RA' columns.
+        longitude : East longitude of the site (degrees).
+    """
+    lst = np.rad2deg(almanac.local_sidereal_time(almanac.datetime_to_jd(eph['datetime']), longitude))
+    return (lst - eph['RA'].to_numpy() + 180) % 360 / 15 - 12
+
+
+def is_sorted(eph:pd.DataFrame) -> bool:
+    """
+    Checks if an ephemeris is sorted by target and time, in a single pass.
+    """
+    target = eph['target'].cat.codes.to_numpy() if hasattr(eph['target'], 'cat') else eph['target'].to_numpy()
+    times  = eph['datetime'].to_numpy()
+    return bool(np.all((target[1:] > target[:-1]) | ((target[1:] == target[:-1]) & (times[1:] >= times[:-1]))))
+
+
+def drop_empty_nights(eph_df_cut:pd.DataFrame, twilight_times:pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Drops the nights without any target passing the cuts, or with only the moon.
+
+    Inputs
+        eph_df_cut     : DataFrame with ephemerides after the constraints.
+        twilight_times : DataFrame with twilight times for each night.
+
+    Output
+        eph_df_cut and twilight_times without those nights.
+    """
+    nights = eph_df_cut.loc[(eph_df_cut['target'] != 'Moon').to_numpy(), 'night'].unique()
+    logger.debug(f"Twilight times reduced from {len(twilight_times)} to {twilight_times['night'].isin(nights).sum()} days")
+    return eph_df_cut[eph_df_cut['night'].isin(nights)], twilight_times[twilight_times['night'].isin(nights)]
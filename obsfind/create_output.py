@@ -1,15 +1,23 @@
-from .plotting import elevation_chart, summary_chart
-from .make_pdfs import create_elevation_pdf, create_summary_pdf
+from .plotting import ElevationChart, summary_chart, summary_file_name, fill_twilight_times
+from .make_pdfs import create_elevation_report, create_summary_pdf
+import io
 import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 from pathlib import Path
+import matplotlib
 from pypdf import PdfWriter, PdfReader
-from astropy.coordinates import SkyCoord
-import astropy.units as u
-import pandas as pd
 from .outfmt import logger, console
+from .summaries import summarize_nights
+from .rowindex import RowIndex
+from . import profiling
 from rich.progress import Progress
 
-def make_elevation_charts_pdf(eph_cut, twilight_list, target_plot_info, elevation_limit, mpc_code, base_out_name=''):
+
+def make_elevation_charts_pdf(eph_cut, twilight_list, target_plot_info, elevation_limit, mpc_code, base_out_name='',
+                              reuse_pages=None, pages=None, jobs=1, summaries=None):
     """
     Creates elevation charts for each night in the ephemeris DataFrame and saves them as a PDF.
 
@@ -20,107 +28,153 @@ def make_elevation_charts_pdf(eph_cut, twilight_list, target_plot_info, elevatio
         elevation_limit  : Minimum elevation limit for plotting.
         mpc_code         : MPC code of the observatory.
         base_out_name    : Base name for the output files (default: '').
+        reuse_pages      : Optional dictionary of PDF pages by night ('YYYY-MM-DD') from a previous
+                           run. These nights are unchanged, so their pages are copied instead of rendered.
+        pages            : Optional dictionary, filled with the (first page, number of pages) of
+                           each night in the output.
+        jobs             : Number of processes rendering the charts (default: 1). The charts are
+                           laid out in night order, so the PDF is the same as with one.
+        summaries        : Optional nightly summaries of eph_cut (see summaries.summarize_nights),
+                           computed here if not given.
 
     Output
         PDF file with elevation charts for each night.
     """
-    
-    summary_list = []
+    reuse_pages = reuse_pages or {}
+    if summaries is None:
+        summaries = summarize_nights(eph_cut, twilight_list)
+    # Rows by night and target, sorted once and sliced for each night
+    eph_nights  = RowIndex(eph_cut, 'night', 'target')
+    sum_nights  = RowIndex(summaries[summaries['target'] != 'Moon'], 'datetime_str', 'target')
+    output_path = Path(f"{base_out_name}elevation.pdf")
+
+    # Nights to render, with their chart inputs and table of the night (in RA order)
+    nights, charts = [], []
+    for i,row in twilight_list.iterrows():
+        if row['night'].strftime('%Y-%m-%d') in reuse_pages:
+            continue
+        row        = fill_twilight_times(row)
+        eph_night  = eph_nights.rows(row['night'])
+        summary_df = sum_nights.rows(row['night']).sort_values(by='RA_str')
+        charts.append((row,eph_night))
+        nights.append((row,summary_df))
+
     with tempfile.TemporaryDirectory() as tmpdir:
-        tmpdir_path = Path(tmpdir)
-        
+        # Without reused pages the document is the output, otherwise they are spliced in after
+        rendered_path  = output_path if not reuse_pages else Path(tmpdir) / 'rendered.pdf'
+        rendered_pages = {}
         with Progress(console=console, transient=True) as pb:
             t1 = pb.add_task('Making nightly plots', total=len(twilight_list))
-            for i,row in twilight_list.iterrows():
-            
-                logger.debug(f'Processing {row["night"]}')
-            
-                mask = eph_cut['night'] == row['night']
-                eph_night = eph_cut[mask]
-                
-                no_targets_visible = len(eph_night.targetname.unique())
-                logger.debug(f'{no_targets_visible} targets visible')
-                        
-                summary_df = (
-                    eph_night
-                    .groupby("target")[eph_night.columns.difference(["target"])]
-                    .apply(lambda df: summarize_target(df, row, tar_name=df.name))
-                    .reset_index(drop=True)
-                )
-                
-                # summary_df["lunar_illum"] = lunar_illum
-                summary_df["lunar_illum"] = row['lunar_illum']
-                summary_df = summary_df[summary_df['target'] != 'Moon']
-                summary_df = summary_df.sort_values(by='RA_str')
-                summary_list.append(summary_df)
-                
-                # Makes fig for each night
-                elevation_chart(row,eph_night,target_plot_info,elevation_limit,show_plot=False,fig_path=tmpdir_path)
-                # Makes pdf for each night
-                create_elevation_pdf(row,summary_df,mpc_code,pdf_path=tmpdir_path)
-
-                pb.update(t1,advance=1)
-    
-        #Mergers pdfs together
-        pdf_name_format = "elevation_????????.pdf"
-        pdf_files = sorted(tmpdir_path.glob(pdf_name_format))
-        writer = PdfWriter()
-        for pdf_file in pdf_files:
-            reader = PdfReader(str(pdf_file))
-            for page in reader.pages:
-                writer.add_page(page)
+            pb.update(t1, advance=len(twilight_list)-len(nights))
+            if nights or not reuse_pages:
+                chart_data = render_charts(charts, target_plot_info, elevation_limit, jobs)
+                def load_chart():
+                    png = next(chart_data)
+                    pb.update(t1, advance=1)
+                    return png
+                try:
+                    create_elevation_report(rendered_path, [(row, summary_df, load_chart) for row, summary_df in nights],
+                                            mpc_code, pages=rendered_pages)
+                finally:
+                    chart_data.close()
 
-        output_path = Path(f"./{base_out_name}elevation.pdf")
-        with open(output_path, "wb") as f_out:
-            writer.write(f_out)
-        logger.info(f"Elevation charts saved to {output_path.resolve()}")
+        if reuse_pages:
+            #Merges rendered and reused pages together, in night order
+            rendered = PdfReader(str(rendered_path)).pages if nights else []
+            writer   = PdfWriter()
+            for night in twilight_list['night'].dt.strftime('%Y-%m-%d'):
+                if night in reuse_pages:
+                    night_pages = reuse_pages[night]
+                else:
+                    first, count = rendered_pages[night]
+                    night_pages  = rendered[first:first+count]
+                if pages is not None:
+                    pages[night] = (len(writer.pages), len(night_pages))
+                for page in night_pages:
+                    writer.add_page(page)
+            with open(output_path, "wb") as f_out:
+                writer.write(f_out)
+        elif pages is not None:
+            pages.update(rendered_pages)
+    logger.info(f"Elevation charts saved to {output_path.resolve()}")
+
+    return summaries[summaries['target'] != 'Moon'].copy()
+
+def render_charts(charts, target_plot_info, elevation_limit, jobs=1):
+    """
+    Renders elevation charts with an ElevationChart per process, in a process pool with
+    jobs > 1. The pool renders at most 2*jobs charts ahead of the ones taken, so only
+    those are held in memory.
+
+    Inputs
+        charts           : List of (twilight_times, eph_night) for each chart.
+        target_plot_info : DataFrame with target names, markers, and colours.
+        elevation_limit  : Minimum elevation limit for plotting.
+        jobs             : Number of processes (default: 1, renders in this process when taken).
+
+    Output
+        Generator of the PNG data of each chart, in order.
+    """
+    if jobs <= 1:
+        init_render_process(target_plot_info, elevation_limit, backend=None)
+        try:
+            for chart in charts:
+                yield observe_render(chart, *render_chart(*chart))
+        finally:
+            close_render_process()
+        return
+
+    pool = ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=init_render_process, initargs=(target_plot_info, elevation_limit))
+    try:
+        pending = deque()
+        for chart in charts:
+            pending.append((chart, pool.submit(render_chart, *chart)))
+            if len(pending) > 2*jobs:
+                chart, future = pending.popleft()
+                yield observe_render(chart, *future.result())
+        while pending:
+            chart, future = pending.popleft()
+            yield observe_render(chart, *future.result())
+    finally:
+        pool.shutdown(cancel_futures=True)
 
-    eph_summary = pd.concat(summary_list)
-    eph_summary = eph_summary.sort_values(by=['target', 'datetime_str'])
+# Chart figure of the rendering process, reused for every night
+_chart = None
 
-    return eph_summary
+def init_render_process(target_plot_info, elevation_limit, backend='Agg'):
+    # Rendering processes have no display, so use the non-interactive backend
+    global _chart
+    if backend is not None:
+        matplotlib.use(backend)
+    _chart = ElevationChart(target_plot_info, elevation_limit)
 
-def summarize_target(group,twilight_info=None,tar_name=None):
+def close_render_process():
+    global _chart
+    _chart.close()
+    _chart = None
 
+def render_chart(twilight_times, eph_night):
     """
-    Summarizes the ephemeris data for a target by calculating median values.
-    
+    Renders the elevation chart of a night with the chart figure of the process.
+
     Inputs
-        group         : DataFrame group for a specific target.
-        twilight_info : Optional DataFrame with twilight times for the night.
+        As ElevationChart.render.
 
     Output
-        Series with median values for the target.
+        PNG data of the chart, and the time it took to render (seconds).
     """
-    
-    medians = group.agg({
-        'alpha': 'median',
-        'Mag': 'median',
-        'Sky_motion': 'median',
-        'RA': 'median',
-        'DEC': 'median',
-        'lunar_elong': 'median',
-        'duration_hours': 'median',
-    })
-
-    target = tar_name
-    night = group['night'].iloc[0]
-    med_coord = SkyCoord(ra=medians['RA']*u.deg, dec=medians['DEC']*u.deg, frame='icrs')
-
-    return pd.Series({
-        'target'      : target,
-        'date_str'    : night.strftime('%Y-%m-%d'),
-        'datetime_str': pd.to_datetime(night),
-        **medians,
-        'RA_str'      : med_coord.ra.to_string(unit=u.hour, sep=':', precision=0, pad=True),
-        'DEC_str'     : med_coord.dec.to_string(sep=':', precision=0, pad=True),
-        'twlt_stt'    : twilight_info['astronomical_set'],
-        'twlt_stp'    : twilight_info['astronomical_rise'],
-        'nght_stt'    : twilight_info['sun_set'],
-        'nght_stp'    : twilight_info['sun_rise']
-    })
-    
-def make_summary_charts_pdf(night_summaries, target_plot_info, base_out_name=''):
+    start  = time.perf_counter()
+    buffer = io.BytesIO()
+    _chart.render(twilight_times,eph_night,png_buffer=buffer)
+    return buffer.getvalue(), time.perf_counter() - start
+
+def observe_render(chart, png, seconds):
+    # Render times are measured in the rendering process and recorded here, by night
+    profiling.observe('night_render', seconds, chart[0]['night'].strftime('%Y-%m-%d'))
+    return png
+
+def make_summary_charts_pdf(night_summaries, target_plot_info, base_out_name='', reuse_pages=None, pages=None):
     """
     Generates summary charts for all targets and compiles them into a PDF.
 
@@ -130,21 +184,28 @@ def make_summary_charts_pdf(night_summaries, target_plot_info, base_out_name='')
         target_plot_info : DataFrame mapping targets to plot colours and markers.
                         Must contain 'targets', 'colours', and 'markers' columns.
         base_out_name    : (optional) String prefix for the output PDF filename.
+        reuse_pages      : (optional) Dictionary of lists of PDF pages by target from a previous run.
+                        These targets are unchanged, so their pages are copied instead of rendered.
+        pages            : (optional) Dictionary, filled with the first page of each target in the output.
 
     Output
         Saves a PDF file in the current directory named '<base_out_name>summary.pdf',
         containing:
             - A first page with the all-target summary chart.
-            - One page per target (excluding the Moon) with its corresponding chart.
+            - One page per target (excluding the Moon) with its corresponding chart,
+            in order of chart file name.
         Temporary PNG plot files are created in a temporary directory and deleted
         automatically after the PDF is built.
     """
+    reuse_pages = reuse_pages or {}
+    targets     = [obj for obj in target_plot_info['targets'] if obj != 'Moon']
+    by_target   = RowIndex(night_summaries, 'target', 'datetime_str')
     
     with tempfile.TemporaryDirectory() as tmpdir:
         tmpdir_path = Path(tmpdir)
     
         #Summary for everything
-        summary_chart(night_summaries,target_plot_info,fig_path=tmpdir_path)
+        summary_chart(by_target.frame,target_plot_info,fig_path=tmpdir_path)
     
         with Progress(console=console, transient=True) as pb:
             t1 = pb.add_task('Making summary plots', total=len(target_plot_info))
@@ -153,13 +214,34 @@ def make_summary_charts_pdf(night_summaries, target_plot_info, base_out_name='')
             for obj in target_plot_info['targets']:
                 if obj=='Moon':
                     continue
+                if obj in reuse_pages:
+                    pb.update(t1, advance=1)
+                    continue
                 logger.debug(f'Processing summary for {obj}')
-                summary_chart(night_summaries,target_plot_info,target=obj,fig_path=tmpdir_path)
+                summary_chart(by_target.rows(obj),target_plot_info,target=obj,fig_path=tmpdir_path)
                 pb.update(t1, advance=1)
         
-        #Create pdf
-        pdf_name = Path(f'./{base_out_name}summary.pdf')
-        create_summary_pdf(pdf_name,tmpdir_path)
+        #Create pdf of the charts, one page each after the all-target summary
+        pdf_name = Path(f'{base_out_name}summary.pdf')
+        if not reuse_pages:
+            create_summary_pdf(pdf_name,tmpdir_path)
+            if pages is not None:
+                pages.update({obj: i + 1 for i, obj in enumerate(sorted(targets, key=summary_file_name))})
+            logger.info(f"Summary charts saved to {pdf_name.resolve()}")
+            return
+
+        #Otherwise add the reused pages to the rendered charts in chart order
+        create_summary_pdf(tmpdir_path / 'rendered.pdf',tmpdir_path)
+        rendered = iter(PdfReader(str(tmpdir_path / 'rendered.pdf')).pages)
+        writer   = PdfWriter()
+        writer.add_page(next(rendered))
+        for obj in sorted(targets, key=summary_file_name):
+            if pages is not None:
+                pages[obj] = len(writer.pages)
+            for page in (reuse_pages[obj] if obj in reuse_pages else [next(rendered)]):
+                writer.add_page(page)
+        with open(pdf_name, "wb") as f_out:
+            writer.write(f_out)
         logger.info(f"Summary charts saved to {pdf_name.resolve()}")
 
     return
\ No newline at end of file
@@ -1,84 +1,521 @@
 import pandas as pd
 import datetime
+from pathlib import Path
+import random
+import time
+import requests
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from astropy.time import Time, TimeDelta
-from astroquery.jplhorizons import Horizons
-from astroquery.mpc import MPC as MPC_query
 from rich.progress import Progress
-from .outfmt import console, logger, error_exit
+from .outfmt import console, logger, memory_mb
+from .orbits import iter_elements_ephemerides
+from . import almanac
+from .sites import get_site, site_latitude
+from .constraints import Constraints, drop_empty_nights
+from .names import RESOLVED, AMBIGUOUS, UNKNOWN
+from .tables import TableWriter
+from . import profiling
 import ephem
 import numpy as np
 
 
-def create_horizon_dataframe(twilight_times:pd.DataFrame, mpc_code:str, target_list:list[str]) -> pd.DataFrame:
+# Horizons query settings
+HORIZONS_QUANTITIES = '1,8,9,24,25,47'
+EPHEMERIS_BACKENDS  = ['horizons', 'elements']
+DEFAULT_WORKERS     = 1     # Concurrent Horizons requests
+MAX_RETRIES         = 4     # Retries of a Horizons request on transient errors
+BACKOFF_BASE        = 1.0   # Initial retry delay (seconds), doubled every attempt
+BACKOFF_MAX         = 30.0  # Maximum retry delay (seconds)
+DEFAULT_STEP        = '15min'  # Ephemeris step
+
+# Compact ephemeris layout
+DROP_COLUMNS    = ['targetname', 'datetime_jd', 'solar_presence', 'lunar_presence', 'H', 'G', 'M1', 'k1']
+FLOAT64_COLUMNS = ['RA', 'DEC']  # Positions keep full precision, other quantities are float32
+OUTPUT_COLUMNS  = ['datetime', 'RA', 'DEC', 'airmass', 'magextinct', 'V', 'surfbright', 'Tmag', 'Nmag',
+                   'alpha', 'lunar_elong', 'lunar_illum', 'Sky_motion', 'Sky_mot_PA', 'RelVel-ANG',
+                   'target', 'elevation', 'night', 'Mag', 'duration_hours']  # Fixed columns of streamed output
+
+# Twilight definitions (Sun centre altitude, degrees)
+TWILIGHT_METHODS     = ['numpy', 'ephem']
+TWILIGHT_DEFINITIONS = {'civil': '-6', 'nautical': '-12', 'astronomical': '-18'}
+TWILIGHT_TOLERANCE   = 10     # Agreement of the numpy and ephem methods below 60 deg latitude, away from grazing crossings (seconds)
+
+
+class HorizonsSession(requests.Session):
+    """
+    HTTP session for Horizons queries. If server_url is given, requests made by
+    astroquery to the JPL Horizons API are sent to that URL instead (e.g. a mirror
+    or a local stand-in server).
+    """
+    def __init__(self, server_url:str=None):
+        super().__init__()
+        self.server_url = server_url
+
+    def request(self, method, url, *args, **kwargs):
+        from astroquery.jplhorizons import conf as horizons_conf
+        if url != horizons_conf.horizons_server:
+            return super().request(method, url, *args, **kwargs)
+        if self.server_url:
+            url = self.server_url
+        with profiling.timer('horizons'):
+            return super().request(method, url, *args, **kwargs)
+
+
+def horizons_session(workers:int=DEFAULT_WORKERS, server_url:str=None) -> HorizonsSession:
+    """
+    Creates an HTTP session to be shared by all Horizons queries of a run.
+    Connections are kept alive and pooled, with one connection per worker.
+
+    Inputs
+        workers    : Number of workers that will use the session concurrently.
+        server_url : Optional URL replacing the JPL Horizons API URL.
+
+    Output
+        HorizonsSession object.
+    """
+    session = HorizonsSession(server_url)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers,1))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def is_transient_error(err:Exception) -> bool:
+    """
+    Checks if an exception raised by a Horizons query is worth retrying
+    (network failures, timeouts, rate limiting and server errors).
+
+    Inputs
+        err : Exception raised by the query.
+
+    Output
+        True if the query should be retried.
+    """
+    if isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(err, requests.exceptions.HTTPError) and err.response is not None:
+        return err.response.status_code == 429 or err.response.status_code >= 500
+    return False
+
+
+def retry_transient(func, *args, retries:int=MAX_RETRIES, backoff:float=BACKOFF_BASE, **kwargs):
+    """
+    Calls func(*args, **kwargs), retrying on transient errors with exponential
+    backoff and full jitter. Any other error is raised straight away.
+
+    Inputs
+        func    : Function to call.
+        retries : Maximum number of retries.
+        backoff : Initial delay between retries (seconds).
+
+    Output
+        Return value of func.
+    """
+    for attempt in range(retries+1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as err:
+            if attempt == retries or not is_transient_error(err):
+                raise
+            delay = random.uniform(0, min(BACKOFF_MAX, backoff * 2**attempt))
+            logger.debug(f'Transient error ({type(err).__name__}), retrying in {delay:.1f} s')
+            time.sleep(delay)
+
+
+def horizons_epochs(start_night:datetime.datetime, end_night:datetime.datetime, step:str=DEFAULT_STEP) -> dict:
+    """
+    Creates the Horizons epochs dictionary covering a range of nights.
+
+    Inputs
+        start_night : First night of the range.
+        end_night   : Last night of the range.
+        step        : Horizons step size (default: '15min').
+
+    Output
+        Dictionary with 'start', 'stop', and 'step' keys for the time range.
+    """
+    return {'start' : Time(start_night).strftime("%Y-%m-%d %H:00"),
+            'stop'  : (Time(end_night) + TimeDelta(2,format="jd")).strftime("%Y-%m-%d %H:00"),
+            'step'  : step}
+
+
+def fetch_ephemerides(target_list:list[str], mpc_code:str, epochs:dict, workers:int=DEFAULT_WORKERS,
+                      horizons_url:str=None, cache=None, names=None) -> list[pd.DataFrame]:
+    """
+    Calls JPL Horizons for a list of targets and the moon.
+    Up to `workers` targets are queried concurrently over a single keep-alive HTTP session.
+
+    Inputs
+        target_list  : list of target names (strings) to query.
+        mpc_code     : MPC code for the observatory - https://www.minorplanetcenter.net/iau/lists/ObsCodes.html
+        epochs       : Dictionary with 'start', 'stop', and 'step' keys for the time range.
+        workers      : Number of concurrent Horizons queries (default: 1).
+        horizons_url : Optional URL replacing the JPL Horizons API URL (e.g. a local stand-in server).
+        cache        : Optional EphemerisCache to read from and store results in.
+        names        : Optional NameIndex to resolve target names with.
+
+    Output
+        List of ephemeris DataFrames in the same order as target_list, followed by the moon.
+    """
+    eph_list = [None] * (len(target_list) + 1)
+    for i, eph in iter_horizons_ephemerides(target_list, mpc_code, epochs, workers, horizons_url, cache, names):
+        eph_list[i] = eph
+    return eph_list
+
+
+def iter_horizons_ephemerides(target_list:list[str], mpc_code:str, epochs:dict, workers:int=DEFAULT_WORKERS,
+                              horizons_url:str=None, cache=None, names=None):
+    """
+    Generator version of fetch_ephemerides, yielding each ephemeris as soon as it
+    arrives, so that they need not all be held at once.
+
+    Inputs
+        As fetch_ephemerides.
+
+    Output
+        Yields (index, DataFrame) pairs, where index is the position of the target in
+        target_list, or len(target_list) for the moon, which comes first.
+    """
+    for _, i, eph in iter_sites_horizons_ephemerides(target_list, [mpc_code], epochs, workers, horizons_url, cache, names):
+        yield i, eph
+
+
+def iter_sites_horizons_ephemerides(target_list:list[str], mpc_codes:list[str], epochs:dict, workers:int=DEFAULT_WORKERS,
+                                    horizons_url:str=None, cache=None, names=None, session:requests.Session=None):
+    """
+    Multi-site version of iter_horizons_ephemerides. The queries for all sites share
+    one pool of `workers` and one keep-alive HTTP session, so the sites are fetched
+    concurrently rather than one after the other.
+
+    Inputs
+        mpc_codes : List of MPC codes for the observatories.
+        session   : Optional HTTP session to use instead of a new one (see horizons_session),
+                    left open for later queries.
+        Others as fetch_ephemerides.
+
+    Output
+        Yields (mpc_code, index, DataFrame) triples, where index is the position of the
+        target in target_list, or len(target_list) for the moon. The moons of all sites
+        come first.
+    """
+    own_session = session is None
+    if own_session:
+        session = horizons_session(workers, horizons_url)
+    
+    # Call horizons for each object and site
+    try:
+        with Progress(console=console, transient=True) as pb, ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                t1 = pb.add_task('Calling Horizons', total=len(target_list)*len(mpc_codes))
+                #Call moon
+                moon_futures = {mpc_code: pool.submit(call_horizons_moon, mpc_code, epochs, session=session, cache=cache)
+                                for mpc_code in mpc_codes}
+                # Sites of a target are queued together, so its name is only resolved once
+                futures = {pool.submit(call_horizons_obj, obj_name, mpc_code, epochs, session=session, cache=cache, names=names): (mpc_code, i)
+                           for i,obj_name in enumerate(target_list) for mpc_code in mpc_codes}
+                for mpc_code, moon_future in moon_futures.items():
+                    yield mpc_code, len(target_list), moon_future.result()
+                del moon_futures
+                for future in as_completed(futures):
+                    # Drop the reference to each result once it is handed over
+                    mpc_code, i = futures.pop(future)
+                    eph = future.result()
+                    del future
+                    pb.update(t1,advance=1)
+                    yield mpc_code, i, eph
+            finally:
+                # If the consumer stops early (or a query fails), the queries not yet started are dropped
+                pool.shutdown(wait=True, cancel_futures=True)
+    finally:
+        if own_session:
+            session.close()
+
+
+def iter_ephemerides(target_list:list[str], mpc_code:str, epochs:dict, workers:int=DEFAULT_WORKERS,
+                     horizons_url:str=None, cache=None, backend:str='horizons', elements_file=None, names=None):
+    """
+    Yields (index, DataFrame) pairs with the ephemeris of each target as it arrives from
+    the selected backend, the moon first (index len(target_list)).
+    See iter_horizons_ephemerides and orbits.iter_elements_ephemerides.
+    """
+    for _, i, eph in iter_sites_ephemerides(target_list, [mpc_code], epochs, workers, horizons_url, cache,
+                                            backend, elements_file, names):
+        yield i, eph
+
+
+def iter_sites_ephemerides(target_list:list[str], mpc_codes:list[str], epochs:dict, workers:int=DEFAULT_WORKERS,
+                           horizons_url:str=None, cache=None, backend:str='horizons', elements_file=None, names=None,
+                           session:requests.Session=None):
+    """
+    Multi-site version of iter_ephemerides, yielding (mpc_code, index, DataFrame) triples
+    with the moons of all sites first. Horizons queries for all sites run concurrently
+    (see iter_sites_horizons_ephemerides), the elements backend propagates one site at a time.
+    """
+    if backend == 'horizons':
+        yield from iter_sites_horizons_ephemerides(target_list, mpc_codes, epochs, workers, horizons_url, cache, names,
+                                                   session)
+    elif backend == 'elements':
+        for mpc_code in mpc_codes:
+            for i, eph in iter_elements_ephemerides(elements_file, target_list, get_site(mpc_code), epochs):
+                yield mpc_code, i, eph
+    else:
+        raise ValueError(f'Unknown ephemeris backend {backend}. Options: {", ".join(EPHEMERIS_BACKENDS)}')
+
+
+def sites_epochs(twilight_times:dict[str, pd.DataFrame], step:str=DEFAULT_STEP) -> dict:
+    """
+    Horizons epochs dictionary covering the nights of all sites.
+    """
+    nights = pd.concat([twilight['night'] for twilight in twilight_times.values()])
+    return horizons_epochs(nights.min(), nights.max(), step)
+
+
+def create_horizon_dataframe(twilight_times:pd.DataFrame, mpc_code:str, target_list:list[str],
+                             workers:int=DEFAULT_WORKERS, horizons_url:str=None, cache=None,
+                             backend:str='horizons', elements_file=None, step:str=DEFAULT_STEP,
+                             names=None) -> pd.DataFrame:
   
     """
     Calls JPL Horizons for a list of targets and returns a DataFrame with ephemerides.
+    With backend='elements' the ephemerides are instead propagated from the osculating
+    elements in a local MPCORB-style file, a fast but lower accuracy option for bulk screening.
 
     Inputs
-        start_date  : astropy Time() object for the start date of the ephemerides.
-        end_date    : astropy Time() object for the end date of the ephemerides.
-        mpc_code    : MPC code for the observatory - https://www.minorplanetcenter.net/iau/lists/ObsCodes.html
-        target_list : list of target names (strings) to query.
+        twilight_times : DataFrame with twilight times for each night.
+        mpc_code       : MPC code for the observatory - https://www.minorplanetcenter.net/iau/lists/ObsCodes.html
+        target_list    : list of target names (strings) to query.
+        workers        : Number of concurrent Horizons queries (default: 1).
+        horizons_url   : Optional URL replacing the JPL Horizons API URL (e.g. a local stand-in server).
+        cache          : Optional EphemerisCache to read from and store results in.
+        backend        : Ephemeris source, 'horizons' (default) or 'elements'.
+        elements_file  : Path to the MPCORB-style orbit file used by the 'elements' backend.
+        step           : Step of the ephemerides (default: '15min').
+        names          : Optional NameIndex to resolve target names with (Horizons backend).
 
     Output
         eph_all_targets : DataFrame with ephemerides for all targets.
     """
-    
-    start_date = twilight_times['night'].iloc[0]
-    end_date = twilight_times['night'].iloc[-1]
-    epochs = {  'start' : Time(start_date).strftime("%Y-%m-%d %H:00"),
-                'stop'  : (Time(end_date) + TimeDelta(2,format="jd")).strftime("%Y-%m-%d %H:00"),
-                'step'  : '15min'}
-    
-    # Empty list of ephemeride dataframes
-    eph_list = []
-    
-    # Call horizons for each object
-    with Progress(console=console, transient=True) as pb:
-        t1 = pb.add_task('Calling Horizons', total=len(target_list))
-        for i,obj_name in enumerate(target_list):
-            
-            logger.debug(f'Searching for {obj_name}')
-            eph = call_horizons_obj(obj_name, mpc_code, epochs)
-            eph_list.append(eph)
+    return create_sites_dataframes({mpc_code: twilight_times}, target_list, workers, horizons_url, cache,
+                                   backend, elements_file, step, names)[mpc_code]
 
-            pb.update(t1,advance=1)
-            
-    #Call moon
-    moon_eph = call_horizons_moon(mpc_code,epochs)
-    eph_list.append(moon_eph)
 
-    # eph_list = [e for e in eph_list if isinstance(e, pd.DataFrame) and not e.empty]
-    eph_list = [df.dropna(axis=1, how='all') if isinstance(df, pd.DataFrame) else df for df in eph_list]
-    eph_all_targets = pd.concat(eph_list)
-        
-    # Create elevation (horizon has airmass)
-    eph_all_targets = eph_all_targets.reset_index(drop=True)
-    eph_all_targets['elevation'] = 90 - np.rad2deg(np.arccos(1 / eph_all_targets['airmass']))
-    logger.info("Horizons call complete")
+def create_sites_dataframes(twilight_times:dict[str, pd.DataFrame], target_list:list[str],
+                            workers:int=DEFAULT_WORKERS, horizons_url:str=None, cache=None,
+                            backend:str='horizons', elements_file=None, step:str=DEFAULT_STEP,
+                            names=None, session:requests.Session=None) -> dict[str, tuple[pd.DataFrame, pd.DataFrame]]:
+    """
+    Multi-site version of create_horizon_dataframe, with the ephemerides of all sites
+    fetched concurrently.
+
+    Inputs
+        twilight_times : Dictionary of twilight times DataFrames by MPC code.
+        session        : Optional HTTP session for the Horizons queries, kept open (see horizons_session).
+        Others as create_horizon_dataframe.
+
+    Output
+        Dictionary of (eph_all_targets, twilight_times) by MPC code.
+    """
+    epochs = sites_epochs(twilight_times, step)
     
-    # Create time visible column in DataFrame
-    eph_all_targets['datetime'] = pd.to_datetime(eph_all_targets['datetime_str'])
+    # Ephemeride dataframes, in the same order as target_list followed by the moon,
+    # compacted as they arrive so the fetched copies are released one at a time
+    eph_lists  = {mpc_code: [None] * (len(target_list) + 1) for mpc_code in twilight_times}
+    categories = sorted(set(target_list) | {'Moon'})
+    raw_mb     = 0
+    for mpc_code, i, eph in iter_sites_ephemerides(target_list, list(twilight_times), epochs, workers, horizons_url,
+                                                   cache, backend, elements_file, names, session):
+        raw_mb += memory_mb(eph)
+        eph_lists[mpc_code][i] = compact_ephemeris(eph, categories) if not eph.empty else None
+    logger.info(f"Ephemerides complete ({backend})")
+    logger.debug(f'Ephemerides memory: {raw_mb:.1f} MB as fetched')
+
+    results = {}
+    for mpc_code, twilight in twilight_times.items():
+        eph_all_targets = pd.concat(eph_lists.pop(mpc_code), ignore_index=True)
         
-    # Loop over nights and mask the relevant rows
-    eph_all_targets['night'] = None
-    for i, date in twilight_times.iterrows():            
-        mask = (eph_all_targets['datetime'] >= date['sun_set']) & (eph_all_targets['datetime'] <= date['sun_rise'])
-        eph_all_targets.loc[mask, 'night'] = date['night']
+        # Create elevation (horizon has airmass)
+        eph_all_targets['elevation'] = 90 - np.rad2deg(np.arccos(1 / eph_all_targets['airmass']))
+        logger.debug(f'Ephemerides memory ({mpc_code}): {memory_mb(eph_all_targets):.1f} MB compact '
+                     f'({len(eph_all_targets)} rows)')
         
-        # Get lunar_illum for the Moon in this time range
-        moon_vals = eph_all_targets.loc[mask & (eph_all_targets['target'] == 'Moon'), 'lunar_illum']
-        twilight_times.loc[i, 'lunar_illum'] = moon_vals.median()
+        with profiling.timer('assign_nights', mpc_code):
+            eph_all_targets, twilight = assign_nights(eph_all_targets, twilight)
+        logger.debug(f'Ephemerides memory ({mpc_code}): {memory_mb(eph_all_targets):.1f} MB within nights '
+                     f'({len(eph_all_targets)} rows)')
+        results[mpc_code] = eph_all_targets, twilight
         
+    return results
+
+
+def stream_ephemeris_cuts(twilight_times:pd.DataFrame, mpc_code:str, target_list:list[str], mag_limit:float,
+                          elevation_limit:float, t_vis_limit:float, output_path:Path, workers:int=DEFAULT_WORKERS,
+                          horizons_url:str=None, cache=None, backend:str='horizons', elements_file=None,
+                          step:str=DEFAULT_STEP, names=None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Streaming equivalent of create_horizon_dataframe followed by limit_cuts. Each target's
+    ephemeris is compacted, assigned to nights and cut as soon as it arrives, and only the
+    surviving rows are kept, so memory grows with the number of surviving targets rather
+    than with the target list. Surviving target rows are appended to output_path as they
+    arrive (in arrival order, with OUTPUT_COLUMNS); the moon rows follow at the end, once
+    the nights with visible targets are known.
+
+    Inputs
+        twilight_times  : DataFrame with twilight times for each night.
+        mpc_code        : MPC code for the observatory - https://www.minorplanetcenter.net/iau/lists/ObsCodes.html
+        target_list     : list of target names (strings) to query.
+        mag_limit       : Magnitude limit for filtering targets.
+        elevation_limit : Minimum elevation limit for filtering targets.
+        t_vis_limit     : Minimum time visible limit in hours for filtering targets.
+        output_path     : Path of the ephemeris CSV file to write.
+        workers, horizons_url, cache, backend, elements_file, step, names : As create_horizon_dataframe.
+
+    Output
+        eph_cut        : DataFrame with the ephemerides after the cuts, sorted by target and time.
+        twilight_times : DataFrame with twilight times for the nights with visible targets.
+    """
+    return stream_sites_ephemeris_cuts({mpc_code: twilight_times}, target_list,
+                                       Constraints(mag_limit, elevation_limit, t_vis_limit), {mpc_code: output_path},
+                                       workers, horizons_url, cache, backend, elements_file, step, names)[mpc_code]
+
+
+def stream_sites_ephemeris_cuts(twilight_times:dict[str, pd.DataFrame], target_list:list[str],
+                                constraints:Constraints, output_paths:dict[str, Path],
+                                workers:int=DEFAULT_WORKERS, horizons_url:str=None, cache=None, backend:str='horizons',
+                                elements_file=None, step:str=DEFAULT_STEP, names=None, fmt:str='csv',
+                                compression:str=None) -> dict[str, tuple[pd.DataFrame, pd.DataFrame]]:
+    """
+    Multi-site version of stream_ephemeris_cuts, with the ephemerides of all sites
+    fetched concurrently and each site written to its own file.
+
+    Inputs
+        twilight_times : Dictionary of twilight times DataFrames by MPC code.
+        constraints    : Constraints to apply (see constraints.Constraints).
+        output_paths   : Dictionary of ephemeris file paths by MPC code, or None to keep the
+                         cut ephemerides without writing them.
+        fmt            : Format of the ephemeris files (see tables.FORMATS, default: 'csv').
+        compression    : Compression of the ephemeris files (see tables.COMPRESSIONS).
+        Others as stream_ephemeris_cuts.
+
+    Output
+        Dictionary of (eph_cut, twilight_times) by MPC code.
+    """
+    epochs         = sites_epochs(twilight_times, step)
+    twilight_times = dict(twilight_times)
+    categories     = sorted(set(target_list) | {'Moon'})
+    kept           = {mpc_code: [] for mpc_code in twilight_times}
+    n_written      = dict.fromkeys(twilight_times, 0)
+    moon, results  = {}, {}
+    n_fetched = 0
+
+    with ExitStack() as stack:
+        files = {mpc_code: stack.enter_context(TableWriter(output_paths[mpc_code], fmt, compression))
+                 for mpc_code in twilight_times if output_paths}
+        # The moon comes first, which sets the lunar illumination of each night
+        for mpc_code, i, eph in iter_sites_ephemerides(target_list, list(twilight_times), epochs, workers, horizons_url,
+                                                       cache, backend, elements_file, names):
+            if eph.empty:
+                continue
+            n_fetched += len(eph)
+            eph = compact_ephemeris(eph, categories)
+            eph['elevation'] = 90 - np.rad2deg(np.arccos(1 / eph['airmass']))
+            with profiling.timer('assign_nights', mpc_code):
+                eph, twilight_times[mpc_code] = assign_nights(eph, twilight_times[mpc_code])
+            with profiling.timer('cuts', mpc_code):
+                eph = constraints.apply(eph, twilight_times[mpc_code], step, get_site(mpc_code)['Longitude'])
+            if eph.empty:
+                continue
+            if i == len(target_list):
+                moon[mpc_code] = eph
+                continue
+            # Nights with a visible target are never dropped, so these rows are final
+            eph.index = pd.RangeIndex(n_written[mpc_code], n_written[mpc_code] + len(eph))
+            if files:
+                files[mpc_code].write(eph.reindex(columns=OUTPUT_COLUMNS))
+            n_written[mpc_code] += len(eph)
+            kept[mpc_code].append(eph)
+
+        for mpc_code in twilight_times:
+            eph_cut, twilight = drop_empty_nights(pd.concat(kept.pop(mpc_code) + [moon.pop(mpc_code, None)], ignore_index=True),
+                                                  twilight_times[mpc_code])
+            moon_cut = eph_cut[eph_cut['target'] == 'Moon']
+            moon_cut.index = pd.RangeIndex(n_written[mpc_code], n_written[mpc_code] + len(moon_cut))
+            if files:
+                files[mpc_code].write(moon_cut.reindex(columns=OUTPUT_COLUMNS))
+            results[mpc_code] = eph_cut.sort_values(by=['target', 'datetime']).reset_index(drop=True), twilight
+
+    logger.info(f"Ephemerides complete ({backend}, streamed)")
+    for mpc_code, output_path in (output_paths or {}).items():
+        logger.info(f"Ephemeris saved to {output_path}")
+    logger.debug(f'Kept {sum(len(eph_cut) for eph_cut, _ in results.values())} of {n_fetched} fetched rows '
+                 f'({sum(memory_mb(eph_cut) for eph_cut, _ in results.values()):.1f} MB)')
+
+    return results
+
+
+def compact_ephemeris(eph:pd.DataFrame, categories:list[str]) -> pd.DataFrame:
+    """
+    Converts the ephemeris of a target to the compact layout used by the rest of the
+    pipeline: a categorical 'target', a single datetime64 'datetime' column replacing
+    'datetime_str', float32 quantities except RA and DEC, and no columns that are
+    constant or unused (names, Julian dates, daylight flags, magnitude parameters).
+
+    Inputs
+        eph        : DataFrame with the ephemeris of a target, as fetched.
+        categories : All target names, so that the categorical columns concatenate.
+
+    Output
+        Compact DataFrame.
+    """
+    eph = eph.drop(columns=[col for col in DROP_COLUMNS if col in eph.columns])
+    eph = eph.dropna(axis=1, how='all').rename(columns={'datetime_str': 'datetime'})
+    eph['datetime'] = eph['datetime'].astype('datetime64[ns]')
+    floats = [col for col in eph.columns if pd.api.types.is_float_dtype(eph[col]) and col not in FLOAT64_COLUMNS]
+    eph[floats] = eph[floats].astype('float32')
+    eph['target'] = pd.Categorical(eph['target'], categories=categories)
+    return eph
+
+
+def assign_nights(eph:pd.DataFrame, twilight_times:pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Labels each ephemeris row with the night it belongs to (sun_set <= datetime <= sun_rise)
+    and adds the median lunar illumination of each night to the twilight times.
+    Rows are matched to nights with a single sorted interval lookup.
+
+    Inputs
+        eph            : DataFrame with ephemerides, including a 'datetime' column.
+        twilight_times : DataFrame with twilight times for each night.
+
+    Output
+        eph            : DataFrame with a 'night' column, without rows outside of any night.
+        twilight_times : DataFrame with a 'lunar_illum' column.
+    """
+    sun_set  = twilight_times['sun_set'].to_numpy(dtype='datetime64[ns]')
+    sun_rise = twilight_times['sun_rise'].to_numpy(dtype='datetime64[ns]')
+    times    = eph['datetime'].to_numpy(dtype='datetime64[ns]')
+
+    # Latest sunset before each row, which must be followed by the sunrise after the row
+    order = np.argsort(sun_set, kind='stable')
+    idx   = np.searchsorted(sun_set[order], times, side='right') - 1
+    idx   = np.where(idx >= 0, order[np.clip(idx, 0, None)], -1)
+    in_night = (idx >= 0) & (times <= sun_rise[np.clip(idx, 0, None)])
+    idx[~in_night] = -1
+
+    # Median lunar illumination of the Moon rows in each night (kept if eph has no Moon rows)
+    is_moon = (eph['target'] == 'Moon').to_numpy() & in_night
+    if is_moon.any() or 'lunar_illum' not in twilight_times.columns:
+        moon_illum = pd.Series(eph['lunar_illum'].to_numpy()[is_moon]).groupby(idx[is_moon]).median()
+        twilight_times['lunar_illum'] = moon_illum.reindex(range(len(twilight_times))).to_numpy()
+
     # Drop rows not assigned to any night
-    eph_all_targets = eph_all_targets.dropna(subset=['night'])
-        
-    eph_all_targets['night'] = pd.to_datetime(eph_all_targets['night'])    
-        
-    return eph_all_targets, twilight_times
+    eph = eph[in_night].copy()
+    eph['night'] = pd.to_datetime(twilight_times['night'].to_numpy()[idx[in_night]])
+
+    return eph, twilight_times
 
 
-def call_horizons_moon(mpc_code:str,epochs:dict,obj_name='301'):
+def call_horizons_moon(mpc_code:str,epochs:dict,obj_name='301',session:requests.Session=None,cache=None):
     """
     Calls JPL Horizons for the moon and returns a DataFrame with ephemerides.
     
@@ -86,116 +523,239 @@ def call_horizons_moon(mpc_code:str,epochs:dict,obj_name='301'):
         mpc_code    : MPC code for the observatory - https://www.minorplanetcenter.net/iau/lists/ObsCodes.html
         epochs      : Dictionary with 'start', 'stop', and 'step' keys for the time range.
         obj_name    : Name of the object to query, default is '301' for the moon.
+        session     : Optional shared HTTP session (see horizons_session).
+        cache       : Optional EphemerisCache to read from and store results in.
     
     Output
         DataFrame with ephemerides for the moon.
     """
     
-    obj_h = Horizons(id=str(obj_name), location=mpc_code, epochs=epochs)
-    # Won't fail as not applying elevation cuts
-    eph = obj_h.ephemerides(quantities='1,8,9,24,25,47').to_pandas()
-    eph['target'] = 'Moon'
-    eph['datetime_str'] = pd.to_datetime(eph['datetime_str'], format='%Y-%b-%d %H:%M')
-    return eph
+    def query(epochs):
+        from astroquery.jplhorizons import Horizons
+        obj_h = Horizons(id=str(obj_name), location=mpc_code, epochs=epochs)
+        if session is not None:
+            obj_h._session = session
+        # Won't fail as not applying elevation cuts
+        eph = retry_transient(obj_h.ephemerides, quantities=HORIZONS_QUANTITIES, cache=False).to_pandas()
+        eph['target'] = 'Moon'
+        eph['datetime_str'] = pd.to_datetime(eph['datetime_str'], format='%Y-%b-%d %H:%M')
+        return eph
+
+    if cache is None:
+        return query(epochs)
+    return cache.fetch('moon', str(obj_name), mpc_code, epochs, HORIZONS_QUANTITIES, query)
 
 
-def call_horizons_obj(obj_name:str, mpc_code:str, epochs:dict) -> pd.DataFrame:
+def call_horizons_obj(obj_name:str, mpc_code:str, epochs:dict, session:requests.Session=None, cache=None,
+                      names=None) -> pd.DataFrame:
     """
     Calls JPL Horizons for a single object and returns a DataFrame with ephemerides.
+    Transient errors are retried with backoff before giving up on the object.
+
+    With a name index, the object is queried by its SPK-ID, and names known to be
+    ambiguous or unknown are skipped without a query. Failures are reported by kind:
+    names that cannot be resolved, objects not visible in the time range, and lookups
+    that failed on network or server errors.
 
     Inputs
         obj_name    : Name of the object to query.
         mpc_code    : MPC code for the observatory - https://www.minorplanetcenter.net/iau/lists/ObsCodes.html
         epochs      : Dictionary with 'start', 'stop', and 'step' keys for the time range.
+        session     : Optional shared HTTP session (see horizons_session).
+        cache       : Optional EphemerisCache to read from and store results in.
+        names       : Optional NameIndex to resolve the name with.
 
     Output
-        DataFrame with ephemerides for the object.
+        DataFrame with ephemerides for the object (empty if there are none).
     """
-    obj_h = Horizons(id=str(obj_name), location=mpc_code, epochs=epochs, id_type='smallbody')
-    try: 
+    logger.debug(f'Searching for {obj_name}')
+    horizons_id, id_type = str(obj_name), 'smallbody'
+
+    if names is not None:
+        try:
+            entry = retry_transient(names.resolve, obj_name, session=session)
+        except Exception as err:
+            # Name lookup unavailable, let Horizons resolve the name
+            logger.debug(f'Cannot look up {obj_name} ({type(err).__name__}), querying Horizons by name')
+            entry = None
+        if entry is not None and entry['status'] != RESOLVED:
+            logger.warning(f"Skipping {obj_name}: {entry['status']} name, {entry['detail']} "
+                           f"(python -m obsfind.names forget '{obj_name}' to look it up again)")
+            return pd.DataFrame()
+        if entry is not None:
+            # The SPK-ID is a record number, sent as is (a designation search would read it as a designation)
+            horizons_id, id_type = entry['spkid'], None
+
+    def query(epochs):
+        from astroquery.jplhorizons import Horizons
+        obj_h = Horizons(id=horizons_id, location=mpc_code, epochs=epochs, id_type=id_type)
+        if session is not None:
+            obj_h._session = session
         # Fails if no ephemerides meet the criteria (I.E, not present in the sky during this time)
-        eph = obj_h.ephemerides(skip_daylight=True, quantities='1,8,9,24,25,47').to_pandas()
+        eph = retry_transient(obj_h.ephemerides, skip_daylight=True, quantities=HORIZONS_QUANTITIES, cache=False).to_pandas()
         eph['target'] = obj_name
         eph['datetime_str'] = pd.to_datetime(eph['datetime_str'], format='%Y-%b-%d %H:%M')
         return eph
-    except:
-        logger.debug(f'Cannot see {obj_name}')
-        return pd.DataFrame()
+
+    try: 
+        if cache is None:
+            return query(epochs)
+        return cache.fetch('obj', obj_name, mpc_code, epochs, HORIZONS_QUANTITIES, query)
+    except ValueError as err:
+        # Horizons answered: either it cannot resolve the name, or nothing meets the criteria
+        status = horizons_name_status(err)
+        if status is None:
+            logger.debug(f'Cannot see {obj_name}')
+        else:
+            detail = str(err).splitlines()[0]
+            logger.warning(f'Skipping {obj_name}: {status} name in Horizons ({detail})')
+            if names is not None:
+                names.put(obj_name, {'status': status, 'detail': detail})
+    except Exception as err:
+        logger.warning(f'Lookup failed for {obj_name} ({type(err).__name__}: {err})')
+    return pd.DataFrame()
+
+
+def horizons_name_status(err:ValueError) -> str:
+    """
+    Classifies a Horizons query error: AMBIGUOUS or UNKNOWN for names Horizons cannot
+    resolve, None for other errors (no ephemeris meeting the criteria).
+    """
+    message = str(err)
+    if message.startswith('Ambiguous target name'):
+        return AMBIGUOUS
+    if message.startswith('Unknown target'):
+        return UNKNOWN
+    return None
     
 
 
-def limit_cuts(eph_df, mag_limit, elevation_limit, t_vis_limit, twilight_times):
+def limit_cuts(eph_df, mag_limit, elevation_limit, t_vis_limit, twilight_times, step=DEFAULT_STEP):
     """
     Applies magnitude, elevation, and time visible limit cuts to the ephemeris DataFrame.
+    See constraints.Constraints for the other constraints.
     Inputs
         eph_df         : DataFrame with ephemerides for all targets.
         mag_limit      : Magnitude limit for filtering targets.
         elevation_limit: Minimum elevation limit for filtering targets.
         t_vis_limit    : Minimum time visible limit in hours for filtering targets.
+        twilight_times : DataFrame with twilight times for each night.
+        step           : Step of the ephemerides (default: '15min').
     Output
         DataFrame with ephemerides after applying the cuts.
     """
-    # Create mag value
-    if 'Tmag' in eph_df.columns: #This won't be the case if there are 0 comets
-        eph_df['Mag'] = eph_df['Tmag']
-        eph_df['Mag'] = eph_df['Mag'].mask((eph_df['Tmag'].isna()) | (eph_df['Tmag'] == 0), eph_df['V'])
-    else:
-        eph_df['Mag'] = eph_df['V']
-    # Apply the magnitude limit
-    eph_df_cut = eph_df[eph_df['Mag'] < mag_limit].sort_values(by=['target', 'datetime_str']).reset_index(drop=True)
-
-    # Time visible above elevation limit
-    above_elev   = eph_df_cut[eph_df_cut['elevation'] > elevation_limit]    
-    t_vis_counts = above_elev.groupby(['target', 'night']).size()          
-    t_vis_dur    = t_vis_counts.mul(0.25).reset_index(name='duration_hours')
-    targets_visible = t_vis_dur[t_vis_dur['duration_hours'] >= t_vis_limit]
+    return Constraints(mag_limit, elevation_limit, t_vis_limit).cut(eph_df, twilight_times, step)
 
-    # Filter not visible targets
-    eph_df_cut = eph_df_cut.merge(targets_visible[['target', 'night', 'duration_hours']], 
-                                  on=['target', 'night'], how='inner')
 
-    #Filter out nights with 0 targets, or just the moon
-    all_nights = set(twilight_times['night'])
-    nights_with_targets = set(eph_df_cut['night'])
-    nights_with_zero_targets = all_nights - nights_with_targets
+def target_cuts(eph_df, mag_limit, elevation_limit, t_vis_limit, twilight_times, step=DEFAULT_STEP):
+    """
+    Applies the magnitude, elevation, and time visible limit cuts, which only depend on
+    each target's own ephemeris, so they can also be applied one target at a time.
+    Inputs
+        As limit_cuts.
+    Output
+        DataFrame with the rows of the target nights passing the cuts, sorted by target
+        and time, with 'Mag' and 'duration_hours' columns.
+    """
+    return Constraints(mag_limit, elevation_limit, t_vis_limit).apply(eph_df, twilight_times, step)
 
-    # If target visible == moon
-    targets_per_night = eph_df_cut.groupby('night')['target'].agg(set)
-    nights_only_moon = targets_per_night[
-        targets_per_night.apply(lambda s: s == {'Moon'})
-    ].index
 
-    # Combine all nights to drop
-    nights_to_drop = set(nights_only_moon) | nights_with_zero_targets
+def get_twilight_times(mpc_code:str, date_list:Time, method:str='numpy') -> pd.DataFrame:
+    """
+    Calculates twilight times for a given observatory code and list of dates.
+    
+    Inputs
+        mpc_code  : MPC code for the observatory - https://www.minorplanetcenter.net/iau/lists/ObsCodes.html
+        date_list : astropy Time array (or list of Time objects) of the nights to calculate twilight times for.
+        method    : 'numpy' to solve all nights at once (default), or 'ephem' for the pyephem reference.
+    Output
+        DataFrame with twilight times for each night, including sunrise, sunset, and twilight times.
+    """
 
-    # Drop those nights from both DataFrames
-    old_length = len(twilight_times)
-    twilight_times = twilight_times[~twilight_times['night'].isin(nights_to_drop)]
-    eph_df_cut = eph_df_cut[~eph_df_cut['night'].isin(nights_to_drop)]
-    logger.debug(f'Twilight times reduced from {old_length} to {len(twilight_times)} days')
+    site     = get_site(mpc_code)
+    site_lat = site_latitude(site)
+    site_lon = site['Longitude']
 
-    return eph_df_cut, twilight_times
+    if method == 'ephem':
+        return twilight_times_ephem(site_lon, site_lat, date_list)
+    return twilight_times_numpy(site_lon, site_lat, date_list)
 
 
-def get_twilight_times(mpc_code:str, date_list:list[Time]) -> dict[datetime.datetime]:
+def twilight_times_numpy(site_lon:float, site_lat:float, date_list:Time) -> pd.DataFrame:
     """
-    Calculates twilight times for a given observatory code and list of dates.
-    
+    Twilight times for all nights at once from the NumPy solar model in almanac, with the
+    same definitions as twilight_times_ephem: sunset and sunrise are for the upper limb of
+    the Sun on the horizon, twilights for the centre of the Sun at the TWILIGHT_DEFINITIONS
+    altitudes, both refracted as in pyephem. Agrees with twilight_times_ephem to within
+    TWILIGHT_TOLERANCE below 60 degrees latitude (tests/test_twilight.py), except on nights
+    where the Sun turns within a degree of the altitude, where the crossing is ill-conditioned
+    and the methods can differ by a minute or more (e.g. astronomical twilight near midsummer).
+
+    Nights where the Sun never rises (polar night) start at local noon, and nights that
+    do not end within a day end at the next local noon. Times the Sun never reaches, including the sunset
+    and sunrise of nights where the Sun never sets, are NaT.
+
     Inputs
-        mpc_code  : MPC code for the observatory - https://www.minorplanetcenter.net/iau/lists/ObsCodes.html
-        date_list : List of astropy Time objects representing the nights to calculate twilight times for.
+        site_lon  : East longitude of the site (degrees).
+        site_lat  : Latitude of the site (degrees).
+        date_list : astropy Time array (or list of Time objects) of the nights.
     Output
-        Dictionary with twilight times for each night, including sunrise, sunset, and twilight times.
+        DataFrame with twilight times for each night.
     """
+    nights = np.atleast_1d(Time(date_list).datetime64).astype('datetime64[us]')
+
+    #Adjust for local_noon calc
+    if site_lon > 180:
+        site_lon -= 360
+
+    # Approximate local noon (in UT), and the Sun altitude over the following two days
+    noon      = almanac.datetime_to_jd(nights) + 0.5 - site_lon/360
+    grid, alt = almanac.sun_altitude_grid(noon, site_lon, site_lat)
+    crossings = lambda horizon, rising, after=None: almanac.sun_crossings(grid, alt, site_lon, site_lat,
+                                                                          horizon, rising, after)
+
+    semidiameter = almanac.sun_semidiameter(noon)
+    horizon = -semidiameter - almanac.refraction(-semidiameter)
+    sunset  = crossings(horizon, rising=False)
+    polar   = np.isnan(sunset) & (alt[:, 0] < horizon)
+    sunset  = np.where(polar, noon, sunset)
+    sunrise = crossings(horizon, rising=True, after=sunset)
+    sunrise = np.where(np.isnan(sunrise) & ~np.isnan(sunset), noon + 1, sunrise)
+
+    twilight_times = {'sun_set': sunset, 'sun_rise': sunrise}
+    for name, angle in TWILIGHT_DEFINITIONS.items():
+        horizon       = float(angle) - almanac.refraction(float(angle))
+        twilight_set  = crossings(horizon, rising=False, after=sunset)
+        twilight_rise = crossings(horizon, rising=True, after=sunset)
+        # Both or neither, as with ephem
+        missing = np.isnan(twilight_set) | np.isnan(twilight_rise)
+        twilight_times[f'{name}_set']  = np.where(missing, np.nan, twilight_set)
+        twilight_times[f'{name}_rise'] = np.where(missing, np.nan, twilight_rise)
+
+    twilight_times = {name: jd_to_datetime(jd) for name, jd in twilight_times.items()}
+    return pd.DataFrame({'night': nights, **twilight_times})
+
+
+def jd_to_datetime(jd:np.ndarray) -> np.ndarray:
+    """
+    Converts Julian dates to datetime64, rounded to the second, with NaT for NaN.
+    """
+    us = np.round((jd - almanac.J2000) * 86400) * 1e6  # Whole seconds, below the model accuracy
+    us = np.where(np.isnan(us), np.iinfo(np.int64).min, us).astype(np.int64)
+    return np.datetime64('2000-01-01T12:00:00', 'us') + us.astype('timedelta64[us]')
 
-    obs_sites   = MPC_query.get_observatory_codes()
-    rho_cos_phi = obs_sites[obs_sites['Code']==mpc_code]['cos'].value
-    rho_sin_phi = obs_sites[obs_sites['Code']==mpc_code]['sin'].value
-    rho         = np.sqrt(rho_cos_phi**2 + rho_sin_phi**2)
-    phi         = np.arcsin(rho_sin_phi/rho)
-    site_lat = np.rad2deg(phi)[0]
-    site_lon = obs_sites[obs_sites['Code']==mpc_code]['Longitude'].value[0]
 
+def twilight_times_ephem(site_lon:float, site_lat:float, date_list:list[Time]) -> pd.DataFrame:
+    """
+    Twilight times for each night from pyephem, one night at a time.
+
+    Inputs
+        site_lon  : East longitude of the site (degrees).
+        site_lat  : Latitude of the site (degrees).
+        date_list : astropy Time array (or list of Time objects) of the nights.
+    Output
+        DataFrame with twilight times for each night.
+    """
     MPC_site      = ephem.Observer()
     MPC_site.lon  = str(site_lon)
     MPC_site.lat  = str(site_lat)
@@ -204,11 +764,6 @@ def get_twilight_times(mpc_code:str, date_list:list[Time]) -> dict[datetime.date
     if site_lon > 180:
         site_lon -= 360  
 
-    twilight_definitions = {
-            'civil': '-6',
-            'nautical': '-12',
-            'astronomical': '-18'
-        }
     all_night_info = []
 
     for night in date_list:
@@ -227,7 +782,7 @@ def get_twilight_times(mpc_code:str, date_list:list[Time]) -> dict[datetime.date
         night_info['sun_set']  = sunset.datetime()
         night_info['sun_rise'] = sunrise.datetime()
         
-        for name, angle in twilight_definitions.items():
+        for name, angle in TWILIGHT_DEFINITIONS.items():
             
             try: # Might fail if the sun never goes below this point
                 MPC_site.horizon = angle
@@ -243,4 +798,4 @@ def get_twilight_times(mpc_code:str, date_list:list[Time]) -> dict[datetime.date
 
     all_night_info = pd.DataFrame(all_night_info)
 
-    return all_night_info
\ No newline at end of file
+    return all_night_info
@@ -0,0 +1,318 @@
+import hashlib
+import io
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from .outfmt import logger
+from .ephemeris import create_sites_dataframes, OUTPUT_COLUMNS, DEFAULT_WORKERS, DEFAULT_STEP
+from .constraints import Constraints, drop_empty_nights
+from .sites import get_site
+from .tables import table_path, read_table
+
+
+# Manifest of the outputs of a run, read by the next run with --incremental
+MANIFEST_NAME    = 'manifest.json'
+MANIFEST_VERSION = 2
+
+
+def run_settings(args) -> dict:
+    """
+    Settings that all the outputs of a run depend on. A previous run can only be
+    extended by one with the same settings.
+
+    Inputs
+        args : Validated command line arguments.
+
+    Output
+        Dictionary of settings (JSON serializable).
+    """
+    settings = {'mpc_codes'          : args.mpc_codes,
+                'mag_limit'          : args.mag_limit,
+                'elevation_limit'    : args.elevation_limit,
+                'time_visible_limit' : args.time_visible_limit,
+                'moon_sep'           : args.moon_sep,
+                'max_motion'         : args.max_motion,
+                'max_hour_angle'     : args.max_hour_angle,
+                'min_dark'           : args.min_dark,
+                'step'               : args.step,
+                'backend'            : args.backend,
+                'twilight'           : args.twilight}
+    if args.backend == 'elements':
+        # A new orbit file changes every target
+        stat = args.elements_file.stat()
+        settings['elements_file'] = [str(args.elements_file.resolve()), stat.st_size, stat.st_mtime]
+    return settings
+
+
+def night_keys(nights:pd.Series) -> pd.Series:
+    """Nights as 'YYYY-MM-DD' strings, the keys of the manifest."""
+    return pd.to_datetime(nights).dt.strftime('%Y-%m-%d')
+
+
+def read_manifest(path:Path) -> dict:
+    """
+    Reads the manifest of a previous run, or returns None if there is no usable one.
+    """
+    if not path.is_file():
+        return None
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        logger.warning(f'Cannot read {path}')
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(path:Path, settings:dict, target_list:list[str], dates:list[str], markers:list[str], sites:dict,
+                   outputs:list[str], fmt:str='csv'):
+    """
+    Writes the manifest of a run.
+
+    Inputs
+        path        : Path of the manifest.
+        settings    : Settings of the run (see run_settings).
+        target_list : Targets of the run.
+        dates       : Dates of the run ('YYYY-MM-DD').
+        markers     : Targets in the order their markers and colours were assigned.
+        sites       : Dictionary of site manifests by MPC code (see site_manifest).
+        outputs     : Output files written by the run (see read_inputs.OUTPUTS).
+        fmt         : Format of the ephemeris and summary tables (see tables.FORMATS).
+    """
+    manifest = {'version'  : MANIFEST_VERSION,
+                'settings' : settings,
+                'targets'  : sorted(target_list),
+                'dates'    : list(dates),
+                'markers'  : list(markers),
+                'outputs'  : list(outputs),
+                'format'   : fmt,
+                'sites'    : sites}
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    tmp_path.replace(path)
+    logger.debug(f'Manifest saved to {path.resolve()}')
+
+
+def site_manifest(eph_cut:pd.DataFrame, twilight_list:pd.DataFrame, night_hashes:dict, night_pages:dict,
+                  target_hashes:dict, target_pages:dict) -> dict:
+    """
+    Manifest entry of a site: the column types of its ephemeris file, and the fingerprint,
+    pages and lunar illumination of each night and the fingerprint and page of each
+    target summary. Nights without an elevation page (not rendered) have no fingerprint.
+    """
+    lunar_illum = dict(zip(night_keys(twilight_list['night']), twilight_list['lunar_illum'].astype(float)))
+    return {'dtypes'  : {col: str(dtype) for col, dtype in eph_cut.dtypes.items() if col != 'target'},
+            'nights'  : {night: {'hash'        : night_hashes.get(night) if night in night_pages else None,
+                                 'page'        : night_pages.get(night, (None, 0))[0],
+                                 'pages'       : night_pages.get(night, (None, 0))[1],
+                                 'lunar_illum' : lunar_illum[night]}
+                         for night in lunar_illum},
+            'targets' : {obj: {'hash'  : target_hashes[obj],
+                               'page'  : page,
+                               'pages' : 1}
+                         for obj, page in target_pages.items()}}
+
+
+def plan_incremental(manifest:dict, settings:dict, target_list:list[str], dates:list[str], site_bases:dict) -> dict:
+    """
+    Compares a run with the manifest of the previous one, to find the targets and nights
+    that are new.
+
+    Inputs
+        manifest    : Manifest of the previous run (or None).
+        settings    : Settings of this run (see run_settings).
+        target_list : Targets of this run.
+        dates       : Dates of this run ('YYYY-MM-DD').
+        site_bases  : Output file name base of each site.
+
+    Output
+        The manifest with 'new_targets', 'kept_targets' and 'new_dates' lists added, or
+        None if the previous run cannot be extended and everything must be computed.
+    """
+    if manifest is None:
+        logger.info('No previous run to extend, computing everything')
+        return None
+    if manifest['settings'] != settings:
+        logger.info('Settings changed since the previous run, computing everything')
+        return None
+    if 'eph' not in manifest['outputs']:
+        logger.info('The previous run did not write its ephemeris file, computing everything')
+        return None
+    for base in site_bases.values():
+        eph_path = table_path(base, 'eph', manifest.get('format', 'csv'))
+        if not eph_path.is_file():
+            logger.info(f'Cannot find {eph_path.name} from the previous run, computing everything')
+            return None
+
+    old_targets, old_dates = set(manifest['targets']), set(manifest['dates'])
+    plan = dict(manifest)
+    plan['new_targets']  = [obj for obj in target_list if obj not in old_targets]
+    plan['kept_targets'] = [obj for obj in target_list if obj in old_targets]
+    plan['new_dates']    = [date for date in dates if date not in old_dates]
+    logger.info(f"Extending the previous run: {len(plan['new_targets'])} new targets, {len(plan['new_dates'])} new nights, "
+                f"{len(old_targets - set(target_list))} targets and {len(old_dates - set(dates))} nights removed")
+    return plan
+
+
+def read_ephemeris(path:Path, dtypes:dict, categories:list[str]) -> pd.DataFrame:
+    """
+    Reads an ephemeris file written by a previous run back into the compact layout.
+
+    Inputs
+        path       : Path of the ephemeris file (CSV, Parquet or Feather).
+        dtypes     : Column types from the manifest.
+        categories : All target names, for the categorical 'target' column.
+
+    Output
+        DataFrame with the ephemerides.
+    """
+    eph = read_table(path, memory_map=False)
+    for col in eph.columns:
+        if col not in dtypes:
+            continue
+        if dtypes[col].startswith('datetime64'):
+            eph[col] = pd.to_datetime(eph[col])
+        eph[col] = eph[col].astype(dtypes[col])
+    eph['target'] = pd.Categorical(eph['target'].astype(str), categories=categories)
+    return eph.reset_index(drop=True)
+
+
+def incremental_cuts(plan:dict, twilight_lists:dict[str, pd.DataFrame], target_list:list[str],
+                     constraints:Constraints, site_bases:dict, workers:int=DEFAULT_WORKERS,
+                     horizons_url:str=None, cache=None, backend:str='horizons', elements_file=None,
+                     step:str=DEFAULT_STEP, names=None) -> dict[str, tuple[pd.DataFrame, pd.DataFrame]]:
+    """
+    Equivalent of create_sites_dataframes followed by Constraints.cut, that only computes the
+    new (target, night) cells of a run and takes the others from the previous ephemeris
+    files. New targets are fetched for all nights, and the other targets for the new nights.
+
+    Inputs
+        plan           : Plan of the run (see plan_incremental).
+        twilight_lists : Dictionary of twilight times DataFrames by MPC code.
+        target_list    : list of target names (strings).
+        constraints    : Constraints to apply (see constraints.Constraints).
+        site_bases     : Output file name base of each site.
+        workers, horizons_url, cache, backend, elements_file, step, names : As create_horizon_dataframe.
+
+    Output
+        Dictionary of (eph_cut, twilight_times) by MPC code.
+    """
+    new_dates  = set(plan['new_dates'])
+    categories = sorted(set(target_list) | {'Moon'})
+    fresh      = {mpc_code: [] for mpc_code in twilight_lists}
+    lunar      = {mpc_code: {night: entry['lunar_illum'] for night, entry in plan['sites'][mpc_code]['nights'].items()}
+                  for mpc_code in twilight_lists}
+    covered    = set()  # Nights whose moon rows were fetched again
+
+    def fetch(targets:list[str], dates:set):
+        twilights = {mpc_code: twilight[night_keys(twilight['night']).isin(dates).to_numpy()].copy()
+                     for mpc_code, twilight in twilight_lists.items()}
+        results = create_sites_dataframes(twilights, targets, workers, horizons_url, cache, backend, elements_file, step, names)
+        for mpc_code, (eph, twilight) in results.items():
+            eph_cut = constraints.apply(eph, twilight, step, get_site(mpc_code)['Longitude'])
+            # The moon of nights covered by an earlier fetch is already there
+            duplicate = (eph_cut['target'] == 'Moon') & night_keys(eph_cut['night']).isin(covered)
+            fresh[mpc_code].append(eph_cut[~duplicate])
+            lunar[mpc_code].update(zip(night_keys(twilight['night']), twilight['lunar_illum']))
+        covered.update(dates)
+
+    all_dates = set(night for twilight in twilight_lists.values() for night in night_keys(twilight['night']))
+    if plan['new_targets']:
+        fetch(plan['new_targets'], all_dates)
+    if plan['new_dates'] and plan['kept_targets']:
+        fetch(plan['kept_targets'], new_dates)
+
+    site_cuts = {}
+    for mpc_code, twilight in twilight_lists.items():
+        # Unchanged cells of the previous run
+        previous = read_ephemeris(table_path(site_bases[mpc_code], 'eph', plan.get('format', 'csv')),
+                                  plan['sites'][mpc_code]['dtypes'], categories)
+        nights   = night_keys(previous['night'])
+        is_moon  = previous['target'] == 'Moon'
+        keep     = ((previous['target'].isin(plan['kept_targets']) | is_moon) & nights.isin(all_dates) & ~nights.isin(new_dates)
+                    & ~(is_moon & nights.isin(covered)))
+        logger.debug(f'{mpc_code}: {keep.sum()} rows from the previous run, {sum(len(eph) for eph in fresh[mpc_code])} new')
+
+        eph = pd.concat([previous[keep]] + fresh.pop(mpc_code), ignore_index=True)
+        eph['target'] = pd.Categorical(eph['target'].astype(str), categories=categories)
+        twilight = twilight.copy()
+        twilight['lunar_illum'] = night_keys(twilight['night']).map(lunar[mpc_code]).astype(float).to_numpy()
+        eph_cut, twilight = drop_empty_nights(eph, twilight)
+        site_cuts[mpc_code] = eph_cut.sort_values(by=['target', 'datetime']).reset_index(drop=True), twilight
+
+    return site_cuts
+
+
+def night_fingerprints(eph_cut:pd.DataFrame, twilight_list:pd.DataFrame, target_plot_info:pd.DataFrame) -> dict[str, str]:
+    """
+    Fingerprint of everything an elevation chart page depends on: the ephemeris rows and
+    twilight times of the night, and the markers of its targets.
+
+    Output
+        Dictionary of fingerprints by night ('YYYY-MM-DD').
+    """
+    eph = eph_cut.reindex(columns=OUTPUT_COLUMNS).astype({'target': str}).sort_values(by=['night', 'target', 'datetime'])
+    row_hashes = pd.util.hash_pandas_object(eph, index=False).to_numpy()
+    rows       = pd.Series(np.arange(len(eph))).groupby(night_keys(eph['night']).to_numpy()).indices
+    markers    = target_plot_info.set_index('targets')
+
+    fingerprints = {}
+    for _, row in twilight_list.iterrows():
+        night = row['night'].strftime('%Y-%m-%d')
+        idx   = rows.get(night, [])
+        h = hashlib.sha1(row_hashes[idx].tobytes())
+        # Floats compared as float64, as the lunar illumination read from the manifest is
+        h.update(repr([float(v) if isinstance(v, (float, np.floating)) else str(v) for v in row]).encode())
+        targets = sorted(set(eph['target'].to_numpy()[idx]) & set(markers.index))
+        h.update(repr(markers.loc[targets].to_numpy().tolist()).encode())
+        fingerprints[night] = h.hexdigest()
+    return fingerprints
+
+
+def target_fingerprints(night_summaries:pd.DataFrame, target_plot_info:pd.DataFrame) -> dict[str, str]:
+    """
+    Fingerprint of everything a summary chart page depends on: the nightly summaries
+    and the marker of the target.
+
+    Output
+        Dictionary of fingerprints by target.
+    """
+    markers = target_plot_info.set_index('targets')
+    fingerprints = {}
+    for obj, summary in night_summaries.groupby('target', observed=True):
+        h = hashlib.sha1(summary.to_csv(index=False).encode())
+        h.update(repr(markers.loc[obj].tolist()).encode())
+        fingerprints[obj] = h.hexdigest()
+    return fingerprints
+
+
+def previous_pages(pdf_path:Path, entries:dict, fingerprints:dict) -> dict:
+    """
+    Pages of a previous output PDF that can be reused, those of the entries (nights or
+    targets) with an unchanged fingerprint.
+
+    Inputs
+        pdf_path     : Path of the previous PDF.
+        entries      : Manifest entries, with the 'hash', first 'page' and number of 'pages' of each key.
+        fingerprints : Fingerprints of this run, by key.
+
+    Output
+        Dictionary of lists of pages by key (single pages for the summary charts).
+    """
+    unchanged = {key: entry for key, entry in entries.items()
+                 if entry['hash'] is not None and fingerprints.get(key) == entry['hash']}
+    if not unchanged or not pdf_path.is_file():
+        logger.info(f'Rendering all {len(fingerprints)} pages of {pdf_path.name}')
+        return {}
+    from pypdf import PdfReader
+    # Read into memory, as the file is about to be replaced
+    reader = PdfReader(io.BytesIO(pdf_path.read_bytes()))
+    if max(entry['page'] + entry['pages'] for entry in unchanged.values()) > len(reader.pages):
+        logger.warning(f'{pdf_path} does not match the manifest, rendering all pages')
+        return {}
+    logger.info(f'Reusing {len(unchanged)} of {len(fingerprints)} pages of {pdf_path.name}')
+    return {key: reader.pages[entry['page']:entry['page'] + entry['pages']] for key, entry in unchanged.items()}
@@ -1,6 +1,7 @@
+import io
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Image, Table, TableStyle, Spacer, PageBreak
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Image, Table, TableStyle, Spacer, PageBreak, Flowable
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from astropy.time import Time
 from .outfmt import logger
@@ -19,20 +20,77 @@ def create_elevation_pdf(twilight_times,summary_df,mpc_code,pdf_path):
         Saves the PDF file with elevation chart and summary table.
     """
     
-    night_str = twilight_times['night'].strftime('%Y-%b-%d')
     night_str_nohyphen = twilight_times['night'].strftime('%Y%m%d')
-    sun_set, sun_rise = twilight_times['sun_set'], twilight_times['sun_rise']
-    twlt_set, twlt_rise = twilight_times['astronomical_set'], twilight_times['astronomical_rise']
 
     fig_name = f'{pdf_path}/elevation_{night_str_nohyphen}.png'
     pdf_name = f'{pdf_path}/elevation_{night_str_nohyphen}.pdf'
 
-    # lunar_illum_val = summary_df['lunar_illum'].iloc[0] #They're all the same anyway
-    lunar_illum_val = twilight_times['lunar_illum']
-
     doc = SimpleDocTemplate(pdf_name, pagesize=letter,
                             rightMargin=20, leftMargin=20,
                             topMargin=20, bottomMargin=20)
+    im = Image(fig_name)
+    im._restrictSize(450, 300)  # max width and height in points
+    doc.build(elevation_story(twilight_times,summary_df,mpc_code,im))
+    
+    return
+
+def create_elevation_report(pdf_name,nights,mpc_code,pages=None):
+    """
+    Creates a single PDF with the elevation chart and summary table of each night, each
+    starting on a new page.
+
+    Inputs
+        pdf_name : Path to save the PDF file.
+        nights   : Iterable of (twilight_times, summary_df, load_chart) for each night, where
+                   load_chart is called once, when the night is laid out, and returns the PNG
+                   data of its chart. Charts are released once drawn, so only one is held at a time.
+        mpc_code : MPC code for the observatory.
+        pages    : Optional dictionary, filled with the (first page, number of pages) of each
+                   night ('YYYY-MM-DD') in the PDF.
+
+    Output
+        Saves the PDF file.
+    """
+    # Invariant: no creation date or random ID, so the same nights give the same file
+    doc = SimpleDocTemplate(str(pdf_name), pagesize=letter,
+                            rightMargin=20, leftMargin=20,
+                            topMargin=20, bottomMargin=20, invariant=True)
+    first_pages = {}
+    story = []
+    for twilight_times, summary_df, load_chart in nights:
+        if story:
+            story.append(PageBreak())
+        story.append(PageMarker(first_pages, twilight_times['night'].strftime('%Y-%m-%d')))
+        story.extend(elevation_story(twilight_times,summary_df,mpc_code,ChartImage(load_chart, 450, 300)))
+    doc.build(story)
+
+    if pages is not None:
+        starts = list(first_pages.values()) + [doc.page]
+        for (night, start), end in zip(first_pages.items(), starts[1:]):
+            pages[night] = (start, end - start)
+
+    return
+
+def elevation_story(twilight_times,summary_df,mpc_code,im):
+    """
+    Flowables of the elevation chart and summary table for a given night.
+
+    Inputs
+        twilight_times : DataFrame with twilight times for the night.
+        summary_df     : DataFrame with summary information for the night.
+        mpc_code       : MPC code for the observatory.
+        im             : Flowable of the elevation chart.
+
+    Output
+        List of flowables.
+    """
+    night_str = twilight_times['night'].strftime('%Y-%b-%d')
+    sun_set, sun_rise = twilight_times['sun_set'], twilight_times['sun_rise']
+    twlt_set, twlt_rise = twilight_times['astronomical_set'], twilight_times['astronomical_rise']
+
+    # lunar_illum_val = summary_df['lunar_illum'].iloc[0] #They're all the same anyway
+    lunar_illum_val = twilight_times['lunar_illum']
+
     styles = getSampleStyleSheet()
     story = []
        
@@ -45,8 +103,6 @@ def create_elevation_pdf(twilight_times,summary_df,mpc_code,pdf_path):
     # lunar_illum_float = lunar_illum if isinstance(lunar_illum, (float,int)) else lunar_illum.to_value()
 
     #===Figure===
-    im = Image(fig_name)
-    im._restrictSize(450, 300)  # max width and height in points
     story.append(im)
     story.append(Spacer(1, 12))
 
@@ -117,9 +173,52 @@ def create_elevation_pdf(twilight_times,summary_df,mpc_code,pdf_path):
     table.setStyle(style)
     story.append(table)
 
-    doc.build(story)
-    
-    return
+    return story
+
+class ChartImage(Flowable):
+    """
+    Image flowable that only gets its PNG data when it is laid out, and releases it once
+    drawn, so that a document with many charts holds one at a time.
+
+    Inputs
+        load       : Function returning the PNG data, called once.
+        max_width  : Maximum width of the image (points).
+        max_height : Maximum height of the image (points).
+    """
+    def __init__(self, load, max_width, max_height):
+        super().__init__()
+        self.load       = load
+        self.max_width  = max_width
+        self.max_height = max_height
+        self.image      = None
+
+    def _image(self):
+        if self.image is None:
+            self.image = Image(io.BytesIO(self.load()))
+            self.image._restrictSize(self.max_width, self.max_height)
+        return self.image
+
+    def wrap(self, availWidth, availHeight):
+        return self._image().wrap(availWidth, availHeight)
+
+    def drawOn(self, canvas, x, y, _sW=0):
+        self._image().drawOn(canvas, x, y, _sW)
+        self.image, self.load = None, None
+
+class PageMarker(Flowable):
+    """
+    Empty flowable recording the (0-based) page it is drawn on, as pages[key].
+    """
+    def __init__(self, pages, key):
+        super().__init__()
+        self.pages = pages
+        self.key   = key
+
+    def wrap(self, availWidth, availHeight):
+        return 0, 0
+
+    def draw(self):
+        self.pages[self.key] = self.canv.getPageNumber() - 1
 
 def create_summary_pdf(pdf_name,tmpdir_path):
     """
@@ -162,7 +261,7 @@ def create_summary_pdf(pdf_name,tmpdir_path):
     story.append(PageBreak())
     
     # Then append all other targets
-    target_summaries = list(tmpdir_path.glob('summary_*'))
+    target_summaries = sorted(tmpdir_path.glob('summary_*'))
     for i, fig in enumerate(target_summaries):
         
         obj_name = str(fig).split('_')[-1][:-4]
@@ -0,0 +1,244 @@
+import argparse
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+import requests
+from .outfmt import logger, console, error_exit
+from .cache import DEFAULT_CACHE_DIR
+
+
+# Resolution settings
+SBDB_URL              = 'https://ssd-api.jpl.nasa.gov/sbdb.api'
+NEGATIVE_MAX_AGE_DAYS = 30  # Unresolved names are looked up again after this (new names and designations)
+
+# Resolution status of a name
+RESOLVED  = 'resolved'   # Unique match, with an SPK-ID
+AMBIGUOUS = 'ambiguous'  # Several objects match the name
+UNKNOWN   = 'unknown'    # No object matches the name
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS names (
+    name     TEXT PRIMARY KEY,
+    status   TEXT NOT NULL,
+    spkid    TEXT,
+    fullname TEXT,
+    detail   TEXT,
+    updated  REAL NOT NULL
+)
+'''
+
+
+def sbdb_lookup(name:str, session:requests.Session=None, url:str=SBDB_URL) -> dict:
+    """
+    Looks up a target name in the JPL Small-Body Database.
+
+    Inputs
+        name    : Free-form target name, number or designation.
+        session : Optional HTTP session.
+        url     : SBDB API URL (default: SBDB_URL).
+
+    Output
+        Dictionary with the 'status' of the name (RESOLVED, AMBIGUOUS or UNKNOWN), and
+        its 'spkid', 'fullname' and a 'detail' message. Network errors and server
+        errors are raised (requests exceptions), as they are not a property of the name.
+    """
+    response = (session or requests).get(url, params={'sstr': name}, timeout=60)
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+    try:
+        data = response.json()
+    except ValueError:
+        response.raise_for_status()
+        raise requests.HTTPError(f'Invalid SBDB response for {name}', response=response)
+
+    if 'object' in data:
+        return {'status'   : RESOLVED,
+                'spkid'    : str(data['object']['spkid']),
+                'fullname' : data['object'].get('fullname', name),
+                'detail'   : None}
+    if 'list' in data:
+        matches = [f"{m.get('pdes', '')} {m.get('name') or ''}".strip() for m in data['list']]
+        return {'status'   : AMBIGUOUS,
+                'spkid'    : None,
+                'fullname' : None,
+                'detail'   : f"{len(matches)} matches ({', '.join(matches[:5])}{', ...' if len(matches) > 5 else ''})"}
+    return {'status'   : UNKNOWN,
+            'spkid'    : None,
+            'fullname' : None,
+            'detail'   : data.get('message', 'not found')}
+
+
+class NameIndex:
+    """
+    Persistent index of target names resolved to JPL SPK-IDs, stored in a SQLite
+    database next to the ephemeris cache.
+
+    Resolved names are kept, so later runs query Horizons by SPK-ID without a lookup.
+    Ambiguous and unknown names are kept as a negative cache for NEGATIVE_MAX_AGE_DAYS,
+    so they are skipped instead of being queried again on every run.
+    """
+
+    def __init__(self, cache_dir:Path=None, sbdb_url:str=SBDB_URL, negative_max_age_days:float=NEGATIVE_MAX_AGE_DAYS):
+        self.path     = Path(cache_dir or DEFAULT_CACHE_DIR) / 'names.sqlite'
+        self.sbdb_url = sbdb_url
+        self.negative_max_age_days = negative_max_age_days
+        self._lock       = threading.Lock()
+        self._name_locks = {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._transaction() as con:
+            con.execute(SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        # One connection per transaction, so the index can be used from several threads
+        con = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                yield con
+                con.execute('COMMIT')
+            except BaseException:
+                con.execute('ROLLBACK')
+                raise
+        finally:
+            con.close()
+
+    def get(self, name:str) -> dict:
+        """
+        Returns the index entry of a name, or None if it is missing or an expired negative entry.
+        """
+        with self._transaction() as con:
+            row = con.execute('SELECT status, spkid, fullname, detail, updated FROM names WHERE name=?',
+                              (name,)).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(['status', 'spkid', 'fullname', 'detail', 'updated'], row))
+        if entry['status'] != RESOLVED and time.time() - entry['updated'] > self.negative_max_age_days * 86400:
+            return None
+        return entry
+
+    def put(self, name:str, entry:dict):
+        """
+        Stores the resolution of a name (a dictionary as returned by sbdb_lookup).
+        """
+        with self._transaction() as con:
+            con.execute('INSERT OR REPLACE INTO names VALUES (?,?,?,?,?,?)',
+                        (name, entry['status'], entry.get('spkid'), entry.get('fullname'),
+                         entry.get('detail'), time.time()))
+
+    def resolve(self, name:str, session:requests.Session=None) -> dict:
+        """
+        Resolves a name from the index, looking it up in the SBDB if needed.
+
+        Inputs
+            name    : Free-form target name.
+            session : Optional HTTP session for the lookup.
+
+        Output
+            Index entry of the name (see sbdb_lookup). Network errors are raised and
+            nothing is stored.
+        """
+        # Concurrent lookups of a name (e.g. one per site) wait for the first one
+        with self._lock:
+            name_lock = self._name_locks.setdefault(name, threading.Lock())
+        with name_lock:
+            entry = self.get(name)
+            if entry is not None:
+                return entry
+            entry = sbdb_lookup(name, session, self.sbdb_url)
+            self.put(name, entry)
+        logger.debug(f"Resolved {name}: {entry['status']} {entry['spkid'] or entry['detail']}")
+        return entry
+
+    def entries(self) -> list[tuple]:
+        """All entries, as (name, status, spkid, fullname, detail, updated) tuples."""
+        with self._transaction() as con:
+            return con.execute('SELECT * FROM names ORDER BY name').fetchall()
+
+    def forget(self, name:str) -> int:
+        """Removes a name, so it is looked up again. Returns the number of entries removed."""
+        with self._transaction() as con:
+            return con.execute('DELETE FROM names WHERE name=?', (name,)).rowcount
+
+    def clear(self, negative_only:bool=False) -> int:
+        """Removes all entries (or only the negative ones), returning the number removed."""
+        with self._transaction() as con:
+            if negative_only:
+                return con.execute('DELETE FROM names WHERE status!=?', (RESOLVED,)).rowcount
+            return con.execute('DELETE FROM names').rowcount
+
+
+def name_index(cache_dir:Path=None, horizons_url:str=None, sbdb_url:str=None) -> NameIndex:
+    """
+    Name index of a run. Names are looked up in the SBDB of JPL, or at sbdb_url. With a
+    Horizons stand-in (horizons_url) and no sbdb_url, names would still be looked up at
+    JPL, so there is no index and targets are queried by name.
+
+    Inputs
+        cache_dir    : Cache directory (default: DEFAULT_CACHE_DIR).
+        horizons_url : URL replacing the JPL Horizons API URL, if any.
+        sbdb_url     : URL replacing the SBDB API URL, if any.
+
+    Output
+        NameIndex object, or None.
+    """
+    if horizons_url is not None and sbdb_url is None:
+        logger.debug('Horizons stand-in without an SBDB URL, targets are queried by name')
+        return None
+    return NameIndex(cache_dir, sbdb_url or SBDB_URL)
+
+
+def parse_args() -> argparse.Namespace:
+    '''
+    Parse command line arguments for the name index management script.
+
+    Returns:
+        Parsed command line arguments.
+    '''
+    parser = argparse.ArgumentParser(description='Manage the pyObsFind target name index')
+    parser.add_argument('--cache-dir', type=Path,
+                        help=f'Cache directory. Default: {DEFAULT_CACHE_DIR}')
+    parser.add_argument('--sbdb-url', type=str, default=SBDB_URL,
+                        help=f'SBDB API URL to look names up at. Default: {SBDB_URL}')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('list', help='Show the indexed names')
+    resolve = sub.add_parser('resolve', help='Resolve a name, looking it up if needed')
+    resolve.add_argument('name', type=str)
+    forget = sub.add_parser('forget', help='Remove a name so it is looked up again')
+    forget.add_argument('name', type=str)
+    clear = sub.add_parser('clear', help='Remove all names')
+    clear.add_argument('--negative', action='store_true',
+                       help='Only remove ambiguous and unknown names')
+
+    return parser.parse_args()
+
+
+def main():
+    args  = parse_args()
+    names = NameIndex(args.cache_dir, args.sbdb_url)
+
+    if args.command == 'list':
+        for name, status, spkid, fullname, detail, updated in names.entries():
+            console.print(f"{name}: {status} {spkid or ''} {fullname or detail or ''}")
+
+    elif args.command == 'resolve':
+        try:
+            entry = names.resolve(args.name)
+        except requests.RequestException as err:
+            error_exit(f'Lookup failed for {args.name}: {err}')
+        console.print(f"{args.name}: {entry['status']} {entry['spkid'] or ''} {entry['fullname'] or entry['detail'] or ''}")
+
+    elif args.command == 'forget':
+        logger.info(f'Removed {names.forget(args.name)} entries')
+
+    elif args.command == 'clear':
+        logger.info(f'Removed {names.clear(args.negative)} entries')
+
+    return
+
+if __name__ == '__main__':
+    main()
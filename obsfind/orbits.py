@@ -0,0 +1,328 @@
+import re
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from rich.progress import Progress
+from .outfmt import console, logger
+from . import almanac
+
+
+# Propagation settings
+GM_SUN       = 0.01720209895**2  # Gaussian gravitational constant squared (au^3/day^2)
+TT_MINUS_UTC = 69.184 / 86400    # TT - UTC (days), constant since 2017
+MOTION_DT    = 1 / 1440          # Time step used for the sky motion rate (days)
+CHUNK_SIZE   = 2_000_000         # Maximum number of object x epoch values propagated at once
+
+# Columns of the MPC orbit (MPCORB) format: https://www.minorplanetcenter.net/iau/info/MPOrbitFormat.html
+MPCORB_COLUMNS = {'H'     : (8, 13),
+                  'G'     : (14, 19),
+                  'epoch' : (20, 25),
+                  'M'     : (26, 35),
+                  'peri'  : (37, 46),
+                  'node'  : (48, 57),
+                  'incl'  : (59, 68),
+                  'e'     : (70, 79),
+                  'n'     : (80, 91),
+                  'a'     : (92, 103)}
+READABLE_DESIGNATION = (166, 194)
+
+# Comet designations (e.g. 1P, 12P/Wild, C/2023 A3, P/2019 LD2), which MPCORB-style files do not describe
+COMET_DESIGNATION = re.compile(r'(\d+[PDI](/.*)?|[PCDXI]/.+)', re.IGNORECASE)
+
+
+def unpack_epoch(packed:str) -> float:
+    """
+    Converts an MPC packed epoch (e.g. 'K2555' for 2025 May 5.0) to a Julian date (TT).
+    """
+    century = {'I': 18, 'J': 19, 'K': 20}[packed[0]]
+    year    = century*100 + int(packed[1:3])
+    digits  = '0123456789ABCDEFGHIJKLMNOPQRSTUV'
+    month   = digits.index(packed[3])
+    day     = digits.index(packed[4])
+    return almanac.datetime_to_jd(np.datetime64(f'{year:04d}-{month:02d}-{day:02d}')).item()
+
+
+def designation_keys(readable:str) -> list[str]:
+    """
+    Names an object can be looked up by, from its readable designation
+    (e.g. '(846) Lipperta' gives ['846', 'lipperta'], '1997 AE12' gives ['1997 ae12']).
+    """
+    readable = readable.strip()
+    numbered = re.match(r'\((\d+)\)\s*(.*)', readable)
+    if numbered:
+        return [k.lower() for k in numbered.groups() if k]
+    return [readable.lower()]
+
+
+def is_comet(target:str) -> bool:
+    """
+    Checks if a target name is a comet designation (e.g. '1P/Halley' or 'C/2023 A3').
+    """
+    return COMET_DESIGNATION.fullmatch(target.strip()) is not None
+
+
+def read_elements(elements_file:Path, target_list:list[str]) -> pd.DataFrame:
+    """
+    Reads the osculating elements of the targets from an MPCORB-style file
+    (e.g. MPCORB.DAT from https://www.minorplanetcenter.net/iau/MPCORB.html).
+    Targets are matched by number, name or provisional designation. Comets are not
+    supported: comet designations and orbits that are not elliptical are skipped.
+
+    Inputs
+        elements_file : Path to the orbit file.
+        target_list   : list of target names (strings).
+
+    Output
+        DataFrame with the elements of each target found, indexed by target name.
+    """
+    comets = [t for t in target_list if is_comet(t)]
+    if comets:
+        logger.warning(f'Comets are not supported by the elements backend, skipping: {", ".join(comets)}')
+    wanted = {t.strip().lower(): t for t in target_list if not is_comet(t)}
+    rows   = {}
+    with open(elements_file, 'r') as f:
+        for line in f:
+            if len(line) < 103 or not line[MPCORB_COLUMNS['a'][0]:MPCORB_COLUMNS['a'][1]].strip():
+                continue
+            for key in designation_keys(line[READABLE_DESIGNATION[0]:READABLE_DESIGNATION[1]]):
+                if key in wanted and wanted[key] not in rows:
+                    rows[wanted[key]] = line
+
+    missing = [t for t in wanted.values() if t not in rows]
+    if missing:
+        logger.warning(f'No orbital elements in {elements_file} for: {", ".join(missing)}')
+
+    elements = []
+    for target, line in rows.items():
+        try:
+            el = {col: float(line[i:j]) if col != 'epoch' else unpack_epoch(line[i:j].strip())
+                  for col, (i,j) in MPCORB_COLUMNS.items()}
+        except (ValueError, KeyError):
+            logger.warning(f'Cannot read orbital elements of {target}')
+            continue
+        if not 0 <= el['e'] < 1:
+            logger.warning(f'Skipping {target}: only elliptical orbits are supported (e = {el["e"]})')
+            continue
+        el['target'] = target
+        el['targetname'] = line[READABLE_DESIGNATION[0]:READABLE_DESIGNATION[1]].strip()
+        elements.append(el)
+
+    return pd.DataFrame(elements, columns=['target', 'targetname', *MPCORB_COLUMNS]).set_index('target')
+
+
+def heliocentric_position(elements:pd.DataFrame, jd_tt:np.ndarray) -> np.ndarray:
+    """
+    Two-body heliocentric equatorial positions of all objects at all epochs at once.
+
+    Inputs
+        elements : DataFrame with the elements of N objects.
+        jd_tt    : Array of Julian dates (TT), either shape (T,) or (N, T).
+
+    Output
+        Array (N, T, 3) of positions in au.
+    """
+    col = lambda c: elements[c].to_numpy()[:, None]
+    e, a = col('e'), col('a')
+    n    = np.sqrt(GM_SUN / a**3)
+    M    = np.deg2rad(col('M')) + n*(jd_tt - col('epoch'))
+    M    = np.mod(M + np.pi, 2*np.pi) - np.pi
+
+    # Solve Kepler's equation (elliptical orbits) with Newton iterations
+    E = np.where(e < 0.8, M, np.pi*np.sign(M))
+    for _ in range(30):
+        dE = (E - e*np.sin(E) - M) / (1 - e*np.cos(E))
+        E -= dE
+        if np.nanmax(np.abs(dE)) < 1e-12:
+            break
+
+    # Position in the orbital plane, rotated to ecliptic then equatorial coordinates
+    x = a*(np.cos(E) - e)
+    y = a*np.sqrt(1 - e**2)*np.sin(E)
+    w, node, incl = np.deg2rad(col('peri')), np.deg2rad(col('node')), np.deg2rad(col('incl'))
+    cw, sw, cn, sn, ci, si = np.cos(w), np.sin(w), np.cos(node), np.sin(node), np.cos(incl), np.sin(incl)
+    ecl = np.stack([(cw*cn - sw*sn*ci)*x + (-sw*cn - cw*sn*ci)*y,
+                    (cw*sn + sw*cn*ci)*x + (-sw*sn + cw*cn*ci)*y,
+                    (sw*si)*x + (cw*si)*y], axis=-1)
+    return almanac.ecliptic_to_equatorial(ecl)
+
+
+def airmass_at(alt:np.ndarray) -> np.ndarray:
+    """
+    Airmass (plane-parallel) at altitudes in degrees, NaN below the horizon as in Horizons.
+    """
+    return np.where(alt > 0, 1 / np.sin(np.deg2rad(np.clip(alt, 1e-3, None))), np.nan)
+
+
+def hg_magnitude(H:np.ndarray, G:np.ndarray, r:np.ndarray, delta:np.ndarray, alpha:np.ndarray) -> np.ndarray:
+    """
+    Apparent V magnitude from the IAU H,G phase function.
+
+    Inputs
+        H, G   : Absolute magnitude and slope parameter.
+        r      : Heliocentric distance (au).
+        delta  : Observer distance (au).
+        alpha  : Phase angle (degrees).
+    """
+    tan_half = np.tan(np.deg2rad(alpha) / 2)
+    phi1 = np.exp(-3.33 * tan_half**0.63)
+    phi2 = np.exp(-1.87 * tan_half**1.22)
+    return H + 5*np.log10(r*delta) - 2.5*np.log10((1 - G)*phi1 + G*phi2)
+
+
+def topocentric(elements:pd.DataFrame, jd:np.ndarray, earth:np.ndarray, observer:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Light-time corrected topocentric and heliocentric positions of all objects.
+
+    Inputs
+        elements : DataFrame with the elements of N objects.
+        jd       : Array (T,) of Julian dates (UTC).
+        earth    : Array (T, 3) of heliocentric positions of the Earth (au).
+        observer : Array (T, 3) of geocentric positions of the observatory (au).
+
+    Output
+        Topocentric and heliocentric positions, arrays (N, T, 3) in au.
+    """
+    jd_tt = jd + TT_MINUS_UTC
+    helio = heliocentric_position(elements, jd_tt)
+    rho   = helio - earth - observer
+    # One light-time iteration is enough at the accuracy of this backend
+    helio = heliocentric_position(elements, jd_tt - np.linalg.norm(rho, axis=-1) / almanac.C_AU_DAY)
+    return helio - earth - observer, helio
+
+
+def elements_ephemerides(elements_file:Path, target_list:list[str], site:dict, epochs:dict, skip_daylight:bool=True) -> list[pd.DataFrame]:
+    """
+    Computes ephemerides for a list of targets by two-body propagation of the osculating
+    elements in a local MPCORB-style file, and for the moon from low precision formulae.
+    All objects are propagated at once with NumPy, so this is suited to screening long
+    target lists; use the Horizons backend for accurate ephemerides, and for comets,
+    which are not supported.
+
+    Inputs
+        elements_file : Path to the orbit file.
+        target_list   : list of target names (strings).
+        site          : Dictionary with the site 'Longitude', 'cos' and 'sin' parallax constants.
+        epochs        : Dictionary with 'start', 'stop', and 'step' keys for the time range.
+        skip_daylight : Drop target epochs with the Sun above the horizon (default: True).
+
+    Output
+        List of ephemeris DataFrames in the same order as target_list, followed by the moon,
+        with the same columns as the Horizons ephemerides used by the pipeline.
+    """
+    eph_list = [pd.DataFrame()] * (len(target_list) + 1)
+    for i, eph in iter_elements_ephemerides(elements_file, target_list, site, epochs, skip_daylight):
+        eph_list[i] = eph
+    return eph_list
+
+
+def iter_elements_ephemerides(elements_file:Path, target_list:list[str], site:dict, epochs:dict, skip_daylight:bool=True):
+    """
+    Generator version of elements_ephemerides, yielding each ephemeris as soon as its
+    chunk of orbits is propagated, so that they need not all be held at once.
+
+    Inputs
+        As elements_ephemerides.
+
+    Output
+        Yields (index, DataFrame) pairs, where index is the position of the target in
+        target_list, or len(target_list) for the moon, which comes first. Targets
+        missing from the orbit file are not yielded.
+    """
+    if not Path(elements_file).is_file():
+        raise FileNotFoundError(f'Cannot find {elements_file}')
+    elements = read_elements(elements_file, target_list)
+
+    times = pd.date_range(epochs['start'], epochs['stop'], freq=epochs['step'])
+    jd    = almanac.datetime_to_jd(times)
+    lon, rho_cos_phi, rho_sin_phi = site['Longitude'], site['cos'], site['sin']
+    lat   = np.rad2deg(np.arctan2(rho_sin_phi, rho_cos_phi))
+    lst   = almanac.local_sidereal_time(jd, lon)
+
+    # Geometry shared by all objects
+    sun      = almanac.sun_position(jd)
+    earth    = -sun
+    observer = almanac.observer_position(jd, lon, rho_cos_phi, rho_sin_phi)
+    moon     = almanac.moon_position(jd) - observer
+    sun_alt  = almanac.altitude(sun - observer, jd, lst, lat)
+    later    = jd + MOTION_DT
+    earth_later    = -almanac.sun_position(later)
+    observer_later = almanac.observer_position(later, lon, rho_cos_phi, rho_sin_phi)
+
+    moon_eph = moon_ephemeris(jd, times, moon, sun - observer, lst, lat)
+    yield len(target_list), moon_eph
+    index = {target: i for i, target in enumerate(target_list)}
+
+    # Propagate objects in chunks to bound memory
+    chunk = max(1, CHUNK_SIZE // max(len(jd), 1))
+    with Progress(console=console, transient=True) as pb:
+        t1 = pb.add_task('Propagating orbits', total=len(elements))
+        for i in range(0, len(elements), chunk):
+            el = elements.iloc[i:i+chunk]
+            rho, helio  = topocentric(el, jd, earth, observer)
+            rho_later,_ = topocentric(el, later, earth_later, observer_later)
+
+            ra, dec = almanac.radec(rho)
+            alt     = almanac.altitude(rho, jd, lst, lat)
+            delta   = np.linalg.norm(rho, axis=-1)
+            r       = np.linalg.norm(helio, axis=-1)
+            alpha   = almanac.angle_between(-helio, -rho)
+            V       = hg_magnitude(el['H'].to_numpy()[:, None], el['G'].to_numpy()[:, None], r, delta, alpha)
+            motion  = almanac.angle_between(rho, rho_later) * 3600 / (MOTION_DT * 1440)
+            elong   = almanac.angle_between(rho, moon)
+            airmass = airmass_at(alt)
+
+            for j, target in enumerate(el.index):
+                keep = sun_alt < 0 if skip_daylight else slice(None)
+                yield index[target], pd.DataFrame({
+                    'targetname'  : el['targetname'].iloc[j],
+                    'datetime_str': times[keep],
+                    'datetime_jd' : jd[keep],
+                    'H'           : el['H'].iloc[j],
+                    'G'           : el['G'].iloc[j],
+                    'RA'          : ra[j][keep],
+                    'DEC'         : dec[j][keep],
+                    'airmass'     : airmass[j][keep],
+                    'V'           : V[j][keep],
+                    'alpha'       : alpha[j][keep],
+                    'lunar_elong' : elong[j][keep],
+                    'lunar_illum' : moon_eph['lunar_illum'].to_numpy()[keep],
+                    'Sky_motion'  : motion[j][keep],
+                    'target'      : target,
+                })
+            pb.update(t1, advance=len(el))
+
+    logger.debug(f'Propagated {len(elements)} orbits over {len(jd)} epochs')
+
+
+def moon_ephemeris(jd:np.ndarray, times:pd.DatetimeIndex, moon:np.ndarray, sun:np.ndarray, lst:np.ndarray, lat:float) -> pd.DataFrame:
+    """
+    Ephemeris of the moon with the columns used by the pipeline.
+
+    Inputs
+        jd    : Array (T,) of Julian dates (UTC).
+        times : Epochs matching jd.
+        moon  : Array (T, 3) of topocentric positions of the moon (au).
+        sun   : Array (T, 3) of topocentric positions of the Sun (au).
+        lst   : Array (T,) of local sidereal times (radians).
+        lat   : Latitude of the site (degrees).
+
+    Output
+        DataFrame with the moon ephemeris.
+    """
+    ra, dec = almanac.radec(moon)
+    alt     = almanac.altitude(moon, jd, lst, lat)
+    phase   = almanac.angle_between(sun - moon, -moon)
+    delta   = np.linalg.norm(moon, axis=-1)
+    return pd.DataFrame({
+        'targetname'  : 'Moon (301)',
+        'datetime_str': times,
+        'datetime_jd' : jd,
+        'RA'          : ra,
+        'DEC'         : dec,
+        'airmass'     : airmass_at(alt),
+        # Allen's lunar phase curve
+        'V'           : 0.23 + 5*np.log10(delta) + 0.026*phase + 4e-9*phase**4,
+        'alpha'       : phase,
+        'lunar_illum' : 100 * (1 + np.cos(np.deg2rad(phase))) / 2,
+        'target'      : 'Moon',
+    })
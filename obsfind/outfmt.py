@@ -3,7 +3,6 @@ from rich.console import Console
 from rich.logging import RichHandler
 from rich.theme import Theme
 import sys
-from pathlib import Path
 
 #Error message output
 def error_exit(message:str):
@@ -18,12 +17,9 @@ def error_exit(message:str):
     logger.error(message)
     sys.exit(1)
 
-def df2csv(df,base_name,file_name,contents):
-    # Save csv in output file
-    output_path = Path(f'./{base_name}{file_name}').resolve()
-    df.to_csv(output_path)
-    logger.info(f"{contents} saved to {output_path}")
-    return
+def memory_mb(df) -> float:
+    # Memory footprint of a DataFrame, including the contents of object columns
+    return df.memory_usage(deep=True).sum() / 1024**2
 
 custom_theme = Theme({
     'logging.level.debug': 'green',
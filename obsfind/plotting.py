@@ -3,7 +3,9 @@ import numpy as np
 import pandas as pd
 import itertools
 import matplotlib.dates as mdates
+from matplotlib.patches import Rectangle
 from .outfmt import logger
+from .rowindex import target_blocks
 
 def marker_list(target_names):
     """
@@ -29,9 +31,11 @@ def marker_list(target_names):
     return target_plot_info
 
 
-def elevation_chart(twilight_times, eph_night, target_plot_info, elevation_limit, show_plot=False, fig_path='./temp_airmass'):
+def elevation_chart(twilight_times, eph_night, target_plot_info, elevation_limit, show_plot=False, fig_path='./temp_airmass',
+                    png_buffer=None):
     """
-    Creates an elevation chart for a given night.
+    Creates an elevation chart for a given night. To chart several nights, use an
+    ElevationChart, which builds the figure once.
     
     Inputs
         twilight_times : DataFrame with twilight times for the night.
@@ -40,79 +44,165 @@ def elevation_chart(twilight_times, eph_night, target_plot_info, elevation_limit
         elevation_limit : Minimum elevation limit for plotting.
         show_plot      : Boolean to show the plot (default: False).
         fig_path       : Path to save the figure (default: './temp_airmass').
+        png_buffer     : Optional file-like object to write the PNG to instead of fig_path.
 
     Output
-        Saves the elevation chart as a PNG file if fig_path is provided.
+        Saves the elevation chart as a PNG file if fig_path or png_buffer is provided.
     """
-    night = twilight_times['night']
+    chart = ElevationChart(target_plot_info, elevation_limit)
+    chart.render(twilight_times, eph_night, fig_path=fig_path, png_buffer=png_buffer)
+    if show_plot:
+        plt.show()
+    chart.close()
 
-    # Create figure
-    fig, ax = plt.subplots(figsize=(22,15))
-    ax = plt.gca()
+    return
 
-    elevation_ticks = [tick for tick in np.arange(0, 91, 10) if tick>=elevation_limit]
-    airmass_values = 1 / np.sin(np.radians(elevation_ticks))
-    airmass_labels = [f'{a:.2f}' for a in airmass_values]
 
-    # Plot targets above threshold
-    for obj in eph_night['target'].unique():
-        
-        eph_night_tar = eph_night[eph_night.target==obj]
-
-        if obj == 'Moon':
-            eph_night_tar.plot(x='datetime_str', y='elevation',
-                            label='Moon', ax=ax,
-                            linestyle='--', color='black', marker='', lw=7, alpha=0.75)
-        else:
-            colour = target_plot_info[target_plot_info['targets']==obj]['colours'].values[0]
-            marker = target_plot_info[target_plot_info['targets']==obj]['markers'].values[0]
-            eph_night_tar.plot(x='datetime_str', y='elevation',
-                            label=obj, ax=ax,
-                            marker=marker, color=colour, markersize=8)
-    
-    #Check if times actually exist (Won't if never sets)
+class ElevationChart:
+    """
+    Elevation chart figure, built once and reused for every night of a run. The axes,
+    airmass scale, ticks and grid are set up once; each night only updates the target
+    lines, twilight spans, time axis and legend.
+
+    Inputs
+        target_plot_info : DataFrame with target names, markers, and colours.
+        elevation_limit  : Minimum elevation limit for plotting.
+    """
+    SPAN_ALPHAS = [.30, .20, .10, .10, .20, .30]  # Civil, nautical and astronomical twilight, evening and morning
+
+    def __init__(self, target_plot_info, elevation_limit):
+        self.styles = dict(zip(target_plot_info['targets'], zip(target_plot_info['markers'], target_plot_info['colours'])))
+        self.lines  = {}  # Line of each target, created when first plotted
+        self.legend = None
+
+        # Create figure
+        self.fig, self.ax = plt.subplots(figsize=(22,15))
+        self.subplot_params = {k: getattr(self.fig.subplotpars, k) for k in ['left', 'bottom', 'right', 'top']}
+        ax = self.ax
+
+        elevation_ticks = [tick for tick in np.arange(0, 91, 10) if tick>=elevation_limit]
+        airmass_values = 1 / np.sin(np.radians(elevation_ticks))
+        airmass_labels = [f'{a:.2f}' for a in airmass_values]
+
+        # Format plot
+        ax.xaxis_date()
+        ax.xaxis.set_major_formatter(plt.FuncFormatter(time_label))
+        ax.set_ylabel("Elevation", fontsize=20)
+        ax.set_ylim(elevation_limit,90)
+        ax.set_yticks(elevation_ticks)
+        ax.xaxis.set_ticks_position('both')
+        ax.yaxis.set_tick_params(direction='in', labelsize=20)
+        ax.xaxis.set_tick_params(labeltop=True, which='both', direction='in', labelsize=20)
+        ax.set_autoscale_on(False)
+        # Twilight spans over the full height, as axvspan draws them. The rectangles are made
+        # directly, as axvspan only returns a Rectangle (moved with set_x) from matplotlib 3.9
+        self.spans = [ax.add_patch(Rectangle((0, 0), 0, 1, alpha=alpha, transform=ax.get_xaxis_transform()))
+                      for alpha in self.SPAN_ALPHAS]
+        ax2 = ax.twinx()
+        ax2.set_ylim(ax.get_ylim())
+        ax2.set_yticks(elevation_ticks)
+        ax2.set_yticklabels(airmass_labels)
+        ax2.set_ylabel("Airmass", fontsize=20)
+        ax2.yaxis.set_tick_params(direction='in', labelsize=20)
+        ax2.grid(which='both',axis='both')
+
+    def _line(self, target):
+        if target not in self.lines:
+            if target == 'Moon':
+                style = dict(linestyle='--', color='black', marker='', lw=7, alpha=0.75)
+            else:
+                marker, colour = self.styles[target]
+                style = dict(marker=marker, color=colour, markersize=8)
+            self.lines[target], = self.ax.plot([], [], label=target, **style)
+        return self.lines[target]
+
+    def render(self, twilight_times, eph_night, fig_path=None, png_buffer=None):
+        """
+        Draws the chart of a night, and saves it.
+
+        Inputs
+            twilight_times : DataFrame with twilight times for the night.
+            eph_night      : DataFrame with ephemerides for the night.
+            fig_path       : Optional path to save the figure to, as 'elevation_YYYYMMDD.png'.
+            png_buffer     : Optional file-like object to write the PNG to instead of fig_path.
+        """
+        night = twilight_times['night']
+        ax    = self.ax
+
+        # Plot targets above threshold, in order of appearance
+        for line in self.lines.values():
+            line.set_visible(False)
+        handles = []
+        times, elevations = eph_night['datetime'].to_numpy(), eph_night['elevation'].to_numpy()
+        for i, (obj, rows) in enumerate(target_blocks(eph_night)):
+            line = self._line(obj)
+            line.set_data(times[rows], elevations[rows])
+            line.set_zorder(2 + i/1000)
+            line.set_visible(True)
+            handles.append(line)
+
+        #Check if times actually exist (Won't if never sets)
+        fill_twilight_times(twilight_times)
+        edges = mdates.date2num([twilight_times[col] for col in ['sun_set', 'civil_set', 'nautical_set', 'astronomical_set',
+                                                                 'astronomical_rise', 'nautical_rise', 'civil_rise', 'sun_rise']])
+        for span, start, stop in zip(self.spans, edges[[0, 1, 2, 4, 5, 6]], edges[[1, 2, 3, 5, 6, 7]]):
+            span.set_x(start)
+            span.set_width(stop - start)
+
+        # Time axis, with a tick every 1-3 hours depending on the length of the night
+        ax.set_xlabel(f"Universal Time (hours) - Night begins on {night.strftime('%d %b %Y')} UT", fontsize=20)
+        ax.set_xlim(edges[0], edges[-1])
+        ax.xaxis.set_major_locator(mdates.HourLocator(byhour=range(0, 24, max(1, int((edges[-1]-edges[0])*24 // 6)))))
+
+        if self.legend is not None:
+            self.legend.remove()
+        self.legend = ax.legend(handles=handles, loc='upper center', bbox_to_anchor=(0.5, -0.15),
+                                ncol=6, prop={'size': 20})
+
+        # Lay out from the initial subplot parameters, as tight_layout depends on the current ones
+        self.fig.subplots_adjust(**self.subplot_params)
+        self.fig.tight_layout()
+        if png_buffer is not None:
+            # Buffers are decoded again to build the PDF, so favour speed over size
+            self.fig.savefig(png_buffer, format='png', pil_kwargs={'compress_level': 1})
+        elif fig_path:
+            self.fig.savefig(f'{fig_path}/elevation_{night.strftime("%Y%m%d")}.png')
+
+        return
+
+    def close(self):
+        plt.close(self.fig)
+
+
+def time_label(x, pos=None):
+    # Hours, with the date at midnight
+    time = mdates.num2date(x)
+    return time.strftime('%H:%M\n%d-%b') if time.strftime('%H:%M') == '00:00' else time.strftime('%H:%M')
+
+
+def fill_twilight_times(twilight_times):
+    """
+    Fills the twilight times of a night that do not exist (the sun does not get that low)
+    with the previous one, in place.
+
+    Inputs
+        twilight_times : Series with twilight times for the night.
+
+    Output
+        twilight_times.
+    """
     set_list = ['sun_set', 'civil_set', 'nautical_set', 'astronomical_set']
     twilight_times[set_list] = twilight_times[set_list].apply(pd.to_datetime).ffill()
     rise_list = ['sun_rise', 'civil_rise', 'nautical_rise', 'astronomical_rise']
     twilight_times[rise_list] = twilight_times[rise_list].apply(pd.to_datetime).ffill()
+    return twilight_times
 
-    # Format plot
-    ax.axvspan(twilight_times['sun_set'].isoformat(), twilight_times['civil_set'].isoformat(), alpha=.30)
-    ax.axvspan(twilight_times['civil_set'].isoformat(), twilight_times['nautical_set'].isoformat(), alpha=.20)
-    ax.axvspan(twilight_times['nautical_set'].isoformat(), twilight_times['astronomical_set'].isoformat(), alpha=.10)
-    ax.axvspan(twilight_times['astronomical_rise'].isoformat(), twilight_times['nautical_rise'].isoformat(), alpha=.10)
-    ax.axvspan(twilight_times['nautical_rise'].isoformat(), twilight_times['civil_rise'].isoformat(), alpha=.20)
-    ax.axvspan(twilight_times['civil_rise'].isoformat(), twilight_times['sun_rise'].isoformat(), alpha=.30)
-    # ax.axhspan(0,elevation_limit,alpha=.5,color='grey')
-    ax.set_xlabel(f"Universal Time (hours) - Night begins on {night.strftime('%d %b %Y')} UT", fontsize=20)
-    ax.set_ylabel("Elevation", fontsize=20)
-    ax.set_ylim(elevation_limit,90)
-    ax.set_yticks(elevation_ticks)
-    ax.xaxis.set_ticks_position('both')
-    ax.yaxis.set_tick_params(direction='in', labelsize=20)
-    ax.xaxis.set_tick_params(labeltop=True, which='both', direction='in', labelsize=20)
-    ax.set_xlim(twilight_times['sun_set'].isoformat(), twilight_times['sun_rise'].isoformat())
-    ax2 = ax.twinx()
-    ax2.set_ylim(ax.get_ylim())
-    ax2.set_yticks(elevation_ticks)
-    ax2.set_yticklabels(airmass_labels)
-    ax2.set_ylabel("Airmass", fontsize=20)
-    ax2.yaxis.set_tick_params(direction='in', labelsize=20)
-
-    # ax.legend(bbox_to_anchor=(1.1, 1), loc='upper left',prop={'size': 20})
-    ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.15),
-              ncol=6, prop={'size': 20})
-
-    plt.grid(which='both',axis='both')
-    plt.tight_layout()
-    if fig_path:
-        plt.savefig(f'{fig_path}/elevation_{night.strftime("%Y%m%d")}.png')
-    if show_plot:
-        plt.show()
-    plt.close()
-
-    return
 
+def summary_file_name(target):
+    """
+    File name (without extension) of the summary chart of a target.
+    """
+    return f"summary_{target.replace(' ','').replace('C/','C')}"
 
 
 def summary_chart(night_summaries,target_plot_info,target=False,fig_path='./temp_summary'):
@@ -122,7 +212,9 @@ def summary_chart(night_summaries,target_plot_info,target=False,fig_path='./temp
     Inputs
         night_summaries  : DataFrame containing nightly summary data for each target,
                         including columns such as 'datetime_str', 'duration_hours',
-                        'Mag', 'alpha', 'Sky_motion', 'RA', and 'DEC'.
+                        'Mag', 'alpha', 'Sky_motion', 'RA', and 'DEC'. Rows grouped
+                        by target (e.g. the frame of a RowIndex) are sliced instead
+                        of searched.
         target_plot_info : DataFrame mapping targets to plot colours and markers.
                         Must contain 'targets', 'colours', and 'markers' columns.
         target           : (optional) Specific target name to plot. If provided,
@@ -141,25 +233,28 @@ def summary_chart(night_summaries,target_plot_info,target=False,fig_path='./temp
     #File names and plotting targets
     if target:
         targets_to_plot = [target]
-        file_name = f"summary_{target.replace(' ','').replace('C/','C')}"
+        file_name = summary_file_name(target)
     else:
-        targets_to_plot = night_summaries['target'].unique()
+        targets_to_plot = None
         file_name = "all_tar_summary"
 
-    #Create figure and plot
+    #Create figure and plot, with the rows of each target taken once
     date_fmt = mdates.DateFormatter('%m-%d')
     fig, axes = plt.subplots(nrows=3,ncols=2,figsize=(28,30))
+    blocks = dict(target_blocks(night_summaries))
+    if targets_to_plot is None:
+        targets_to_plot = list(blocks)
+    styles = dict(zip(target_plot_info['targets'], zip(target_plot_info['markers'], target_plot_info['colours'])))
     for obj in targets_to_plot:
         
-        tar_summary = night_summaries[night_summaries.target==obj]
+        tar_summary = night_summaries.iloc[blocks[obj]]
 
         # if obj == 'Moon':
             # eph_night_tar.plot(x='datetime_str', y='elevation',
                             # label='Moon', ax=ax,
                             # linestyle='--', color='black', marker='', lw=7, alpha=0.75)
         # else:
-        colour = target_plot_info[target_plot_info['targets']==obj]['colours'].values[0]
-        marker = target_plot_info[target_plot_info['targets']==obj]['markers'].values[0]
+        marker, colour = styles[obj]
         
         step = 3
         date = tar_summary['datetime_str'][::step]
@@ -0,0 +1,169 @@
+import json
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from .outfmt import logger
+
+
+# Bin edges of the latency histograms (seconds), the last bin is open
+HISTOGRAM_EDGES = [0, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50]
+
+# Profiler of the run, if profiling. The timers below only record anything while it is set
+_active = None
+
+
+class Profiler:
+    """
+    Profile of a run: the wall time, CPU time and peak memory of each stage, and the
+    durations of repeated operations within the stages (e.g. each Horizons call or the
+    rendering of each night), observed with the timer and observe functions.
+
+    With memory, the peak memory of each stage is that of the allocations traced by
+    tracemalloc during the stage, which include Python objects and numpy arrays but not
+    the internal buffers of C libraries. Tracing slows allocation heavy stages down, so it
+    is off by default and the times are those of a run without profiling. The peak
+    resident memory of the process so far is always recorded (where the platform has it).
+
+    Inputs
+        cprofile : Also run cProfile on each stage, keeping the statistics of the slowest.
+        memory   : Trace the peak memory of each stage with tracemalloc.
+    """
+
+    def __init__(self, cprofile:bool=False, memory:bool=False):
+        self.cprofile = cprofile
+        self.memory   = memory
+        self.stages   = []
+        self.timings  = defaultdict(list)
+        self._lock    = threading.Lock()
+        self._slowest = None
+        self._start   = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name:str):
+        """Profiles the code of a with block as a stage of the run."""
+        profile = None
+        if self.cprofile:
+            import cProfile
+            profile = cProfile.Profile()
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            wall = time.perf_counter() - wall
+            cpu  = time.process_time() - cpu
+            rss = max_rss_mb()
+            self.stages.append({'stage'      : name,
+                                'wall_s'     : round(wall, 4),
+                                'cpu_s'      : round(cpu, 4),
+                                'peak_mb'    : round(tracemalloc.get_traced_memory()[1] / 2**20, 1) if self.memory else None,
+                                'max_rss_mb' : round(rss, 1) if rss is not None else None})
+            if profile is not None and (self._slowest is None or wall > self._slowest[1]):
+                self._slowest = (name, wall, profile)
+
+    def observe(self, kind:str, seconds:float, key:str=None):
+        """Records the duration of an operation of a kind, with an optional key (e.g. the night)."""
+        with self._lock:
+            self.timings[kind].append((key, seconds))
+
+    def report(self) -> dict:
+        """Profile as a dictionary, with the statistics and histogram of each kind of operation."""
+        timings = {}
+        for kind, observed in self.timings.items():
+            seconds = np.array([s for _, s in observed])
+            counts  = np.histogram(seconds, bins=HISTOGRAM_EDGES + [max(seconds.max(), HISTOGRAM_EDGES[-1]) + 1])[0]
+            timings[kind] = {'count'     : len(seconds),
+                             'total_s'   : round(float(seconds.sum()), 4),
+                             'min_s'     : round(float(seconds.min()), 4),
+                             'median_s'  : round(float(np.median(seconds)), 4),
+                             'p90_s'     : round(float(np.percentile(seconds, 90)), 4),
+                             'max_s'     : round(float(seconds.max()), 4),
+                             'histogram' : [{'from_s': edge, 'count': int(count)}
+                                            for edge, count in zip(HISTOGRAM_EDGES, counts)]}
+            if any(key is not None for key, _ in observed):
+                timings[kind]['by_key'] = [{'key': key, 'seconds': round(s, 4)} for key, s in observed]
+        return {'python'   : platform.python_version(),
+                'platform' : platform.platform(),
+                'wall_s'   : round(time.perf_counter() - self._start, 4),
+                'stages'   : self.stages,
+                'timings'  : timings,
+                'cprofile' : self._slowest[0] if self._slowest else None}
+
+    def write(self, path:Path, cprofile_path:Path=None):
+        """
+        Writes the report as JSON, and the cProfile statistics of the slowest stage
+        (readable with pstats or snakeviz) if profiled.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        logger.info(f'Profile saved to {Path(path).resolve()}')
+        if self._slowest is not None and cprofile_path is not None:
+            self._slowest[2].dump_stats(cprofile_path)
+            logger.info(f'cProfile of the {self._slowest[0]} stage saved to {Path(cprofile_path).resolve()}')
+
+
+def max_rss_mb() -> float:
+    """Peak resident memory of the process so far (MB), None where it is not available (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+def start(cprofile:bool=False, memory:bool=False) -> Profiler:
+    """Starts profiling the run, so the timers record into the returned Profiler."""
+    global _active
+    _active = Profiler(cprofile, memory)
+    return _active
+
+
+def stop():
+    """Stops profiling the run."""
+    global _active
+    _active = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+@contextmanager
+def stage(name:str):
+    """Profiles a with block as a stage of the run, if profiling."""
+    if _active is None:
+        yield
+        return
+    with _active.stage(name):
+        yield
+
+
+def observe(kind:str, seconds:float, key:str=None):
+    """Records the duration of an operation, if profiling."""
+    if _active is not None:
+        _active.observe(kind, seconds, key)
+
+
+@contextmanager
+def timer(kind:str, key:str=None):
+    """Records the duration of a with block as an operation, if profiling."""
+    if _active is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _active.observe(kind, time.perf_counter() - start, key)
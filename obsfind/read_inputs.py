@@ -1,11 +1,15 @@
 import argparse
 import logging
+import re
+from typing import TYPE_CHECKING
 from .outfmt import logger
 from pathlib import Path
 import numpy as np
-from astropy.time import Time, TimeDelta
-from astroquery.mpc import MPC as MPC_query
 from .outfmt import logger, error_exit
+from .checkpoint import CHECKPOINT_STAGES
+# astropy and the site registry are imported when needed, so --help starts fast
+if TYPE_CHECKING:
+    from astropy.time import Time
 
 
 # Configure default parameters
@@ -13,6 +17,11 @@ DEFAULT_MPC_CODE        = '809'  # Observatory MPC code
 DEFAULT_ELEVATION_LIMIT = 30     # Minimum elevation angle (degrees)
 DEFAULT_TIME_VISIBLE    = 1      # Minimum time visible (hours)
 DEFAULT_MAG_LIMIT       = 22     # Maximum magnitude limit
+DEFAULT_WORKERS         = 1      # Concurrent Horizons queries
+DEFAULT_JOBS            = 1      # Processes rendering the nightly charts
+DEFAULT_STEP            = 15     # Ephemeris step (minutes)
+MAX_STEP                = 60     # Longest step the elevation interpolation is trusted for (minutes)
+OUTPUTS                 = ['eph', 'summary', 'elevation-pdf', 'summary-pdf']  # Output files, all written by default
 
 
 def parse_args() -> argparse.Namespace:
@@ -40,7 +49,7 @@ def parse_args() -> argparse.Namespace:
 
     mpc_group = parser.add_argument_group('Optional MPC code input: https://www.minorplanetcenter.net/iau/lists/ObsCodes.html')
     mpc_group.add_argument('-mpc', '--mpc-code', type=str,
-                           help=f'Location for observation site: default = {DEFAULT_MPC_CODE}')
+                           help=f'Location for observation site, or a comma separated list of sites (e.g. 809,I11): default = {DEFAULT_MPC_CODE}')
 
     limit_group = parser.add_argument_group('Optional inputs for limits')
     limit_group.add_argument('-mag', '--mag-limit', type=str,
@@ -51,10 +60,70 @@ def parse_args() -> argparse.Namespace:
                                    help=f'Maximum airmass to be observable [float]. Use this only if no elevation is specified.')
     limit_group.add_argument('-tvis', '--time-visible-limit', type=str,
                                    help=f'Minimum time visible per night to be included in observable list [float]. Default: {DEFAULT_TIME_VISIBLE}')
+    limit_group.add_argument('--moon-sep', type=str,
+                                   help='Minimum separation from the moon to be observable, in degrees [float]. Default: none')
+    limit_group.add_argument('--max-motion', type=str,
+                                   help='Maximum rate of motion on the sky to be observable, in arcsec/min [float]. Default: none')
+    limit_group.add_argument('--max-hour-angle', type=str,
+                                   help='Maximum absolute hour angle to be observable, in hours [float]. Default: none')
+    limit_group.add_argument('--min-dark', type=str,
+                                   help='Minimum time observable between astronomical twilights per night, in hours [float]. Default: none')
     
+    eph_group = parser.add_argument_group('Optional ephemeris source inputs')
+    eph_group.add_argument('--backend', type=str, choices=['horizons', 'elements'], default='horizons',
+                           help='Ephemeris source: JPL Horizons (accurate) or two-body propagation of local orbital elements (fast screening, no comets). Default: horizons')
+    eph_group.add_argument('--elements-file', type=Path,
+                           help='MPCORB-style orbital elements file for --backend elements')
+    eph_group.add_argument('--step', type=str,
+                           help=f'Ephemeris step, in minutes or hours (e.g. 15m, 1h). Crossings of the elevation limit are interpolated, so coarse steps keep accurate durations. Default: {DEFAULT_STEP}m')
+    eph_group.add_argument('--twilight', type=str, choices=['numpy', 'ephem'], default='numpy',
+                           help='Twilight times from a vectorized solar model (all nights at once) or pyephem (one night at a time). Default: numpy')
+
+    perf_group = parser.add_argument_group('Optional performance inputs')
+    perf_group.add_argument('-w', '--workers', type=str,
+                            help=f'Number of concurrent Horizons queries [int]. Default: {DEFAULT_WORKERS}')
+    perf_group.add_argument('-j', '--jobs', type=str,
+                            help=f'Number of processes rendering the nightly elevation pages [int]. Default: {DEFAULT_JOBS}')
+    perf_group.add_argument('--horizons-url', type=str,
+                            help='URL to send Horizons API queries to instead of JPL (e.g. a mirror or local stand-in server)')
+    perf_group.add_argument('--sbdb-url', type=str,
+                            help='URL to look target names up at instead of the JPL SBDB API. With --horizons-url and no --sbdb-url, names are not looked up')
+    perf_group.add_argument('--stream', action='store_true',
+                            help='Apply the cuts to each target as it arrives and only keep the surviving rows, to bound memory on long target lists')
+    perf_group.add_argument('--incremental', action='store_true',
+                            help='Extend the previous run with the same output base: only new targets and nights are computed, and only changed pages are rendered')
+    perf_group.add_argument('--profile', action='store_true',
+                            help='Write profile.json with the time and memory of each stage, the latency of each Horizons call and the render time of each night')
+    perf_group.add_argument('--cprofile', action='store_true',
+                            help='Also run cProfile on each stage and save the statistics of the slowest one to profile.prof (implies --profile)')
+    perf_group.add_argument('--profile-memory', action='store_true',
+                            help='Also trace the peak memory of each stage, which slows the run down (implies --profile)')
+
+    checkpoint_group = parser.add_argument_group('Optional checkpoint inputs')
+    checkpoint_group.add_argument('--checkpoint', action='store_true',
+                                  help='Save the output of each stage (twilight, ephemeris, cuts and summaries) to the run directory')
+    checkpoint_group.add_argument('--resume', action='store_true',
+                                  help='Continue the previous run with the same inputs from its last completed stage (implies --checkpoint)')
+    checkpoint_group.add_argument('--from-stage', type=str, choices=CHECKPOINT_STAGES,
+                                  help='Run again from this stage with the checkpoints of the earlier ones, e.g. render to remake the outputs without fetching (implies --checkpoint)')
+    checkpoint_group.add_argument('--run-dir', type=Path,
+                                  help='Directory of the checkpoints. Default: ./<output base>run')
+
+    cache_group = parser.add_argument_group('Optional ephemeris cache inputs. Manage with: python -m obsfind.cache')
+    cache_group.add_argument('--cache-dir', type=Path,
+                             help='Directory of the persistent ephemeris cache. Default: ~/.cache/obsfind')
+    cache_group.add_argument('--no-cache', action='store_true',
+                             help='Always query Horizons, without reading or updating the cache')
+
     file_group = parser.add_argument_group('Optional output file name base')
     file_group.add_argument('-out', '--output-base', type=str,
                             help=f'Optional name of the output files base.')    
+    file_group.add_argument('--outputs', type=str,
+                            help=f'Comma separated list of the output files to write, from {",".join(OUTPUTS)}. Default: all')
+    file_group.add_argument('--format', type=str, choices=['csv', 'parquet', 'feather'], default='csv',
+                            help='Format of the ephemeris and summary tables. Parquet and Feather keep the column types and need pyarrow. Default: csv')
+    file_group.add_argument('--compression', type=str,
+                            help='Compression of Parquet (snappy, zstd, gzip, brotli, lz4, none) or Feather (lz4, zstd, none) tables. Default: snappy for Parquet, lz4 for Feather')
     
     return parser.parse_args()
 
@@ -78,6 +147,26 @@ def check_type(name:str, val:str, req_type:type):
     return val
 
 
+def parse_step(step:str) -> str:
+    '''
+    Reads an ephemeris step given in minutes or hours (e.g. 15, 15m, 15min or 1h).
+
+    Inputs
+        step : Step to read.
+
+    Output
+        Horizons step string in minutes (e.g. '15min'). Raises ValueError if the step
+        cannot be read or is not between 1 and MAX_STEP minutes.
+    '''
+    match = re.fullmatch(r'(\d+)\s*(m|min|h|hr|hour)?', str(step).strip().lower())
+    if not match:
+        raise ValueError('must be a whole number of minutes or hours, e.g. 15m or 1h')
+    minutes = int(match[1]) * (60 if match[2] in ('h', 'hr', 'hour') else 1)
+    if not 1 <= minutes <= MAX_STEP:
+        raise ValueError(f'must be between 1 and {MAX_STEP} minutes')
+    return f'{minutes}min'
+
+
 def validate_args(args:argparse.Namespace) -> argparse.Namespace:
     '''
     Validates the arguments passed to the script.
@@ -98,6 +187,7 @@ def validate_args(args:argparse.Namespace) -> argparse.Namespace:
         error_exit(f'Cannot find {args.target_file}')
 
     # Check dates format
+    from astropy.time import Time
     try:
         args.start_date = Time(args.start_date, format='iso')
         args.end_date   = Time(args.end_date, format='iso')
@@ -141,29 +231,117 @@ def validate_args(args:argparse.Namespace) -> argparse.Namespace:
     else:
         error_exit('This message should not appear so it is time to cry')
 
-    # Check MPC codes
+    # Check optional constraints
+    for option in ['moon_sep', 'max_motion', 'max_hour_angle', 'min_dark']:
+        flag = '--' + option.replace('_', '-')
+        if getattr(args, option) is not None:
+            setattr(args, option, check_type(flag, getattr(args, option), float))
+            if getattr(args, option) <= 0:
+                error_exit(f'{flag} must be positive')
+    if args.max_hour_angle is not None and args.max_hour_angle > 12:
+        error_exit('--max-hour-angle must be at most 12')
+
+    # Check ephemeris backend
+    if args.backend == 'elements':
+        if not args.elements_file:
+            error_exit('--backend elements requires --elements-file')
+        if not args.elements_file.is_file():
+            error_exit(f'Cannot find {args.elements_file}')
+
+    # Check ephemeris step, as a Horizons step string in minutes
+    if not args.step:
+        args.step = f'{DEFAULT_STEP}min'
+    else:
+        try:
+            args.step = parse_step(args.step)
+        except ValueError as err:
+            error_exit(f'--step {err}')
+
+    # Check number of workers
+    if not args.workers:
+        args.workers = DEFAULT_WORKERS
+    else:
+        args.workers = check_type('--workers', args.workers, int)
+        if args.workers < 1:
+            error_exit('--workers must be at least 1')
+
+    # Check number of rendering processes
+    if not args.jobs:
+        args.jobs = DEFAULT_JOBS
+    else:
+        args.jobs = check_type('--jobs', args.jobs, int)
+        if args.jobs < 1:
+            error_exit('--jobs must be at least 1')
+
+    # Check MPC codes, as a list of unique sites
+    from .sites import get_site
     if not args.mpc_code:
         args.mpc_code = DEFAULT_MPC_CODE
-    elif len(args.mpc_code) != 3:
-        error_exit('Input MPC code does not have 3 characters')
-
-    obs_sites = MPC_query.get_observatory_codes()
-    logger.info(f"Selected observatory: {obs_sites[obs_sites['Code']==args.mpc_code]['Name'].value[0]}")
+    args.mpc_codes = list(dict.fromkeys(code.strip() for code in args.mpc_code.split(',') if code.strip()))
+    if not args.mpc_codes:
+        error_exit('No MPC code given')
+    for mpc_code in args.mpc_codes:
+        if len(mpc_code) != 3:
+            error_exit(f'Input MPC code {mpc_code} does not have 3 characters')
+        try:
+            logger.info(f"Selected observatory: {get_site(mpc_code, args.cache_dir)['Name']}")
+        except ValueError as err:
+            error_exit(str(err))
+    args.mpc_code = args.mpc_codes[0]
     
+    # Check outputs, as a list in the order they are written
+    if not args.outputs:
+        args.outputs = list(OUTPUTS)
+    else:
+        outputs = {output.strip() for output in args.outputs.split(',') if output.strip()}
+        unknown = outputs - set(OUTPUTS)
+        if unknown:
+            error_exit(f'Unknown outputs: {",".join(sorted(unknown))} (choose from {",".join(OUTPUTS)})')
+        if not outputs:
+            error_exit('No outputs given')
+        args.outputs = [output for output in OUTPUTS if output in outputs]
+    if args.incremental and 'eph' not in args.outputs:
+        error_exit('--incremental extends the ephemeris file of the previous run, so --outputs must include eph')
+
+    if args.cprofile or args.profile_memory:
+        args.profile = True
+
+    # Check checkpoint options
+    if args.resume and args.from_stage:
+        error_exit('Use either --resume or --from-stage')
+    args.checkpoint = args.checkpoint or args.resume or args.from_stage is not None
+    if args.checkpoint and args.incremental:
+        error_exit('--incremental reuses the outputs of the previous run, so it cannot be combined with checkpoints')
+
+    # Check table format and compression
+    from .tables import COMPRESSIONS, DEFAULT_COMPRESSION, has_pyarrow
+    if args.format != 'csv' and not has_pyarrow():
+        error_exit(f'--format {args.format} needs pyarrow (pip install pyarrow)')
+    if not args.compression:
+        args.compression = DEFAULT_COMPRESSION[args.format]
+    elif args.compression.strip().lower() not in COMPRESSIONS[args.format]:
+        error_exit(f'--compression must be one of {",".join(COMPRESSIONS[args.format])} for {args.format} tables')
+    else:
+        args.compression = args.compression.strip().lower()
+
     if args.output_base:
         args.output_base += '_'
     else: 
         args.output_base = ''
+    if args.run_dir is None:
+        args.run_dir = Path(f'{args.output_base}run')
 
     return args
 
 
-def read_target_list(fname:Path) -> list[str]:
+def read_target_list(fname:Path, interactive:bool=True) -> list[str]:
     '''
     Reads the target list from a file.
 
     Inputs
         fname       : Path to the target list file.
+        interactive : Ask whether a target 301 is the asteroid (301) Bavaria or the moon.
+                      Otherwise it is kept as the asteroid (default: True).
 
     Output
         List of target names (strings) read from the file.
@@ -173,7 +351,9 @@ def read_target_list(fname:Path) -> list[str]:
         # Read all targets in file avoiding lines starting with '#'
         target_list = [l.strip() for l in f.readlines() if l.strip()[0]!='#']
         
-    if '301' in target_list:
+    if '301' in target_list and not interactive:
+        logger.warning('Detected target name: 301. Will plot asteroid (301) Bavaria, the moon is plotted automatically.')
+    elif '301' in target_list:
         logger.warning('Detected target name: 301. The moon will be plotted automatically.')
         bavaria_check = input('Did you mean asteroid (301) Bavaria? (y/n)')
         if bavaria_check.strip().lower() in ('y', 'yes'):
@@ -188,7 +368,7 @@ def read_target_list(fname:Path) -> list[str]:
     return target_list
 
 
-def create_date_list(start_date:Time, end_date:Time) -> list[Time]:
+def create_date_list(start_date:'Time', end_date:'Time') -> 'Time':
     '''
     Creates a list of dates from start_date to end_date, inclusive.
 
@@ -197,9 +377,10 @@ def create_date_list(start_date:Time, end_date:Time) -> list[Time]:
         end_date    : astropy Time() object for the end date.
 
     Output
-        List of astropy Time() objects for each day in the range.
+        astropy Time() array with each day in the range.
     '''
+    from astropy.time import TimeDelta
     # Number of days to scan
     len_days = int((end_date - start_date).jd)
-    date_list = [start_date + TimeDelta(d,format='jd') for d in range(0,len_days+1)]
+    date_list = start_date + TimeDelta(np.arange(len_days+1), format='jd')
     return date_list
\ No newline at end of file
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+
+def run_starts(values:np.ndarray) -> np.ndarray:
+    """Positions where the runs of equal consecutive values of an array start."""
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+
+
+def target_blocks(df:pd.DataFrame, column:str='target') -> list[tuple[str, object]]:
+    """
+    Rows of each target of a DataFrame, in order of appearance. These are slices when the
+    rows are grouped by target (as in a RowIndex), and arrays of positions otherwise.
+
+    Inputs
+        df     : DataFrame with a target column.
+        column : Name of the target column (default: 'target').
+
+    Output
+        List of (target, rows) to take with df.iloc or on the column arrays.
+    """
+    starts = run_starts(df[column].to_numpy())
+    keys   = df[column].iloc[starts].tolist()
+    if len(set(keys)) < len(keys):
+        return list(df.groupby(column, observed=True, sort=False).indices.items())
+    bounds = np.r_[starts, len(df)].tolist()
+    return [(key, slice(start, stop)) for key, start, stop in zip(keys, bounds[:-1], bounds[1:])]
+
+
+class RowIndex:
+    """
+    DataFrame sorted once by two key columns (e.g. night and target), with the offsets of
+    the rows of each first key and of each pair of keys. The rows of a night, or of a
+    target in a night, are then taken as a slice instead of being searched for.
+
+    The sort is stable, so rows keep their order within a pair of keys (e.g. time order
+    in an ephemeris sorted by target and time). Categorical keys sort in category order.
+
+    Inputs
+        df     : DataFrame to index.
+        first  : Name of the first key column.
+        second : Name of the second key column.
+    """
+
+    def __init__(self, df:pd.DataFrame, first:str, second:str):
+        self.frame   = df.sort_values(by=[first, second], kind='stable')
+        first_starts = run_starts(self.frame[first].to_numpy())
+        pair_starts  = np.union1d(first_starts, run_starts(self.frame[second].to_numpy()))
+        self._first  = self._offsets(self.frame[first].iloc[first_starts].tolist(), first_starts)
+        self._pairs  = self._offsets(list(zip(self.frame[first].iloc[pair_starts].tolist(),
+                                              self.frame[second].iloc[pair_starts].tolist())), pair_starts)
+
+    def _offsets(self, keys:list, starts:np.ndarray) -> dict:
+        # Keys come from the columns with iloc, so datetimes are Timestamps and not numpy datetimes
+        bounds = np.r_[starts, len(self.frame)].tolist()
+        return dict(zip(keys, zip(bounds[:-1], bounds[1:])))
+
+    def keys(self) -> list:
+        """First keys, in order."""
+        return list(self._first)
+
+    def bounds(self, first, second=None) -> tuple[int, int]:
+        """Offsets (start, stop) of the rows of a first key, or of a pair of keys ((0, 0) if there are none)."""
+        if second is None:
+            return self._first.get(first, (0, 0))
+        return self._pairs.get((first, second), (0, 0))
+
+    def rows(self, first, second=None) -> pd.DataFrame:
+        """Rows of a first key, or of a pair of keys, as a slice of the sorted DataFrame."""
+        start, stop = self.bounds(first, second)
+        return self.frame.iloc[start:stop]
@@ -1,32 +1,184 @@
 from pathlib import Path
-from .outfmt import logger, console, df2csv
+from .outfmt import logger, console, error_exit
 from .read_inputs import parse_args, validate_args, read_target_list, create_date_list
-from .ephemeris import create_horizon_dataframe, limit_cuts, get_twilight_times
-from .plotting import marker_list
-from .create_output import make_elevation_charts_pdf, make_summary_charts_pdf
 
 
 def main():
     args = parse_args()
     args = validate_args(args)
+    # Imported after parsing so --help is fast, and the plotting modules only for the PDFs
+    import pandas as pd
+    from .ephemeris import create_sites_dataframes, get_twilight_times, stream_sites_ephemeris_cuts
+    from .constraints import Constraints
+    from .sites import get_site
+    from .summaries import summarize_nights
+    from .tables import table_path, save_table
+    from .cache import EphemerisCache
+    from .names import name_index
+    from . import profiling
+    from .incremental import (MANIFEST_NAME, run_settings, read_manifest, write_manifest, plan_incremental, incremental_cuts,
+                              night_fingerprints, target_fingerprints, previous_pages, site_manifest)
+    from .checkpoint import CHECKPOINT_STAGES, RunCheckpoints, start_stage
+    make_pdfs = 'elevation-pdf' in args.outputs or 'summary-pdf' in args.outputs
+    if make_pdfs:
+        from .plotting import marker_list
+        from .create_output import make_elevation_charts_pdf, make_summary_charts_pdf
+
+    profiler = profiling.start(args.cprofile, args.profile_memory) if args.profile else None
+
     target_list = read_target_list(args.target_file)
     logger.debug('Processed args and input file')
     date_list     = create_date_list(args.start_date, args.end_date)    
-    twilight_list = get_twilight_times(args.mpc_code,date_list)
+    settings      = run_settings(args)
+    dates         = [str(date) for date in date_list.strftime('%Y-%m-%d')]
+
+    # Stage to start from, with the output of the earlier stages loaded from their checkpoints
+    checkpoints, start = None, CHECKPOINT_STAGES[0]
+    if args.checkpoint:
+        checkpoints = RunCheckpoints(args.run_dir, {**settings, 'targets': sorted(target_list), 'dates': dates})
+        try:
+            start = start_stage(checkpoints, args.resume, args.from_stage)
+        except ValueError as err:
+            error_exit(str(err))
+        if start is None:
+            logger.info(f'The run in {args.run_dir} is complete. Use --from-stage render to make the outputs again')
+            return
+        logger.info(f'Starting from the {start} stage')
+    runs = lambda stage: CHECKPOINT_STAGES.index(stage) >= CHECKPOINT_STAGES.index(start)
+    save_checkpoint = lambda stage, data=None: checkpoints.save(stage, data) if checkpoints else None
+
+    if runs('twilight'):
+        with profiling.stage('twilight'):
+            twilight_lists = {mpc_code: get_twilight_times(mpc_code, date_list, method=args.twilight)
+                              for mpc_code in args.mpc_codes}
+        save_checkpoint('twilight', twilight_lists)
+    elif start == 'ephemeris':
+        twilight_lists = checkpoints.load('twilight')
+
+    # With several sites, each site gets its own ephemeris and PDFs, and the summaries are combined
+    multi_site = len(args.mpc_codes) > 1
+    site_bases = {mpc_code: f'{args.output_base}{mpc_code}_' if multi_site else args.output_base
+                  for mpc_code in args.mpc_codes}
+    site_stage = lambda name, mpc_code: f'{name} ({mpc_code})' if multi_site else name
+
+    constraints = Constraints(args.mag_limit, args.elevation_limit, args.time_visible_limit, args.moon_sep,
+                              args.max_motion, args.max_hour_angle, args.min_dark)
+    logger.debug(f'{constraints}')
+
+    cache, names = None, None
+    if not args.no_cache:
+        cache = EphemerisCache(args.cache_dir)
+        names = name_index(args.cache_dir, args.horizons_url, args.sbdb_url)
 
-    # Create dataframe and apply cuts
-    eph_df, twilight_list = create_horizon_dataframe(twilight_list, args.mpc_code, target_list)
-    eph_cut, twilight_list = limit_cuts(eph_df, args.mag_limit, args.elevation_limit, args.time_visible_limit, twilight_list)
+    # Previous run to extend, if any
+    manifest_path = Path(f'./{args.output_base}{MANIFEST_NAME}')
+    plan = None
+    if args.incremental:
+        plan = plan_incremental(read_manifest(manifest_path), settings, target_list, dates, site_bases)
 
-    df2csv(eph_cut,args.output_base,'eph.csv','Ephemeris')
+    # Create dataframes and apply cuts, with the sites fetched concurrently
+    # With --incremental and --stream, the cuts are applied in the ephemeris stage
+    if not runs('cuts'):
+        site_cuts = checkpoints.load('cuts')
+        if 'eph' in args.outputs:
+            for mpc_code, (eph_cut, _) in site_cuts.items():
+                with profiling.stage(site_stage('eph-table', mpc_code)):
+                    save_table(eph_cut, site_bases[mpc_code], 'eph', 'Ephemeris', args.format, args.compression)
+    elif plan is not None:
+        with profiling.stage('ephemeris'):
+            site_cuts = incremental_cuts(plan, twilight_lists, target_list, constraints, site_bases,
+                                         workers=args.workers, horizons_url=args.horizons_url, cache=cache,
+                                         backend=args.backend, elements_file=args.elements_file, step=args.step,
+                                         names=names)
+        for mpc_code, (eph_cut, _) in site_cuts.items():
+            with profiling.stage(site_stage('eph-table', mpc_code)):
+                save_table(eph_cut, site_bases[mpc_code], 'eph', 'Ephemeris', args.format, args.compression)
+    elif args.stream and runs('ephemeris'):
+        output_paths = ({mpc_code: table_path(base, 'eph', args.format) for mpc_code, base in site_bases.items()}
+                        if 'eph' in args.outputs else None)
+        with profiling.stage('ephemeris'):
+            site_cuts = stream_sites_ephemeris_cuts(twilight_lists, target_list, constraints, output_paths,
+                                                    workers=args.workers, horizons_url=args.horizons_url, cache=cache,
+                                                    backend=args.backend, elements_file=args.elements_file,
+                                                    step=args.step, names=names, fmt=args.format,
+                                                    compression=args.compression)
+        save_checkpoint('cuts', site_cuts)
+    else:
+        site_cuts = {}
+        if runs('ephemeris'):
+            with profiling.stage('ephemeris'):
+                site_dfs = create_sites_dataframes(twilight_lists, target_list, workers=args.workers,
+                                                   horizons_url=args.horizons_url, cache=cache,
+                                                   backend=args.backend, elements_file=args.elements_file,
+                                                   step=args.step, names=names)
+            save_checkpoint('ephemeris', site_dfs)
+        else:
+            site_dfs = checkpoints.load('ephemeris')
+        for mpc_code in args.mpc_codes:
+            eph_df, twilight_list = site_dfs.pop(mpc_code)
+            with profiling.stage(site_stage('cuts', mpc_code)):
+                site_cuts[mpc_code] = constraints.cut(eph_df, twilight_list, args.step, get_site(mpc_code)['Longitude'])
+            del eph_df
+
+            if 'eph' in args.outputs:
+                with profiling.stage(site_stage('eph-table', mpc_code)):
+                    save_table(site_cuts[mpc_code][0], site_bases[mpc_code], 'eph', 'Ephemeris', args.format,
+                               args.compression)
+        save_checkpoint('cuts', site_cuts)
+
+    if runs('summaries'):
+        site_summaries = {}
+        for mpc_code, (eph_cut, twilight_list) in site_cuts.items():
+            with profiling.stage(site_stage('summaries', mpc_code)):
+                site_summaries[mpc_code] = summarize_nights(eph_cut, twilight_list)
+        save_checkpoint('summaries', site_summaries)
+    else:
+        site_summaries = checkpoints.load('summaries')
         
-    target_plot_info = marker_list(eph_cut.target.unique())
-    
-    night_summaries = make_elevation_charts_pdf(eph_cut, twilight_list, target_plot_info, args.elevation_limit, args.mpc_code, args.output_base)
+    # Same markers and colours for a target at every site, and as in the previous run
+    visible_targets = [t for eph_cut, _ in site_cuts.values() for t in eph_cut.target.unique()]
+    markers         = list(dict.fromkeys((plan['markers'] if plan else []) + visible_targets))
+    if make_pdfs:
+        target_plot_info = marker_list(markers)
     
-    df2csv(night_summaries,args.output_base,'summary.csv','Summary')
+    summaries, site_manifests = [], {}
+    for mpc_code, (eph_cut, twilight_list) in site_cuts.items():
+        base            = site_bases[mpc_code]
+        all_summaries   = site_summaries[mpc_code]
+        night_summaries = all_summaries[all_summaries['target'] != 'Moon'].copy()
+        night_hashes, night_pages, target_hashes, target_pages = {}, {}, {}, {}
+        if make_pdfs:
+            site_plot_info = target_plot_info[target_plot_info['targets'].isin(eph_cut.target.unique())]
+
+        # Only pages that changed since the previous run are rendered
+        if 'elevation-pdf' in args.outputs:
+            with profiling.stage(site_stage('elevation-pdf', mpc_code)):
+                night_hashes = night_fingerprints(eph_cut, twilight_list, site_plot_info)
+                reuse = previous_pages(Path(f'./{base}elevation.pdf'), plan['sites'][mpc_code]['nights'], night_hashes) if plan else None
+                make_elevation_charts_pdf(eph_cut, twilight_list, site_plot_info, args.elevation_limit, mpc_code, base,
+                                          reuse_pages=reuse, pages=night_pages, jobs=args.jobs, summaries=all_summaries)
+        if 'summary-pdf' in args.outputs:
+            with profiling.stage(site_stage('summary-pdf', mpc_code)):
+                target_hashes = target_fingerprints(night_summaries, site_plot_info)
+                reuse = previous_pages(Path(f'./{base}summary.pdf'), plan['sites'][mpc_code]['targets'], target_hashes) if plan else None
+                make_summary_charts_pdf(night_summaries,site_plot_info,base,reuse_pages=reuse,pages=target_pages)
+
+        site_manifests[mpc_code] = site_manifest(eph_cut, twilight_list, night_hashes, night_pages, target_hashes, target_pages)
+        if multi_site:
+            night_summaries.insert(0, 'site', mpc_code)
+        summaries.append(night_summaries)
     
-    make_summary_charts_pdf(night_summaries,target_plot_info,args.output_base)
+    if 'summary' in args.outputs:
+        with profiling.stage('summary-table'):
+            save_table(pd.concat(summaries, ignore_index=True), args.output_base, 'summary', 'Summary', args.format,
+                       args.compression)
+    write_manifest(manifest_path, settings, target_list, dates, markers, site_manifests, args.outputs, args.format)
+    save_checkpoint('render')
+
+    if profiler is not None:
+        profiler.write(Path(f'./{args.output_base}profile.json'),
+                       Path(f'./{args.output_base}profile.prof') if args.cprofile else None)
+        profiling.stop()
         
     console.print('yay')
     return
@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import pandas as pd
+from .outfmt import logger, error_exit
+from .read_inputs import (DEFAULT_MPC_CODE, DEFAULT_MAG_LIMIT, DEFAULT_ELEVATION_LIMIT, DEFAULT_TIME_VISIBLE,
+                          DEFAULT_WORKERS, read_target_list, parse_step)
+from .ephemeris import DEFAULT_STEP
+from .session import ObservabilitySession, night_date
+
+
+DEFAULT_PORT     = 8770
+DEFAULT_KEEP     = 32       # Recent ephemerides kept in memory by each site
+STREAM_ROWS      = 500      # Rows converted to JSON and sent at a time
+# Query parameters of the constraints, as the command line options, with their defaults
+CONSTRAINT_PARAMS = {'mag-limit'          : DEFAULT_MAG_LIMIT,
+                     'elevation-limit'    : DEFAULT_ELEVATION_LIMIT,
+                     'time-visible-limit' : DEFAULT_TIME_VISIBLE,
+                     'moon-sep'           : None,
+                     'max-motion'         : None,
+                     'max-hour-angle'     : None,
+                     'min-dark'           : None}
+
+
+class QueryService:
+    """
+    State of the query server: an ObservabilitySession for each site queried, created on
+    first use and kept for the life of the server, so the observatory table, twilight
+    times, target names and recent ephemerides stay in memory.
+
+    Inputs
+        targets          : Default target list, for queries without targets.
+        keep_ephemerides : Recent ephemerides kept in memory by each site (default: DEFAULT_KEEP).
+        Others as session.ObservabilitySession.
+    """
+
+    def __init__(self, targets:list[str]=None, workers:int=DEFAULT_WORKERS, horizons_url:str=None,
+                 cache_dir:Path=None, use_cache:bool=True, backend:str='horizons', elements_file:Path=None,
+                 step:str=DEFAULT_STEP, twilight:str='numpy', keep_ephemerides:int=DEFAULT_KEEP, sbdb_url:str=None):
+        self.targets  = targets or []
+        self.settings = {'workers': workers, 'horizons_url': horizons_url, 'cache_dir': cache_dir,
+                         'use_cache': use_cache, 'backend': backend, 'elements_file': elements_file, 'step': step,
+                         'twilight': twilight, 'keep_ephemerides': keep_ephemerides, 'sbdb_url': sbdb_url}
+        self.sessions = {}
+        self.started  = time.time()
+        self._lock    = threading.Lock()
+
+    def session(self, mpc_code:str) -> ObservabilitySession:
+        """Session of a site, created on first use (ValueError for unknown sites)."""
+        with self._lock:
+            if mpc_code not in self.sessions:
+                self.sessions[mpc_code] = ObservabilitySession(mpc_code, **self.settings)
+                logger.info(f"Opened session for {self.sessions[mpc_code].site['Name']} ({mpc_code})")
+            return self.sessions[mpc_code]
+
+    def query_targets(self, params:dict) -> list[str]:
+        """Targets of a query: the comma separated 'targets' parameter, or the default list."""
+        targets = [t.strip() for t in params.get('targets', '').split(',') if t.strip()] or self.targets
+        if not targets:
+            raise ValueError('No targets given, and the server has no default target list')
+        return targets
+
+    def visible(self, params:dict) -> pd.DataFrame:
+        """
+        Targets observable in one night (default: tonight), as the summary of each target in
+        RA order, as in the table of the elevation report.
+        """
+        session = self.session(params.get('mpc-code', DEFAULT_MPC_CODE))
+        night   = query_night(params.get('date', 'tonight'), session.site['Longitude'])
+        result  = session.observe(self.query_targets(params), night, night, **query_constraints(params))
+        return result.summaries.sort_values(by='RA').assign(site=session.mpc_code)
+
+    def summary(self, params:dict) -> pd.DataFrame:
+        """Summary of each target and night over a range of nights (default: tonight only)."""
+        session = self.session(params.get('mpc-code', DEFAULT_MPC_CODE))
+        lon     = session.site['Longitude']
+        start   = query_night(params.get('start-date', 'tonight'), lon)
+        end     = query_night(params.get('end-date', start.strftime('%Y-%m-%d')), lon)
+        result  = session.observe(self.query_targets(params), start, end, **query_constraints(params))
+        return result.summaries.assign(site=session.mpc_code)
+
+    def health(self) -> dict:
+        """Status of the server."""
+        return {'status'      : 'ok',
+                'uptime_s'    : round(time.time() - self.started, 1),
+                'sites'       : sorted(self.sessions),
+                'targets'     : len(self.targets),
+                'ephemerides' : {code: len(session._ephemerides) for code, session in self.sessions.items()}}
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+
+
+def query_night(value:str, longitude:float) -> pd.Timestamp:
+    """
+    Night of a query date: 'YYYY-MM-DD', or 'tonight' for the night in progress (or next)
+    at the site, which starts at local noon.
+    """
+    if value != 'tonight':
+        return night_date(value)
+    lon = longitude - 360 if longitude > 180 else longitude
+    local_time = pd.Timestamp.now(tz='UTC').tz_localize(None) + pd.Timedelta(hours=lon/15)
+    return (local_time - pd.Timedelta(hours=12)).normalize()
+
+
+def query_constraints(params:dict) -> dict:
+    """Constraints of a query from its parameters, as ObservabilitySession.observe arguments."""
+    values = {}
+    for name, default in CONSTRAINT_PARAMS.items():
+        value = params.get(name, default)
+        if value is not None:
+            try:
+                value = float(value)
+            except ValueError:
+                raise ValueError(f'{name} must be a number, not {value}') from None
+        values[name.replace('-', '_')] = value
+    return values
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET queries with newline delimited JSON (one object per line), sent as the
+    rows are converted:
+
+        /visible  : Targets observable in a night (mpc-code, date, targets and constraints).
+        /summary  : Summary of each target and night (mpc-code, start-date, end-date, targets
+                    and constraints).
+        /health   : Status of the server.
+
+    The constraints are the parameters of CONSTRAINT_PARAMS, named as the command line
+    options. Errors are answered with a JSON object with an 'error' key.
+    """
+    routes = {'/visible': 'visible', '/summary': 'summary'}
+
+    def do_GET(self):
+        url    = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        start  = time.perf_counter()
+        if url.path == '/health':
+            self.send_json(200, self.server.service.health())
+            return
+        if url.path not in self.routes:
+            self.send_json(404, {'error': f'Unknown query {url.path}, use {", ".join(self.routes)} or /health'})
+            return
+        try:
+            df = getattr(self.server.service, self.routes[url.path])(params)
+        except ValueError as err:
+            self.send_json(400, {'error': str(err)})
+            return
+        except Exception as err:
+            logger.warning(f'Query {self.path} failed ({type(err).__name__}: {err})')
+            self.send_json(500, {'error': f'{type(err).__name__}: {err}'})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('X-Rows', str(len(df)))
+        self.send_header('X-Query-Time-Ms', f'{1000*(time.perf_counter()-start):.1f}')
+        self.end_headers()
+        for i in range(0, len(df), STREAM_ROWS):
+            lines = df.iloc[i:i+STREAM_ROWS].to_json(orient='records', lines=True, date_format='iso')
+            self.wfile.write(lines.rstrip('\n').encode() + b'\n')
+            self.wfile.flush()
+
+    def send_json(self, status:int, obj:dict):
+        data = (json.dumps(obj) + '\n').encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Without the client address, which Unix socket clients do not have
+        logger.debug(format % args)
+
+
+class UnixQueryServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service:QueryService, host:str='127.0.0.1', port:int=DEFAULT_PORT, socket_path:Path=None):
+    """
+    Creates the query server, on a local TCP port or on a Unix socket, not yet serving.
+
+    Inputs
+        service     : QueryService answering the queries.
+        host        : Address to listen on (default: 127.0.0.1, this machine only).
+        port        : TCP port (default: DEFAULT_PORT, 0 for any free port).
+        socket_path : Optional Unix socket path, instead of the TCP port.
+
+    Output
+        Server object, with the service as its service attribute.
+    """
+    if socket_path is not None:
+        socket_path = Path(socket_path)
+        if socket_path.exists():
+            socket_path.unlink()
+        server = UnixQueryServer(str(socket_path), QueryHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), QueryHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def parse_args() -> argparse.Namespace:
+    '''
+    Parse command line arguments for the query server.
+
+    Returns:
+        Parsed command line arguments.
+    '''
+    parser = argparse.ArgumentParser(description='Local pyObsFind query server, answering visibility queries from memory')
+    parser.add_argument('--target-file', type=Path,
+                        help='Default target list, for queries without targets')
+    parser.add_argument('-mpc', '--mpc-code', type=str, default=DEFAULT_MPC_CODE,
+                        help=f'Comma separated sites to load at start, with tonight for the default targets. Default: {DEFAULT_MPC_CODE}')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Address to listen on. Default: 127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'TCP port to listen on. Default: {DEFAULT_PORT}')
+    parser.add_argument('--socket', type=Path,
+                        help='Unix socket to listen on instead of a TCP port')
+    parser.add_argument('--keep', type=int, default=DEFAULT_KEEP,
+                        help=f'Recent ephemerides kept in memory by each site. Default: {DEFAULT_KEEP}')
+    parser.add_argument('--backend', type=str, choices=['horizons', 'elements'], default='horizons',
+                        help='Ephemeris source. Default: horizons')
+    parser.add_argument('--elements-file', type=Path,
+                        help='MPCORB-style orbital elements file for --backend elements')
+    parser.add_argument('--step', type=str, default=DEFAULT_STEP,
+                        help=f'Ephemeris step (e.g. 15min, 60min). Default: {DEFAULT_STEP}')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Number of concurrent Horizons queries. Default: {DEFAULT_WORKERS}')
+    parser.add_argument('--horizons-url', type=str,
+                        help='URL to send Horizons API queries to instead of JPL')
+    parser.add_argument('--sbdb-url', type=str,
+                        help='URL to look target names up at instead of the JPL SBDB API')
+    parser.add_argument('--cache-dir', type=Path,
+                        help='Directory of the persistent ephemeris cache. Default: ~/.cache/obsfind')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not read or update the persistent ephemeris cache')
+    return parser.parse_args()
+
+
+def validate_args(args:argparse.Namespace) -> argparse.Namespace:
+    '''
+    Check the query server arguments, exiting with an error for invalid values.
+
+    Inputs
+        args : Parsed command line arguments.
+
+    Output
+        Validated arguments, with the step as a Horizons step string in minutes.
+    '''
+    try:
+        args.step = parse_step(args.step)
+    except ValueError as err:
+        error_exit(f'--step {err}')
+    if args.workers < 1:
+        error_exit('--workers must be at least 1')
+    if args.keep < 0:
+        error_exit('--keep must be at least 0')
+    if not 0 <= args.port <= 65535:
+        error_exit('--port must be between 0 and 65535')
+    if args.backend == 'elements' and (args.elements_file is None or not args.elements_file.is_file()):
+        error_exit(f'--backend elements needs an orbit file, cannot find {args.elements_file}')
+    return args
+
+
+def main():
+    args = validate_args(parse_args())
+    targets = []
+    if args.target_file is not None:
+        if not args.target_file.is_file():
+            error_exit(f'Cannot find {args.target_file}')
+        targets = read_target_list(args.target_file, interactive=False)
+
+    service = QueryService(targets, args.workers, args.horizons_url, args.cache_dir, not args.no_cache, args.backend,
+                           args.elements_file, args.step, keep_ephemerides=args.keep, sbdb_url=args.sbdb_url)
+    try:
+        for mpc_code in [code.strip() for code in args.mpc_code.split(',') if code.strip()]:
+            if targets:
+                service.visible({'mpc-code': mpc_code})
+            else:
+                service.session(mpc_code)
+    except ValueError as err:
+        error_exit(str(err))
+
+    server = make_server(service, args.host, args.port, args.socket)
+    where  = args.socket if args.socket is not None else f'http://{args.host}:{server.server_address[1]}'
+    logger.info(f'Serving queries at {where} (/visible, /summary, /health)')
+    # Stopping with kill closes the server as Ctrl+C does
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if args.socket is not None and args.socket.exists():
+            os.unlink(args.socket)
+
+if __name__ == '__main__':
+    main()
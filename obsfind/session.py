@@ -0,0 +1,283 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+import pandas as pd
+from astropy.time import Time
+from .ephemeris import (EPHEMERIS_BACKENDS, TWILIGHT_METHODS, DEFAULT_STEP, create_sites_dataframes, get_twilight_times,
+                        horizons_session)
+from .constraints import Constraints
+from .read_inputs import (DEFAULT_MPC_CODE, DEFAULT_MAG_LIMIT, DEFAULT_ELEVATION_LIMIT, DEFAULT_TIME_VISIBLE,
+                          DEFAULT_WORKERS, DEFAULT_JOBS, OUTPUTS, parse_step)
+from .sites import lookup_site
+from .summaries import summarize_nights
+from .outfmt import logger
+
+
+class Observability:
+    """
+    Result of an ObservabilitySession query, held in memory.
+
+    Attributes
+        mpc_code    : MPC code of the site.
+        constraints : Constraints applied to the ephemeris.
+        eph         : Ephemeris of the target nights passing the constraints, with the Moon
+                      rows of those nights (as the eph output of obsfind.run).
+        twilight    : Twilight times of each night with visible targets, with the median
+                      lunar illumination.
+        summaries   : Summary of each target and night (as the summary output of obsfind.run).
+    """
+
+    def __init__(self, mpc_code:str, constraints:Constraints, eph:pd.DataFrame, twilight:pd.DataFrame,
+                 summaries:pd.DataFrame):
+        self.mpc_code    = mpc_code
+        self.constraints = constraints
+        self.eph         = eph
+        self.twilight    = twilight
+        self.summaries   = summaries
+
+    @property
+    def targets(self) -> list[str]:
+        """Visible targets, in order of appearance in the summaries."""
+        return list(dict.fromkeys(self.summaries['target']))
+
+    def __repr__(self):
+        return (f'Observability({self.mpc_code}, {len(self.targets)} targets visible on '
+                f'{self.summaries["datetime_str"].nunique()} nights, {self.constraints})')
+
+
+class ObservabilitySession:
+    """
+    Library entry point to the pipeline of obsfind.run, for use from other programs. The
+    session holds what does not change between queries: the site, the ephemeris cache
+    and target name index, one pooled HTTP session for Horizons, and the twilight times
+    of the nights already queried. Results are returned in memory, and only written to
+    files with write(). With keep_ephemerides, the ephemerides of the most recent queries
+    are also kept in memory, so queries of the same targets and nights with other
+    constraints do not fetch them again.
+
+    A session can be shared by threads, which query concurrently. The lock of the session
+    is only held to look up and store the ephemerides in memory, and a thread asking for
+    an ephemeris already being fetched waits for that fetch instead of repeating it.
+
+    Errors raise exceptions instead of exiting: ValueError for invalid settings or
+    queries, and the errors of the fetch itself (e.g. network errors for the Moon).
+
+        with ObservabilitySession('809') as session:
+            result = session.observe(['Ceres', '2000 SG344'], '2025-08-07', '2025-08-14', mag_limit=20)
+            result.summaries
+
+    Inputs
+        mpc_code      : MPC code of the observatory (default: DEFAULT_MPC_CODE).
+        workers       : Number of concurrent Horizons queries (default: DEFAULT_WORKERS).
+        horizons_url  : Optional URL replacing the JPL Horizons API URL.
+        sbdb_url      : Optional URL replacing the SBDB API URL, to look names up at (without
+                        it, names are not looked up when horizons_url is given).
+        cache_dir     : Directory of the ephemeris cache and name index (default: ~/.cache/obsfind).
+        use_cache     : Read and update the ephemeris cache and name index (default: True).
+        backend       : Ephemeris source, one of EPHEMERIS_BACKENDS (default: 'horizons').
+        elements_file : Path to the MPCORB-style orbit file of the 'elements' backend.
+        step          : Step of the ephemerides (default: '15min').
+        twilight      : Twilight method, one of TWILIGHT_METHODS (default: 'numpy').
+        keep_ephemerides : Number of recent (targets, nights) ephemerides kept in memory (default: 0).
+    """
+
+    def __init__(self, mpc_code:str=DEFAULT_MPC_CODE, workers:int=DEFAULT_WORKERS, horizons_url:str=None,
+                 cache_dir:Path=None, use_cache:bool=True, backend:str='horizons', elements_file:Path=None,
+                 step:str=DEFAULT_STEP, twilight:str='numpy', keep_ephemerides:int=0, sbdb_url:str=None):
+        if backend not in EPHEMERIS_BACKENDS:
+            raise ValueError(f'Unknown ephemeris backend {backend}. Options: {", ".join(EPHEMERIS_BACKENDS)}')
+        if backend == 'elements' and (elements_file is None or not Path(elements_file).is_file()):
+            raise ValueError(f'The elements backend needs an orbit file, cannot find {elements_file}')
+        if twilight not in TWILIGHT_METHODS:
+            raise ValueError(f'Unknown twilight method {twilight}. Options: {", ".join(TWILIGHT_METHODS)}')
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+        if keep_ephemerides < 0:
+            raise ValueError('keep_ephemerides must be at least 0')
+        try:
+            step = parse_step(step)
+        except ValueError as err:
+            raise ValueError(f'step {err}') from None
+        self.site = lookup_site(mpc_code, cache_dir)
+        if self.site is None:
+            raise ValueError(f'Unknown MPC code {mpc_code}')
+
+        self.mpc_code        = mpc_code
+        self.workers         = workers
+        self.horizons_url    = horizons_url
+        self.backend         = backend
+        self.elements_file   = elements_file
+        self.step            = step
+        self.twilight_method = twilight
+        self.cache, self.names = None, None
+        if use_cache:
+            from .cache import EphemerisCache
+            from .names import name_index
+            self.cache = EphemerisCache(cache_dir)
+            self.names = name_index(cache_dir, horizons_url, sbdb_url)
+        self.http      = horizons_session(workers, horizons_url) if backend == 'horizons' else None
+        self.keep_ephemerides = keep_ephemerides
+        self._twilight    = None            # Twilight times of the nights computed so far
+        self._ephemerides = OrderedDict()   # Recent ephemerides by (targets, first night, last night)
+        self._fetching    = {}              # Futures of the ephemerides being fetched, by the same keys
+        self._lock        = threading.RLock()
+        logger.debug(f"Session for {self.site['Name']} ({mpc_code})")
+
+    def twilight(self, start_date, end_date) -> pd.DataFrame:
+        """
+        Twilight times of the nights from start_date to end_date (inclusive), computed
+        once per night in the session.
+
+        Inputs
+            start_date, end_date : First and last nights ('YYYY-MM-DD', date or Timestamp).
+
+        Output
+            DataFrame with the twilight times of each night (a copy, safe to modify).
+        """
+        nights = pd.date_range(night_date(start_date), night_date(end_date), freq='D')
+        if len(nights) == 0:
+            raise ValueError(f'End date {end_date} is before start date {start_date}')
+        with self._lock:
+            known   = set() if self._twilight is None else set(self._twilight['night'])
+            missing = [night.strftime('%Y-%m-%d') for night in nights if night not in known]
+            if missing:
+                new = get_twilight_times(self.mpc_code, Time(missing), method=self.twilight_method)
+                self._twilight = new if self._twilight is None else pd.concat([self._twilight, new], ignore_index=True)
+            twilight = self._twilight[self._twilight['night'].isin(nights)]
+        return twilight.sort_values('night').reset_index(drop=True)
+
+    def ephemeris(self, targets:list[str], start_date, end_date) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Ephemeris of the targets and the Moon over the nights, before any constraints.
+
+        Inputs
+            targets              : List of target names.
+            start_date, end_date : First and last nights ('YYYY-MM-DD', date or Timestamp).
+
+        Output
+            eph      : DataFrame with the ephemeris rows within each night.
+            twilight : DataFrame with the twilight times of each night, with the median lunar illumination.
+        """
+        targets = list(dict.fromkeys(str(target) for target in targets))
+        key     = (tuple(targets), night_date(start_date), night_date(end_date))
+        # Copies, as the cuts add columns to the ephemeris (shallow, the data is shared until written)
+        copies  = lambda eph, twilight: (eph.copy(deep=False), twilight.copy())
+        with self._lock:
+            if key in self._ephemerides:
+                self._ephemerides.move_to_end(key)
+                return copies(*self._ephemerides[key])
+            future = self._fetching.get(key)
+            fetch  = future is None
+            if fetch:
+                future = self._fetching[key] = Future()
+        if not fetch:
+            return copies(*future.result())
+
+        try:
+            eph, twilight = create_sites_dataframes({self.mpc_code: self.twilight(start_date, end_date)}, targets,
+                                                    workers=self.workers, horizons_url=self.horizons_url,
+                                                    cache=self.cache, backend=self.backend,
+                                                    elements_file=self.elements_file, step=self.step,
+                                                    names=self.names, session=self.http)[self.mpc_code]
+        except BaseException as err:
+            with self._lock:
+                del self._fetching[key]
+            future.set_exception(err)
+            raise
+        with self._lock:
+            if self.keep_ephemerides > 0:
+                self._ephemerides[key] = eph, twilight
+                while len(self._ephemerides) > self.keep_ephemerides:
+                    self._ephemerides.popitem(last=False)
+            del self._fetching[key]
+        future.set_result((eph, twilight))
+        return copies(eph, twilight)
+
+    def observe(self, targets:list[str], start_date, end_date, mag_limit:float=DEFAULT_MAG_LIMIT,
+                elevation_limit:float=DEFAULT_ELEVATION_LIMIT, time_visible_limit:float=DEFAULT_TIME_VISIBLE,
+                moon_sep:float=None, max_motion:float=None, max_hour_angle:float=None,
+                min_dark:float=None) -> Observability:
+        """
+        When the targets are observable over the nights, as obsfind.run without its files.
+        Unlike obsfind.run, '301' is queried as the asteroid (301) Bavaria without asking.
+
+        Inputs
+            targets              : List of target names.
+            start_date, end_date : First and last nights ('YYYY-MM-DD', date or Timestamp).
+            Others as constraints.Constraints.
+
+        Output
+            Observability object with the cut ephemeris, twilight times and nightly summaries.
+        """
+        constraints = Constraints(mag_limit, elevation_limit, time_visible_limit, moon_sep, max_motion,
+                                  max_hour_angle, min_dark)
+        eph, twilight = self.ephemeris(targets, start_date, end_date)
+        eph_cut, twilight = constraints.cut(eph, twilight, self.step, self.site['Longitude'])
+        del eph
+        summaries = summarize_nights(eph_cut, twilight)
+        summaries = summaries[summaries['target'] != 'Moon'].copy()
+        return Observability(self.mpc_code, constraints, eph_cut, twilight, summaries)
+
+    def write(self, result:Observability, output_dir:Path='.', base_out_name:str='', outputs:list[str]=OUTPUTS,
+              fmt:str='csv', compression:str=None, jobs:int=DEFAULT_JOBS) -> list[Path]:
+        """
+        Writes the output files of obsfind.run for a result. The plotting modules are only
+        imported if a PDF is requested.
+
+        Inputs
+            result        : Observability object from observe.
+            output_dir    : Directory of the files (default: the current directory).
+            base_out_name : Base of the file names (default: '').
+            outputs       : Files to write, from OUTPUTS (default: all).
+            fmt           : Table format, one of tables.FORMATS (default: 'csv').
+            compression   : Table compression (default: that of the format).
+            jobs          : Number of processes rendering the elevation charts (default: DEFAULT_JOBS).
+
+        Output
+            List of the paths written.
+        """
+        from .tables import save_table
+        unknown = set(outputs) - set(OUTPUTS)
+        if unknown:
+            raise ValueError(f'Unknown outputs: {",".join(sorted(unknown))} (choose from {",".join(OUTPUTS)})')
+        os.makedirs(output_dir, exist_ok=True)
+        base  = os.path.join(output_dir, base_out_name)
+        paths = []
+        if 'eph' in outputs:
+            paths.append(save_table(result.eph, base, 'eph', 'Ephemeris', fmt, compression))
+        if 'summary' in outputs:
+            paths.append(save_table(result.summaries, base, 'summary', 'Summary', fmt, compression))
+        if 'elevation-pdf' in outputs or 'summary-pdf' in outputs:
+            from .plotting import marker_list
+            from .create_output import make_elevation_charts_pdf, make_summary_charts_pdf
+            plot_info = marker_list(list(result.eph.target.unique()))
+            if 'elevation-pdf' in outputs:
+                make_elevation_charts_pdf(result.eph, result.twilight, plot_info, result.constraints.elevation_limit,
+                                          result.mpc_code, base, jobs=jobs, summaries=result.summaries)
+                paths.append(Path(f'{base}elevation.pdf').resolve())
+            if 'summary-pdf' in outputs:
+                make_summary_charts_pdf(result.summaries, plot_info, base)
+                paths.append(Path(f'{base}summary.pdf').resolve())
+        return paths
+
+    def close(self):
+        """Closes the HTTP session."""
+        if self.http is not None:
+            self.http.close()
+            self.http = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def night_date(date) -> pd.Timestamp:
+    """Night of a date given as 'YYYY-MM-DD', date, datetime or Timestamp."""
+    try:
+        return pd.Timestamp(date).normalize()
+    except (TypeError, ValueError):
+        raise ValueError(f'Cannot read date {date}, use YYYY-MM-DD') from None
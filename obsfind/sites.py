@@ -0,0 +1,246 @@
+import argparse
+import csv
+import gzip
+import json
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from .outfmt import logger, console, error_exit
+from .cache import DEFAULT_CACHE_DIR
+
+
+# Observatory code tables: bundled snapshot of the MPC table, and local copy in the cache
+# directory, refreshed from the MPC
+OBSCODES_URL  = 'https://minorplanetcenter.net/Extended_Files/obscodes_extended.json.gz'
+SNAPSHOT_PATH = Path(__file__).parent / 'data' / 'obscodes.csv'
+CACHE_NAME    = 'obscodes.csv'
+CHECKED_NAME  = 'obscodes.checked'
+REFRESH_DAYS  = 30   # Age of the local copy before the MPC is queried again
+RETRY_DAYS    = 1    # Time before trying again after a failed download
+COLUMNS       = ['Code', 'Longitude', 'cos', 'sin', 'Name']
+
+_registry     = None    # Code -> site dictionary, loaded at most once per process and cache directory
+_registry_dir = None    # Cache directory the registry was loaded from
+_refreshed    = set()   # Cache directories refreshed from the MPC in this process
+_lock         = threading.Lock()
+
+
+def registry_paths(cache_dir:Path=None) -> tuple[Path, Path]:
+    """
+    Paths of the local copy of the observatory codes, and of the marker of the last
+    download attempt, in a cache directory (default: DEFAULT_CACHE_DIR).
+    """
+    cache_dir = Path(cache_dir or DEFAULT_CACHE_DIR)
+    return cache_dir / CACHE_NAME, cache_dir / CHECKED_NAME
+
+
+def read_codes(path:Path) -> dict[str, dict]:
+    """
+    Reads an observatory code table written by write_codes.
+
+    Inputs
+        path : Path to the CSV table.
+
+    Output
+        Dictionary of sites by MPC code.
+    """
+    with open(path, 'r', newline='') as f:
+        return {row['Code']: {'Code'      : row['Code'],
+                              'Name'      : row['Name'],
+                              'Longitude' : float(row['Longitude']),
+                              'cos'       : float(row['cos']),
+                              'sin'       : float(row['sin'])}
+                for row in csv.DictReader(f)}
+
+
+def write_codes(sites:dict[str, dict], path:Path):
+    """
+    Writes a dictionary of sites by MPC code to a CSV table.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        for code in sorted(sites):
+            writer.writerow({col: sites[code][col] for col in COLUMNS})
+    tmp_path.replace(path)
+
+
+def parse_codes(codes:dict) -> dict[str, dict]:
+    """
+    Reads the MPC observatory code file (obscodes_extended.json). Sites without parallax
+    constants, such as spacecraft, are skipped.
+
+    Inputs
+        codes : Decoded JSON, a dictionary of 'Longitude', 'cos', 'sin' and 'Name' by code.
+
+    Output
+        Dictionary of sites by MPC code.
+    """
+    sites = {}
+    for code, row in codes.items():
+        if any(row.get(col) is None for col in ('Longitude', 'cos', 'sin')):
+            continue
+        sites[code] = {'Code'      : code,
+                       'Name'      : str(row.get('Name', '')).strip(),
+                       'Longitude' : float(row['Longitude']),
+                       'cos'       : float(row['cos']),
+                       'sin'       : float(row['sin'])}
+    return sites
+
+
+def fetch_codes() -> dict[str, dict]:
+    """
+    Downloads the observatory codes from the MPC, from the same file as the bundled
+    snapshot.
+
+    Output
+        Dictionary of sites by MPC code.
+    """
+    import requests
+    response = requests.get(OBSCODES_URL, timeout=60)
+    response.raise_for_status()
+    data = response.content
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    return parse_codes(json.loads(data))
+
+
+def refresh_cache(cache_dir:Path=None) -> bool:
+    """
+    Downloads the observatory codes from the MPC into the cache directory.
+
+    Inputs
+        cache_dir : Cache directory (default: DEFAULT_CACHE_DIR).
+
+    Output
+        True if the local copy was updated.
+    """
+    cache_path, checked_path = registry_paths(cache_dir)
+    _refreshed.add(cache_path.parent)
+    checked_path.parent.mkdir(parents=True, exist_ok=True)
+    checked_path.touch()
+    try:
+        sites = fetch_codes()
+    except Exception as err:
+        logger.debug(f'Cannot download MPC observatory codes ({type(err).__name__}), using local copy')
+        return False
+    write_codes(sites, cache_path)
+    logger.debug(f'Updated {cache_path} with {len(sites)} observatory codes')
+    return True
+
+
+def needs_refresh(cache_dir:Path=None) -> bool:
+    """
+    Checks if the local copy in the cache directory is old enough to query the MPC again.
+    """
+    cache_path, checked_path = registry_paths(cache_dir)
+    now = time.time()
+    if cache_path.is_file() and now - cache_path.stat().st_mtime < REFRESH_DAYS*86400:
+        return False
+    if checked_path.is_file() and now - checked_path.stat().st_mtime < RETRY_DAYS*86400:
+        return False
+    return True
+
+
+def load_registry(refresh:bool=False, cache_dir:Path=None) -> dict[str, dict]:
+    """
+    Returns the observatory registry (sites by MPC code): the bundled snapshot, updated
+    with the local copy in the cache directory. The local copy is refreshed from the MPC
+    when it is older than REFRESH_DAYS. The tables are only read once per process, and
+    without cache_dir the registry already loaded is used, so the cache directory of a
+    run only needs to be given to the first lookup.
+
+    Inputs
+        refresh   : Query the MPC even if the local copy is recent (default: False).
+        cache_dir : Cache directory of the local copy (default: that of the registry
+                    already loaded, or DEFAULT_CACHE_DIR).
+
+    Output
+        Dictionary of sites by MPC code.
+    """
+    global _registry, _registry_dir
+    with _lock:
+        if cache_dir is None:
+            cache_dir = _registry_dir
+        cache_path, _ = registry_paths(cache_dir)
+        if _registry is not None and not refresh and cache_path.parent == _registry_dir:
+            return _registry
+        if (refresh or needs_refresh(cache_dir)) and cache_path.parent not in _refreshed:
+            refresh_cache(cache_dir)
+        _registry     = read_codes(SNAPSHOT_PATH)
+        _registry_dir = cache_path.parent
+        if cache_path.is_file():
+            _registry.update(read_codes(cache_path))
+    return _registry
+
+
+def get_site(mpc_code:str, cache_dir:Path=None) -> dict:
+    """
+    Looks up an observatory by MPC code.
+
+    Inputs
+        mpc_code  : MPC code for the observatory - https://www.minorplanetcenter.net/iau/lists/ObsCodes.html
+        cache_dir : Cache directory of the local copy of the codes (see load_registry).
+
+    Output
+        Dictionary with the site 'Code', 'Name', 'Longitude' and 'cos', 'sin' parallax constants.
+        Raises ValueError for an unknown MPC code.
+    """
+    site = lookup_site(mpc_code, cache_dir)
+    if site is None:
+        raise ValueError(f'Unknown MPC code {mpc_code}')
+    return site
+
+
+def lookup_site(mpc_code:str, cache_dir:Path=None) -> dict:
+    """
+    As get_site, but returns None for an unknown MPC code instead of raising ValueError.
+    """
+    registry = load_registry(cache_dir=cache_dir)
+    site     = registry.get(mpc_code)
+    if site is None and _registry_dir not in _refreshed:
+        # Possibly a new code, try the MPC once
+        site = load_registry(refresh=True, cache_dir=_registry_dir).get(mpc_code)
+    return site
+
+
+def site_latitude(site:dict) -> float:
+    """
+    Geocentric latitude (degrees) of a site from its parallax constants.
+    """
+    return np.rad2deg(np.arctan2(site['sin'], site['cos']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MPC observatory code registry')
+    sub = parser.add_subparsers(dest='command', required=True)
+    show = sub.add_parser('show', help='Show the details of an observatory')
+    show.add_argument('mpc_code', type=str)
+    refresh = sub.add_parser('refresh', help='Download the observatory codes into the local cache')
+    refresh.add_argument('--cache-dir', type=Path,
+                         help='Directory of the local copy of the codes. Default: ~/.cache/obsfind')
+    sub.add_parser('update-snapshot', help='Download the observatory codes into the bundled snapshot (maintainers)')
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        try:
+            site = get_site(args.mpc_code)
+        except ValueError as err:
+            error_exit(str(err))
+        console.print(f"{site['Code']} {site['Name']}: longitude {site['Longitude']} deg, "
+                      f"latitude {site_latitude(site):.4f} deg, cos {site['cos']}, sin {site['sin']}")
+    elif args.command == 'refresh':
+        if not refresh_cache(args.cache_dir):
+            error_exit('Cannot download MPC observatory codes')
+        logger.info(f'Observatory codes saved to {registry_paths(args.cache_dir)[0]}')
+    elif args.command == 'update-snapshot':
+        write_codes(fetch_codes(), SNAPSHOT_PATH)
+        logger.info(f'Observatory codes saved to {SNAPSHOT_PATH}')
+
+    return
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import astropy.units as u
+import numpy as np
+import pandas as pd
+
+
+# Columns of the nightly summaries given by the median over the night
+SUMMARY_MEDIANS = ['alpha', 'Mag', 'Sky_motion', 'RA', 'DEC', 'lunar_elong', 'duration_hours']
+
+def summarize_nights(eph_cut, twilight_list):
+    """
+    Summarizes the ephemeris of each target for each night by its median values, in a
+    single aggregation over all nights.
+
+    Inputs
+        eph_cut       : DataFrame with ephemerides for each target, with 'night' column.
+        twilight_list : DataFrame with twilight times for each night.
+
+    Output
+        DataFrame with one row per target and night (including the moon), sorted by target
+        and night, and indexed by the position of the target within the night.
+    """
+    medians = (eph_cut
+               .groupby(['target', 'night'], observed=True)[SUMMARY_MEDIANS]
+               .median()
+               .astype(float)
+               .reset_index())
+    twilight = twilight_list.set_index('night').reindex(medians['night'])
+
+    summaries = pd.DataFrame({
+        'target'      : medians['target'].astype(str),
+        'date_str'    : medians['night'].dt.strftime('%Y-%m-%d'),
+        'datetime_str': medians['night'],
+        **{col: medians[col] for col in SUMMARY_MEDIANS},
+        'RA_str'      : sexagesimal(medians['RA'].to_numpy() * u.deg.to(u.hourangle)),
+        'DEC_str'     : sexagesimal(medians['DEC'].to_numpy()),
+        'twlt_stt'    : twilight['astronomical_set'].to_numpy(),
+        'twlt_stp'    : twilight['astronomical_rise'].to_numpy(),
+        'nght_stt'    : twilight['sun_set'].to_numpy(),
+        'nght_stp'    : twilight['sun_rise'].to_numpy(),
+        'lunar_illum' : twilight['lunar_illum'].to_numpy(dtype=float),
+    })
+    summaries.index = summaries.groupby('datetime_str', sort=False).cumcount().to_numpy()
+    return summaries
+
+def sexagesimal(values):
+    """
+    Formats angles as 'DD:MM:SS' strings to the nearest second, as astropy's
+    Angle.to_string(sep=':', precision=0, pad=True), but vectorized.
+
+    Inputs
+        values : Array of angles, in degrees or hours.
+
+    Output
+        List of strings ('nan' for missing values).
+    """
+    values   = np.asarray(values, dtype=float)
+    negative = np.signbit(values)
+    # Split |value| into whole units, minutes and seconds
+    frac, d = np.modf(np.abs(values))
+    frac, m = np.modf(frac * 60)
+    s = frac * 60
+    # Seconds that round to 60 carry into the minutes, and minutes into the units
+    carry = s >= 59
+    s = np.where(carry, 0, np.rint(s))
+    m = m + carry
+    d = d + (m >= 60)
+    m = np.where(m >= 60, 0, m)
+
+    return ['nan' if np.isnan(value) else f"{'-' if neg else ''}{dd:02.0f}:{mm:02.0f}:{ss:02.0f}"
+            for value, neg, dd, mm, ss in zip(values, negative, d, m, s)]
@@ -0,0 +1,145 @@
+import importlib.util
+from pathlib import Path
+import pandas as pd
+from .outfmt import logger
+
+
+# Table file formats. Parquet and Feather need the optional pyarrow package
+FORMATS             = ['csv', 'parquet', 'feather']
+COMPRESSIONS        = {'csv'     : ['none'],
+                       'parquet' : ['snappy', 'zstd', 'gzip', 'brotli', 'lz4', 'none'],
+                       'feather' : ['lz4', 'zstd', 'none']}
+DEFAULT_COMPRESSION = {'csv': 'none', 'parquet': 'snappy', 'feather': 'lz4'}
+DEFAULT_CHUNK_ROWS  = 100_000  # Rows converted and written at a time (Parquet row groups, Feather record batches)
+
+
+def has_pyarrow() -> bool:
+    """True if pyarrow can be imported, without importing it."""
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def table_path(base_name:str, name:str, fmt:str='csv') -> Path:
+    """Path of an output table, e.g. ./{base_name}eph.parquet."""
+    return Path(f'{base_name}{name}.{fmt}').resolve()
+
+
+class TableWriter:
+    """
+    Writes a table file from DataFrames given in chunks, so a table can be written as it
+    is computed without holding all of it.
+
+    CSV files keep the index as their first column, as DataFrame.to_csv. Parquet and
+    Feather files hold the columns only, with their types (float32, datetime64 and
+    categorical columns are read back as such). The types are those of the first chunk,
+    and later chunks are converted to them. Categorical columns must have the same
+    categories in every chunk, as a Feather file holds a single set per column.
+    """
+
+    def __init__(self, path:Path, fmt:str='csv', compression:str=None):
+        if fmt not in FORMATS:
+            raise ValueError(f'Unknown table format {fmt}')
+        self.path        = Path(path)
+        self.fmt         = fmt
+        self.compression = compression or DEFAULT_COMPRESSION[fmt]
+        self.rows        = 0
+        self._file       = None
+        self._writer     = None
+        self._schema     = None
+        if self.compression not in COMPRESSIONS[fmt]:
+            raise ValueError(f'Compression {self.compression} is not available for {fmt}')
+        if fmt == 'csv':
+            self._file = open(self.path, 'w', newline='')
+
+    def write(self, df:pd.DataFrame):
+        """Appends the rows of a DataFrame to the table."""
+        if self.fmt == 'csv':
+            df.to_csv(self._file, header=(self._file.tell() == 0))
+        else:
+            import pyarrow as pa
+            if self._schema is None:
+                self._schema = pa.Schema.from_pandas(df, preserve_index=False)
+                self._writer = self._open_writer()
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            self._writer.write_table(table)
+        self.rows += len(df)
+
+    def _open_writer(self):
+        import pyarrow as pa
+        compression = None if self.compression == 'none' else self.compression
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.ParquetWriter(self.path, self._schema, compression=compression or 'none')
+        return pa.ipc.new_file(str(self.path), self._schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save_table(df:pd.DataFrame, base_name:str, name:str, contents:str, fmt:str='csv', compression:str=None,
+               chunk_rows:int=DEFAULT_CHUNK_ROWS) -> Path:
+    """
+    Saves a DataFrame as an output table, in chunks of chunk_rows rows.
+
+    Inputs
+        df          : DataFrame to save.
+        base_name   : Base of the output file names.
+        name        : Name of the table (e.g. 'eph'), the file extension is that of the format.
+        contents    : Description of the table, for the log.
+        fmt         : Table format, one of FORMATS (default: 'csv').
+        compression : Compression, one of COMPRESSIONS[fmt] (default: DEFAULT_COMPRESSION[fmt]).
+        chunk_rows  : Rows written at a time (default: DEFAULT_CHUNK_ROWS).
+
+    Output
+        Path of the table.
+    """
+    output_path = table_path(base_name, name, fmt)
+    with TableWriter(output_path, fmt, compression) as writer:
+        for start in range(0, max(len(df), 1), chunk_rows):
+            writer.write(df.iloc[start:start+chunk_rows])
+    logger.info(f"{contents} saved to {output_path}")
+    return output_path
+
+
+def read_table(path:Path, columns:list[str]=None, memory_map:bool=True, as_arrow:bool=False):
+    """
+    Reads a table written by save_table or TableWriter, with the format given by its extension.
+
+    Inputs
+        path       : Path of the table.
+        columns    : Optional list of columns to read (Parquet and Feather only read those).
+        memory_map : Memory-map Parquet and Feather files instead of reading them (default: True).
+                     Uncompressed Feather files are then used in place, without a copy.
+        as_arrow   : Return a pyarrow Table instead of a DataFrame (Parquet and Feather only).
+
+    Output
+        DataFrame (or pyarrow Table) with the table contents.
+    """
+    path = Path(path)
+    fmt  = path.suffix.lstrip('.')
+    if fmt == 'csv':
+        if as_arrow:
+            raise ValueError('CSV tables are read as DataFrames only')
+        df = pd.read_csv(path, index_col=0, float_precision='round_trip')
+        return df[columns] if columns is not None else df
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown table format {fmt}')
+
+    import pyarrow as pa
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, columns=columns, memory_map=memory_map)
+    else:
+        source = pa.memory_map(str(path)) if memory_map else pa.OSFile(str(path))
+        table  = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+    return table if as_arrow else table.to_pandas()
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+from astropy.time import Time
+
+# The Horizons stand-in server of the benchmarks answers the queries of the tests instead of JPL
+sys.path.insert(0, str(Path(__file__).parents[1] / 'benchmarks'))
+from horizons_server import running_server
+from obsfind.ephemeris import get_twilight_times
+from obsfind.read_inputs import create_date_list
+
+
+@pytest.fixture
+def night_ephemeris():
+    """
+    Fixed 15 minute ephemeris of two targets and the Moon over four nights at La Silla,
+    where the nights cross midnight UT. Nothing is left on the night of 2025-08-08, B is
+    only there on the first night, and the ephemeris stops before the last night.
+    """
+    twilight = get_twilight_times('809', create_date_list(Time('2025-08-06'), Time('2025-08-09')))
+    times    = pd.date_range('2025-08-06 12:00', '2025-08-09 18:00', freq='15min')
+    rng      = np.random.default_rng(0)
+    eph = pd.concat([pd.DataFrame({'target'         : target,
+                                   'datetime_str'   : times.strftime('%Y-%b-%d %H:%M'),
+                                   'datetime'       : times,
+                                   'alpha'          : rng.uniform(0, 60, len(times)),
+                                   'Mag'            : rng.uniform(15, 22, len(times)),
+                                   'Sky_motion'     : rng.uniform(0, 5, len(times)),
+                                   'RA'             : rng.uniform(0, 360, len(times)),
+                                   'DEC'            : rng.uniform(-90, 90, len(times)),
+                                   'lunar_elong'    : rng.uniform(0, 180, len(times)),
+                                   'lunar_illum'    : rng.uniform(0, 100, len(times)),
+                                   'duration_hours' : rng.uniform(0, 10, len(times))})
+                     for target in ['A', 'B', 'Moon']], ignore_index=True)
+    eph = eph[~eph['datetime'].between('2025-08-08 12:00', '2025-08-09 12:00')]
+    eph = eph[(eph['target'] != 'B') | (eph['datetime'] < '2025-08-07 12:00')]
+    return eph.reset_index(drop=True), twilight
+
+
+@pytest.fixture
+def horizons_log():
+    """Queries answered by the Horizons stand-in of run_obsfind."""
+    return []
+
+
+@pytest.fixture
+def run_obsfind(tmp_path, horizons_log):
+    """
+    Runs obsfind in tmp_path on four synthetic targets over three nights at La Silla,
+    without the cache, with the Horizons stand-in answering the queries.
+    """
+    (tmp_path / 'targets.txt').write_text('Synthetic A\nSynthetic B\nSynthetic C\nSynthetic D\n')
+    env = {**os.environ, 'PYTHONPATH': str(Path(__file__).parents[1])}
+    with running_server('synthetic', log=horizons_log) as url:
+        def run(*args, check=True):
+            return subprocess.run([sys.executable, '-m', 'obsfind.run', 'targets.txt', '2025-08-07', '2025-08-09',
+                                   '--horizons-url', url, '--step', '30', '--no-cache', *args],
+                                  cwd=tmp_path, env=env, check=check, capture_output=True, text=True)
+        yield run
@@ -0,0 +1,129 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+import pandas as pd
+import pytest
+from horizons_server import running_server
+from obsfind.cache import EphemerisCache, NO_EPHEMERIS
+
+
+def grid_query(calls):
+    """Query answering every step from the start to the stop of the epochs, like Horizons."""
+    def query(epochs):
+        calls.append((epochs['start'], epochs['stop']))
+        times = pd.date_range(epochs['start'], epochs['stop'], freq=epochs['step'])
+        return pd.DataFrame({'datetime_str' : times,
+                             'hours'        : (times - pd.Timestamp('2025-08-07')) / pd.Timedelta(hours=1)})
+    return query
+
+
+def epochs(start, stop, step='60min'):
+    return {'start': start, 'stop': stop, 'step': step}
+
+
+def fetch(cache, query, start, stop, target='Synthetic A'):
+    return cache.fetch('obj', target, '809', epochs(start, stop), 'quantities', query)
+
+
+def test_partial_hits_only_query_the_missing_ranges(tmp_path):
+    cache, calls = EphemerisCache(tmp_path), []
+    query = grid_query(calls)
+    fetch(cache, query, '2025-08-07 00:00', '2025-08-09 00:00')
+
+    calls.clear()
+    eph = fetch(cache, query, '2025-08-06 00:00', '2025-08-10 00:00')
+    assert calls == [('2025-08-06 00:00', '2025-08-07 00:00'), ('2025-08-09 00:00', '2025-08-10 00:00')]
+    pd.testing.assert_frame_equal(eph, grid_query([])(epochs('2025-08-06 00:00', '2025-08-10 00:00')))
+
+    calls.clear()
+    eph = fetch(cache, query, '2025-08-07 05:00', '2025-08-08 05:00')
+    assert calls == []
+    pd.testing.assert_frame_equal(eph, grid_query([])(epochs('2025-08-07 05:00', '2025-08-08 05:00')))
+
+
+def test_ranges_off_the_cached_grid_are_queried_again(tmp_path):
+    cache, calls = EphemerisCache(tmp_path), []
+    query = grid_query(calls)
+    fetch(cache, query, '2025-08-07 00:00', '2025-08-09 00:00')
+
+    # Starting half a step off the cached rows: nothing can be reused
+    calls.clear()
+    eph = fetch(cache, query, '2025-08-06 00:30', '2025-08-10 00:30')
+    assert calls == [('2025-08-06 00:30', '2025-08-10 00:30')]
+    pd.testing.assert_frame_equal(eph, grid_query([])(epochs('2025-08-06 00:30', '2025-08-10 00:30')))
+
+    # Cached up to a stop off the grid: the range after it would start off the grid
+    fetch(cache, query, '2025-08-07 00:00', '2025-08-09 00:30', 'Synthetic B')
+    calls.clear()
+    eph = fetch(cache, query, '2025-08-07 00:00', '2025-08-10 00:00', 'Synthetic B')
+    assert calls == [('2025-08-07 00:00', '2025-08-10 00:00')]
+    pd.testing.assert_frame_equal(eph, grid_query([])(epochs('2025-08-07 00:00', '2025-08-10 00:00')))
+
+
+def test_only_empty_ranges_are_cached_as_empty(tmp_path):
+    cache, calls = EphemerisCache(tmp_path), []
+    query = grid_query(calls)
+    fetch(cache, query, '2025-08-07 00:00', '2025-08-09 00:00')
+
+    def not_visible(epochs):
+        raise ValueError(f'{NO_EPHEMERIS} "Synthetic A" meets the criteria')
+    eph = fetch(cache, not_visible, '2025-08-07 00:00', '2025-08-10 00:00')
+    assert eph['datetime_str'].max() == pd.Timestamp('2025-08-09 00:00')
+
+    def broken(epochs):
+        raise ValueError('Query failed with error message: Cannot interpret date')
+    with pytest.raises(ValueError, match='Cannot interpret date'):
+        fetch(cache, broken, '2025-08-07 00:00', '2025-08-12 00:00')
+    start, stop, _, _ = cache._read(cache.make_key('obj', 'Synthetic A', '809', '60min', 'quantities'))
+    assert (start, stop) == (pd.Timestamp('2025-08-07 00:00'), pd.Timestamp('2025-08-10 00:00'))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    query = grid_query([])
+    fetch(EphemerisCache(tmp_path), query, '2025-08-07 00:00', '2025-08-09 00:00', 'Synthetic A')
+    size  = EphemerisCache(tmp_path).stats()['size_bytes']
+
+    # Room for two entries: using A again makes B the least recently used
+    cache = EphemerisCache(tmp_path, max_bytes=2 * size + size // 2)
+    fetch(cache, query, '2025-08-07 00:00', '2025-08-09 00:00', 'Synthetic B')
+    fetch(cache, query, '2025-08-07 00:00', '2025-08-09 00:00', 'Synthetic A')
+    fetch(cache, query, '2025-08-07 00:00', '2025-08-09 00:00', 'Synthetic C')
+
+    keys = {target: cache.make_key('obj', f'Synthetic {target}', '809', '60min', 'quantities') for target in 'ABC'}
+    assert cache.stats()['entries'] == 2
+    assert cache._read(keys['B']) is None
+    assert cache._read(keys['A']) is not None and cache._read(keys['C']) is not None
+
+
+def test_ranges_without_anything_visible_are_cached(tmp_path):
+    cache, calls = EphemerisCache(tmp_path), []
+    def not_visible(epochs):
+        calls.append(epochs)
+        raise ValueError(f'{NO_EPHEMERIS} "Synthetic A" meets the criteria')
+
+    assert fetch(cache, not_visible, '2025-08-07 00:00', '2025-08-09 00:00').empty
+    assert fetch(cache, not_visible, '2025-08-07 00:00', '2025-08-09 00:00').empty
+    assert len(calls) == 1
+
+    # Extending the range only queries the new part
+    assert fetch(cache, not_visible, '2025-08-07 00:00', '2025-08-10 00:00').empty
+    assert calls[1]['start'] == '2025-08-09 00:00' and len(calls) == 2
+
+
+def test_warmed_cache_is_used_by_a_run(tmp_path):
+    (tmp_path / 'targets.txt').write_text('Synthetic A\nSynthetic B\n')
+    cache_dir, log = tmp_path / 'cache', []
+    env = {**os.environ, 'PYTHONPATH': str(Path(__file__).parents[1])}
+    with running_server('synthetic', log=log) as url:
+        # The step is written as an hour for the cache and in minutes for the run
+        dates = ['targets.txt', '2025-08-07', '2025-08-08', '--horizons-url', url]
+        subprocess.run([sys.executable, '-m', 'obsfind.cache', '--cache-dir', cache_dir, 'warm', *dates, '--step', '1h'],
+                       cwd=tmp_path, env=env, check=True, capture_output=True)
+        warmed = len(log)
+        subprocess.run([sys.executable, '-m', 'obsfind.run', *dates, '--step', '60', '--cache-dir', cache_dir,
+                        '--outputs', 'summary'], cwd=tmp_path, env=env, check=True, capture_output=True)
+
+    assert warmed == 3
+    assert len(log) == warmed
+    assert (tmp_path / 'summary.csv').is_file()
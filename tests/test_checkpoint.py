@@ -0,0 +1,100 @@
+import json
+import pandas as pd
+import pytest
+from obsfind.checkpoint import RUN_MANIFEST, RunCheckpoints, start_stage
+
+
+INPUTS = {'mpc_codes': ['809'], 'mag_limit': 22.0, 'targets': ['A', 'B'], 'dates': ['2025-08-07']}
+
+
+def test_resume_from_the_last_completed_stage(tmp_path):
+    checkpoints = RunCheckpoints(tmp_path, INPUTS)
+    assert start_stage(checkpoints, True, None) == 'twilight'
+    eph = {'809': pd.DataFrame({'target': pd.Categorical(['A', 'B']), 'V': [18.5, 20.25]})}
+    checkpoints.save('twilight', {'809': pd.DataFrame({'night': [pd.Timestamp('2025-08-07')]})})
+    checkpoints.save('ephemeris', eph)
+
+    # Stopped after the ephemeris stage
+    checkpoints = RunCheckpoints(tmp_path, INPUTS)
+    assert start_stage(checkpoints, True, None) == 'cuts'
+    pd.testing.assert_frame_equal(checkpoints.load('ephemeris')['809'], eph['809'])
+    assert start_stage(checkpoints, False, None) == 'twilight'
+
+    # A missing checkpoint is made again
+    checkpoints.path('ephemeris').unlink()
+    assert start_stage(RunCheckpoints(tmp_path, INPUTS), True, None) == 'ephemeris'
+
+    # Saving a stage again drops the later ones
+    checkpoints.save('twilight', {})
+    assert RunCheckpoints(tmp_path, INPUTS).completed == ['twilight']
+
+
+def test_from_stage_needs_the_upstream_checkpoints(tmp_path):
+    checkpoints = RunCheckpoints(tmp_path, INPUTS)
+    with pytest.raises(ValueError, match='no checkpoint of the summaries stage'):
+        start_stage(checkpoints, False, 'render')
+    assert start_stage(checkpoints, False, 'twilight') == 'twilight'
+
+    for stage in ['twilight', 'ephemeris', 'cuts']:
+        checkpoints.save(stage, {})
+    assert start_stage(checkpoints, False, 'summaries') == 'summaries'
+    # Rendering also needs the cuts
+    checkpoints.save('summaries', {})
+    checkpoints.path('cuts').unlink()
+    with pytest.raises(ValueError, match='no checkpoint of the cuts stage'):
+        start_stage(RunCheckpoints(tmp_path, INPUTS), False, 'render')
+
+
+def test_checkpoints_of_other_inputs_are_not_used(tmp_path):
+    checkpoints = RunCheckpoints(tmp_path, INPUTS)
+    for stage in ['twilight', 'ephemeris', 'cuts']:
+        checkpoints.save(stage, {})
+
+    checkpoints = RunCheckpoints(tmp_path, {**INPUTS, 'mag_limit': 19.0})
+    assert not checkpoints.reusable and checkpoints.completed == []
+    assert start_stage(checkpoints, True, None) == 'twilight'
+    with pytest.raises(ValueError, match='no checkpoint of the ephemeris stage'):
+        start_stage(checkpoints, False, 'cuts')
+
+    # Checkpoints saved now replace the others
+    checkpoints.save('twilight', {})
+    assert RunCheckpoints(tmp_path, INPUTS).completed == []
+
+
+def test_run_resumed_after_stopping(run_obsfind, tmp_path, horizons_log):
+    run_obsfind('--checkpoint', '--outputs', 'summary')
+    expected = (tmp_path / 'summary.csv').read_text()
+    queries  = len(horizons_log)
+
+    # Stopped after the ephemeris stage, before writing the outputs
+    manifest = json.loads((tmp_path / 'run' / RUN_MANIFEST).read_text())
+    manifest['completed'] = ['twilight', 'ephemeris']
+    (tmp_path / 'run' / RUN_MANIFEST).write_text(json.dumps(manifest))
+    (tmp_path / 'summary.csv').unlink()
+
+    run_obsfind('--resume', '--outputs', 'summary')
+    assert len(horizons_log) == queries
+    assert (tmp_path / 'summary.csv').read_text() == expected
+    manifest = json.loads((tmp_path / 'run' / RUN_MANIFEST).read_text())
+    assert manifest['completed'] == ['twilight', 'ephemeris', 'cuts', 'summaries', 'render']
+
+
+def test_run_from_a_stage_without_checkpoints(run_obsfind, tmp_path):
+    result = run_obsfind('--from-stage', 'render', '--outputs', 'summary', check=False)
+    assert result.returncode == 1
+    assert 'Cannot start from the render stage' in result.stdout + result.stderr
+    assert 'Traceback' not in result.stderr
+    assert not (tmp_path / 'summary.csv').exists()
+
+
+def test_run_resumed_with_other_settings(run_obsfind, tmp_path, horizons_log):
+    run_obsfind('--checkpoint', '--outputs', 'summary', '-mag', '22')
+    queries = len(horizons_log)
+
+    # The ephemerides are fetched again, and the new magnitude limit is applied
+    run_obsfind('--resume', '--outputs', 'summary', '-mag', '19')
+    assert len(horizons_log) == 2 * queries
+    assert pd.read_csv(tmp_path / 'summary.csv')['Mag'].max() < 19
+
+    result = run_obsfind('--from-stage', 'summaries', '--outputs', 'summary', '-mag', '20', check=False)
+    assert result.returncode == 1 and 'Traceback' not in result.stderr
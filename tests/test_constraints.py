@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+import pytest
+from astropy.time import Time
+from obsfind.constraints import Constraints, drop_empty_nights, hour_angle
+from obsfind.ephemeris import assign_nights, get_twilight_times
+from obsfind.read_inputs import create_date_list
+from obsfind.sites import get_site
+
+
+# Three nights at La Silla, from about 22:15 to 11:20 UT
+TWILIGHT  = get_twilight_times('809', create_date_list(Time('2025-08-06'), Time('2025-08-08')))
+LONGITUDE = get_site('809')['Longitude']
+DEFAULTS  = {'V': 15.0, 'elevation': 60.0, 'lunar_elong': 90.0, 'lunar_illum': 50.0, 'Sky_motion': 0.1, 'RA': 0.0}
+
+
+def ephemeris(targets:dict, step:str='15min') -> pd.DataFrame:
+    """
+    Ephemeris sampled every step over the nights of TWILIGHT, with the columns of each
+    target given as values or functions of the hours since 2025-08-06 00:00 (DEFAULTS otherwise).
+    """
+    times = pd.date_range('2025-08-06 12:00', '2025-08-09 12:00', freq=step)
+    hours = ((times - pd.Timestamp('2025-08-06')) / pd.Timedelta(hours=1)).to_numpy()
+    frames = []
+    for target, columns in targets.items():
+        columns = {**DEFAULTS, **columns}
+        frames.append(pd.DataFrame({'target': target, 'datetime_str': times.strftime('%Y-%b-%d %H:%M'), 'datetime': times,
+                                    **{col: value(hours) if callable(value) else value for col, value in columns.items()}}))
+    eph, _ = assign_nights(pd.concat(frames, ignore_index=True), TWILIGHT.copy())
+    return eph.reset_index(drop=True)
+
+
+def kept(constraints:Constraints, eph:pd.DataFrame) -> set:
+    return set(constraints.apply(eph, TWILIGHT, '15min', LONGITUDE)['target'])
+
+
+def segment_above(e_start, e_end, length):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.maximum(e_start, e_end) / np.abs(e_start - e_end)
+    frac = np.where((e_start >= 0) & (e_end >= 0), 1, np.where((e_start < 0) & (e_end < 0), 0, frac))
+    return length * frac
+
+
+def time_above_limit(eph, elevation_limit, twilight_times, step):
+    """The elevation-only duration Constraints.observable_hours replaced, as reference."""
+    step_hours = pd.Timedelta(step) / pd.Timedelta(hours=1)
+    nights = twilight_times.set_index('night')
+    target = pd.factorize(eph['target'])[0]
+    night  = eph['night'].to_numpy()
+    t      = (eph['datetime'] - eph['night']).to_numpy() / np.timedelta64(1, 'h')
+    e      = eph['elevation'].fillna(0).to_numpy() - elevation_limit
+    t_set  = (nights.loc[eph['night'], 'sun_set'].to_numpy() - night) / np.timedelta64(1, 'h')
+    t_rise = (nights.loc[eph['night'], 'sun_rise'].to_numpy() - night) / np.timedelta64(1, 'h')
+
+    same = np.zeros(len(eph), dtype=bool)
+    same[:-1] = (target[1:] == target[:-1]) & (night[1:] == night[:-1])
+    dt = np.append(np.diff(t), np.inf)
+    adjacent = same & (dt <= 1.5*step_hours)
+    prev_adjacent = np.insert(adjacent[:-1], 0, False)
+
+    e_next = np.append(e[1:], 0)
+    above  = segment_above(e, e_next, np.where(adjacent, dt, 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope_next = np.where(adjacent, (e_next - e) / dt, 0)
+    slope_prev = np.insert(slope_next[:-1], 0, 0)
+
+    prev_same = np.insert(same[:-1], 0, False)
+    left  = np.where(prev_same, step_hours/2, np.clip(t - t_set, 0, step_hours))
+    above += np.where(~prev_adjacent, segment_above(e - slope_next*left, e, left), 0)
+    right = np.where(same, step_hours/2, np.clip(t_rise - t, 0, step_hours))
+    above += np.where(~adjacent, segment_above(e, e + slope_prev*right, right), 0)
+
+    duration = pd.Series(above, index=pd.MultiIndex.from_arrays([eph['target'], eph['night']], names=['target', 'night']))
+    duration = duration.groupby(level=['target', 'night'], sort=True, observed=True).sum()
+    return duration[duration > 0]
+
+
+def target_cuts(eph_df, mag_limit, elevation_limit, t_vis_limit, twilight_times, step):
+    """The magnitude, elevation and time cuts before Constraints, as reference."""
+    eph_df['Mag'] = eph_df['V']
+    eph_df_cut = eph_df[eph_df['Mag'] < mag_limit].sort_values(by=['target', 'datetime']).reset_index(drop=True)
+    t_vis_dur = time_above_limit(eph_df_cut, elevation_limit, twilight_times, step).reset_index(name='duration_hours')
+    targets_visible = t_vis_dur[t_vis_dur['duration_hours'] >= t_vis_limit]
+    return eph_df_cut.merge(targets_visible[['target', 'night', 'duration_hours']], on=['target', 'night'], how='inner')
+
+
+def test_apply_matches_the_elevation_cuts_it_replaced():
+    # Targets rising and setting at different times, fading below the magnitude limit at times (gaps)
+    def elevation(phase):
+        def curve(hours):
+            e = 80 * np.sin(2 * np.pi * (hours - phase) / 23.93)
+            return np.where(e > 0, e, np.nan)
+        return curve
+    targets = {f'T{i}': {'elevation': elevation(phase), 'V': lambda h, i=i: 20 + 2 * np.sin(h * (1 + i / 3))}
+               for i, phase in enumerate(np.linspace(0, 24, 9))}
+    targets['Moon'] = {'elevation': elevation(5), 'V': -10.0}
+    eph = ephemeris(targets)
+
+    for mag_limit, elevation_limit, t_vis_limit in [(21, 30, 1), (30, 50, 2.5), (19, 10, 0)]:
+        expected = target_cuts(eph.copy(), mag_limit, elevation_limit, t_vis_limit, TWILIGHT, '15min')
+        result   = Constraints(mag_limit, elevation_limit, t_vis_limit).apply(eph.copy(), TWILIGHT, '15min')
+        assert 0 < len(result) < len(eph)
+        pd.testing.assert_frame_equal(result, expected, rtol=1e-9)
+
+
+def test_moon_separation():
+    eph = ephemeris({'Near': {'lunar_elong': 10.0}, 'Far': {'lunar_elong': 50.0}, 'Moon': {}})
+    assert kept(Constraints(min_moon_sep=30), eph) == {'Far', 'Moon'}
+    assert kept(Constraints(), eph) == {'Near', 'Far', 'Moon'}
+
+
+def test_max_sky_motion():
+    eph = ephemeris({'Fast': {'Sky_motion': 5.0}, 'Slow': {'Sky_motion': 0.5}, 'Moon': {}})
+    assert kept(Constraints(max_sky_motion=1), eph) == {'Slow', 'Moon'}
+    assert kept(Constraints(), eph) == {'Fast', 'Slow', 'Moon'}
+
+
+def test_max_hour_angle():
+    # RA on the meridian at local midnight of the middle night, and opposite to it
+    midnight = TWILIGHT['sun_set'].iloc[1] + (TWILIGHT['sun_rise'].iloc[1] - TWILIGHT['sun_set'].iloc[1]) / 2
+    lst      = hour_angle(pd.DataFrame({'datetime': [midnight], 'RA': [0.0]}), LONGITUDE)[0] * 15
+    eph = ephemeris({'Transit': {'RA': lst % 360}, 'Opposite': {'RA': (lst + 180) % 360}, 'Moon': {}})
+    assert kept(Constraints(max_hour_angle=3), eph) == {'Transit', 'Moon'}
+    assert kept(Constraints(), eph) == {'Transit', 'Opposite', 'Moon'}
+
+
+def test_min_dark():
+    # Only high in the first hour after sunset, before astronomical twilight ends
+    def evening(hours):
+        night = (hours - 12) // 24
+        return np.where(hours - 24*night < 23.25, 60.0, np.nan)
+    eph = ephemeris({'Evening': {'elevation': evening}, 'Dark': {}, 'Moon': {'elevation': evening}})
+    constraints = Constraints(t_vis_limit=0.5, min_dark_hours=0.5)
+    assert kept(constraints, eph) == {'Dark', 'Moon'}
+    assert kept(Constraints(t_vis_limit=0.5), eph) == {'Evening', 'Dark', 'Moon'}
+
+
+def test_drop_empty_nights():
+    # A is only up on the first night, and there are no rows on the last night
+    eph = ephemeris({'A': {'elevation': lambda h: np.where(h < 36, 60.0, np.nan)}, 'Moon': {}})
+    eph = eph[eph['night'] != TWILIGHT['night'].iloc[2]]
+
+    eph_cut, twilight = Constraints().cut(eph, TWILIGHT, '15min')
+    assert list(twilight['night']) == [TWILIGHT['night'].iloc[0]]
+    assert set(eph_cut['night']) == {TWILIGHT['night'].iloc[0]}
+    assert set(eph_cut['target']) == {'A', 'Moon'}
+
+    eph_cut, twilight = drop_empty_nights(eph_cut.iloc[0:0], TWILIGHT)
+    assert eph_cut.empty and twilight.empty
+
+
+def observable_hours_per_night(eph:pd.DataFrame, step:str, elevation_limit:float=30) -> pd.Series:
+    eph_cut = Constraints(elevation_limit=elevation_limit, t_vis_limit=0).apply(eph.copy(), TWILIGHT, step)
+    return eph_cut.groupby('night')['duration_hours'].first()
+
+
+def test_interpolated_duration_is_closer_to_the_truth_than_counting_steps():
+    # Sampled every hour: crossings of the limit are interpolated between the samples
+    for phase in [19.5, 21.6]:
+        def elevation(hours):
+            e = 80 * np.sin(2 * np.pi * (hours - phase) / 23.93)
+            return np.where(e > 0, e, np.nan)
+        eph   = ephemeris({'A': {'elevation': elevation}}, step='60min')
+        hours = observable_hours_per_night(eph, '60min')
+        count = eph[eph['elevation'] > 30].groupby('night').size() * 1.0
+
+        for _, night in TWILIGHT.iterrows():
+            fine  = pd.date_range(night['sun_set'], night['sun_rise'], freq='10s')
+            truth = np.sum(elevation(((fine - pd.Timestamp('2025-08-06')) / pd.Timedelta(hours=1)).to_numpy()) > 30) / 360
+            assert hours[night['night']] == pytest.approx(truth, abs=0.05)
+            assert abs(hours[night['night']] - truth) < abs(count[night['night']] - truth)
+
+
+def test_crossings_between_twilight_and_the_first_or_last_sample():
+    # Rising through the limit between sunset and the first sample, setting between the last sample and sunrise
+    sun_set, sun_rise = TWILIGHT['sun_set'].iloc[1], TWILIGHT['sun_rise'].iloc[1]
+    rise_at = (sun_set.ceil('h') - sun_set) / 3 + sun_set
+    set_at  = sun_rise - (sun_rise - sun_rise.floor('h')) / 3
+    def hours_since(time):
+        return (time - pd.Timestamp('2025-08-06')) / pd.Timedelta(hours=1)
+    eph = ephemeris({'Rising'  : {'elevation': lambda h: 30 + 5 * (h - hours_since(rise_at))},
+                     'Setting' : {'elevation': lambda h: 30 - 5 * (h - hours_since(set_at))}}, step='60min')
+    eph = eph[eph['night'] == TWILIGHT['night'].iloc[1]]
+
+    for target, expected in [('Rising', sun_rise - rise_at), ('Setting', set_at - sun_set)]:
+        hours = observable_hours_per_night(eph[eph['target'] == target], '60min')
+        assert hours.iloc[0] == pytest.approx(expected / pd.Timedelta(hours=1), abs=1e-6)
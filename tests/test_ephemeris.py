@@ -0,0 +1,31 @@
+import pandas as pd
+from obsfind.ephemeris import assign_nights
+
+
+def assign_nights_loop(eph_all_targets, twilight_times):
+    """The per-night loop assign_nights replaced, as reference."""
+    eph_all_targets['night'] = None
+    for i, date in twilight_times.iterrows():
+        mask = (eph_all_targets['datetime'] >= date['sun_set']) & (eph_all_targets['datetime'] <= date['sun_rise'])
+        eph_all_targets.loc[mask, 'night'] = date['night']
+
+        moon_vals = eph_all_targets.loc[mask & (eph_all_targets['target'] == 'Moon'), 'lunar_illum']
+        twilight_times.loc[i, 'lunar_illum'] = moon_vals.median()
+
+    eph_all_targets = eph_all_targets.dropna(subset=['night'])
+    eph_all_targets['night'] = pd.to_datetime(eph_all_targets['night'])
+    return eph_all_targets, twilight_times
+
+
+def test_assign_nights_matches_the_loop(night_ephemeris):
+    eph, twilight = night_ephemeris
+    expected_eph, expected_twilight = assign_nights_loop(eph.copy(), twilight.copy())
+    result_eph, result_twilight     = assign_nights(eph.copy(), twilight.copy())
+
+    pd.testing.assert_frame_equal(result_eph, expected_eph)
+    pd.testing.assert_frame_equal(result_twilight, expected_twilight)
+
+    # Rows after midnight UT belong to the night before, nights without rows have no lunar illumination
+    assert (result_eph['datetime'].dt.normalize() > result_eph['night']).any()
+    assert set(result_eph['night'].dt.strftime('%Y-%m-%d')) == {'2025-08-06', '2025-08-07'}
+    assert result_twilight['lunar_illum'].isna().tolist() == [False, False, True, True]
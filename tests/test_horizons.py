@@ -0,0 +1,83 @@
+import datetime
+import pytest
+import requests
+from horizons_server import running_server
+from obsfind import ephemeris
+from obsfind.ephemeris import fetch_ephemerides, horizons_epochs, iter_sites_horizons_ephemerides, retry_transient
+
+
+TARGETS = ['Synthetic A', 'Synthetic B', 'Synthetic C', 'Synthetic D', 'Synthetic E', 'Synthetic F']
+EPOCHS  = horizons_epochs(datetime.datetime(2025, 8, 7), datetime.datetime(2025, 8, 8), '60min')
+
+
+def max_in_flight(log:list[dict]) -> int:
+    """Largest number of requests the server was answering at once."""
+    events = sorted([(r['start'], 1) for r in log] + [(r['end'], -1) for r in log], key=lambda e: (e[0], e[1]))
+    current, peak = 0, 0
+    for _, change in events:
+        current += change
+        peak     = max(peak, current)
+    return peak
+
+
+def test_fetch_is_concurrent_and_retries_transient_errors():
+    log = []
+    with running_server('synthetic', latency=0.1, failures=1, log=log) as url:
+        eph_list = fetch_ephemerides(TARGETS, '809', EPOCHS, workers=4, horizons_url=url)
+
+    # Every target and the Moon, in order, despite the first attempt of each failing
+    assert len(eph_list) == len(TARGETS) + 1
+    assert [eph['target'].iloc[0] for eph in eph_list] == TARGETS + ['Moon']
+    assert all(len(eph) > 0 for eph in eph_list)
+    # All queries went to the stand-in server, each failed once then succeeded
+    assert [r['status'] for r in log].count(503) == len(TARGETS) + 1
+    assert [r['status'] for r in log].count(200) == len(TARGETS) + 1
+    assert max_in_flight(log) > 1
+
+
+def test_retry_gives_up_and_does_not_retry_other_errors(tmp_path):
+    def get(session, url):
+        response = session.get(url, params={'COMMAND': "'Synthetic A'"})
+        response.raise_for_status()
+        return response
+
+    log = []
+    with running_server('synthetic', failures=3, log=log) as url, requests.Session() as session:
+        with pytest.raises(requests.HTTPError):
+            retry_transient(get, session, url, retries=1, backoff=0.01)
+    assert [r['status'] for r in log] == [503, 503]
+
+    # Not found is not transient, so it is raised straight away
+    log = []
+    with running_server('replay', recordings=tmp_path, log=log) as url, requests.Session() as session:
+        with pytest.raises(requests.HTTPError):
+            retry_transient(get, session, url, retries=3, backoff=0.01)
+    assert [r['status'] for r in log] == [404]
+
+
+def test_early_stop_closes_session_and_drops_queued_queries(monkeypatch):
+    sessions = []
+    def tracked_session(workers, server_url):
+        session = ephemeris.HorizonsSession(server_url)
+        session.closed = False
+        close = session.close
+        def tracked_close():
+            session.closed = True
+            close()
+        session.close = tracked_close
+        sessions.append(session)
+        return session
+    monkeypatch.setattr(ephemeris, 'horizons_session', tracked_session)
+
+    targets = [f'Synthetic {i}' for i in range(20)]
+    log = []
+    with running_server('synthetic', latency=0.05, log=log) as url:
+        ephemerides = iter_sites_horizons_ephemerides(targets, ['809'], EPOCHS, workers=2, horizons_url=url)
+        mpc_code, index, moon = next(ephemerides)
+        ephemerides.close()
+        answered = len(log)
+
+    assert (mpc_code, index) == ('809', len(targets))
+    assert sessions and sessions[0].closed
+    # Only the queries already running when the consumer stopped were answered
+    assert answered < len(targets)
@@ -0,0 +1,76 @@
+import hashlib
+import pandas as pd
+import pytest
+from obsfind.create_output import make_summary_charts_pdf
+from obsfind.ephemeris import assign_nights
+from obsfind.incremental import plan_incremental, previous_pages, target_fingerprints
+from obsfind.plotting import marker_list
+from obsfind.summaries import summarize_nights
+from obsfind.tables import table_path
+
+
+SETTINGS = {'mpc_codes': ['809'], 'mag_limit': 21.0, 'elevation_limit': 30.0, 'step': '60m', 'backend': 'horizons'}
+
+
+def manifest(targets, dates):
+    return {'version': 2, 'settings': SETTINGS, 'targets': targets, 'dates': dates, 'markers': targets,
+            'outputs': ['eph', 'summary'], 'format': 'csv', 'sites': {'809': {'nights': {}, 'targets': {}}}}
+
+
+def test_plan_incremental(tmp_path):
+    base     = f'{tmp_path}/'
+    previous = manifest(['A', 'B'], ['2025-08-07', '2025-08-08'])
+
+    # The ephemeris file of the previous run is needed to extend it
+    assert plan_incremental(previous, SETTINGS, ['A', 'B'], ['2025-08-07', '2025-08-08'], {'809': base}) is None
+    table_path(base, 'eph', 'csv').write_text('target,datetime_str\n')
+
+    plan = plan_incremental(previous, SETTINGS, ['A', 'B'], ['2025-08-07', '2025-08-08'], {'809': base})
+    assert (plan['new_targets'], plan['kept_targets'], plan['new_dates']) == ([], ['A', 'B'], [])
+
+    plan = plan_incremental(previous, SETTINGS, ['A', 'C', 'B'], ['2025-08-07', '2025-08-08'], {'809': base})
+    assert (plan['new_targets'], plan['kept_targets'], plan['new_dates']) == (['C'], ['A', 'B'], [])
+
+    plan = plan_incremental(previous, SETTINGS, ['A'], ['2025-08-07', '2025-08-08', '2025-08-09'], {'809': base})
+    assert (plan['new_targets'], plan['kept_targets'], plan['new_dates']) == ([], ['A'], ['2025-08-09'])
+    assert plan['markers'] == ['A', 'B']
+
+    assert plan_incremental(previous, {**SETTINGS, 'mag_limit': 22.0}, ['A', 'B'], ['2025-08-07'], {'809': base}) is None
+    assert plan_incremental(None, SETTINGS, ['A', 'B'], ['2025-08-07'], {'809': base}) is None
+
+
+def page_contents(path):
+    """Text and image data of each page of a PDF."""
+    from pypdf import PdfReader
+    pages = []
+    for page in PdfReader(str(path)).pages:
+        images = [hashlib.sha1(image.get_object().get_data()).hexdigest()
+                  for image in page['/Resources']['/XObject'].values()]
+        pages.append((page.extract_text(), images))
+    return pages
+
+
+def test_reused_summary_pages_match_a_full_run(night_ephemeris, tmp_path):
+    pytest.importorskip('pypdf')
+    # Marker order differs from the chart (file name) order
+    eph, twilight = night_ephemeris
+    extra = eph[eph['target'] == 'A'].assign(target='C/2023 A3', Mag=lambda df: df['Mag'] - 1)
+    eph, twilight = assign_nights(pd.concat([extra, eph], ignore_index=True), twilight)
+    summaries   = summarize_nights(eph, twilight)
+    summaries   = summaries[summaries['target'] != 'Moon']
+    plot_info   = marker_list(['C/2023 A3', 'B', 'A', 'Moon'])
+    fingerprints = target_fingerprints(summaries, plot_info)
+
+    full_pages = {}
+    make_summary_charts_pdf(summaries, plot_info, f'{tmp_path}/full_', pages=full_pages)
+    assert full_pages == {'A': 1, 'B': 2, 'C/2023 A3': 3}
+
+    # B changed since the previous run: only its page is rendered
+    entries = {obj: {'hash': fingerprints[obj], 'page': page, 'pages': 1} for obj, page in full_pages.items()}
+    reuse   = previous_pages(tmp_path / 'full_summary.pdf', entries, {**fingerprints, 'B': 'changed'})
+    assert sorted(reuse) == ['A', 'C/2023 A3']
+
+    spliced_pages = {}
+    make_summary_charts_pdf(summaries, plot_info, f'{tmp_path}/spliced_', reuse_pages=reuse, pages=spliced_pages)
+    assert spliced_pages == full_pages
+    assert page_contents(tmp_path / 'spliced_summary.pdf') == page_contents(tmp_path / 'full_summary.pdf')
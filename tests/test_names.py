@@ -0,0 +1,72 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import pytest
+from horizons_server import running_server
+from obsfind.ephemeris import call_horizons_obj, horizons_epochs, horizons_session
+from obsfind.names import RESOLVED, UNKNOWN, NameIndex, name_index
+
+
+# SBDB API answers of the stand-in below
+SBDB_OBJECTS = {'Ceres': {'object': {'spkid': '20000001', 'fullname': '1 Ceres (A801 AA)'}},
+                '1P'   : {'object': {'spkid': '90000030', 'fullname': '1P/Halley'}},
+                'Nope' : {'message': 'specified object was not found'}}
+
+
+@pytest.fixture
+def sbdb_url():
+    """URL of a local stand-in for the SBDB API, with the list of names looked up."""
+    lookups = []
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            name = parse_qs(urlsplit(self.path).query)['sstr'][0]
+            lookups.append(name)
+            data = json.dumps(SBDB_OBJECTS[name]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        def log_message(self, format, *args):
+            pass
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/api/sbdb.api', lookups
+    server.shutdown()
+    server.server_close()
+
+
+def test_names_are_looked_up_once_at_the_given_url(tmp_path, sbdb_url):
+    url, lookups = sbdb_url
+    names = NameIndex(tmp_path, url)
+    assert names.resolve('Ceres')['spkid'] == '20000001'
+    assert names.resolve('Nope')['status'] == UNKNOWN
+    # Both kept, the unknown name as a negative entry
+    assert names.resolve('Ceres')['status'] == RESOLVED
+    assert names.resolve('Nope')['status'] == UNKNOWN
+    assert lookups == ['Ceres', 'Nope']
+
+
+def test_no_name_index_with_a_horizons_stand_in(tmp_path):
+    assert name_index(tmp_path, horizons_url='http://127.0.0.1:1/api/horizons.api') is None
+    names = name_index(tmp_path, horizons_url='http://127.0.0.1:1/api/horizons.api', sbdb_url='http://127.0.0.1:2/sbdb')
+    assert names.sbdb_url == 'http://127.0.0.1:2/sbdb'
+    assert name_index(tmp_path).sbdb_url.startswith('https://ssd-api.jpl.nasa.gov')
+
+
+def test_resolved_names_are_queried_by_spkid_record(tmp_path, sbdb_url):
+    url, _ = sbdb_url
+    names  = NameIndex(tmp_path, url)
+    epochs = horizons_epochs('2025-08-07', '2025-08-07', '60min')
+    log    = []
+    with running_server('synthetic', log=log) as horizons_url:
+        session = horizons_session(1, horizons_url)
+        for target in ['Ceres', '1P']:
+            eph = call_horizons_obj(target, '809', epochs, session=session, names=names)
+            assert len(eph) > 0 and (eph['target'] == target).all()
+        session.close()
+
+    commands = [r['params']['COMMAND'].strip('"\'') for r in log]
+    # The SPK-IDs as record numbers, not designation searches (DES=) or small-body numbers (;)
+    assert commands == ['20000001', '90000030']
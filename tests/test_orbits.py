@@ -0,0 +1,60 @@
+from pathlib import Path
+import numpy as np
+from obsfind import almanac
+from obsfind.orbits import elements_ephemerides, heliocentric_position, is_comet, read_elements
+from obsfind.sites import get_site
+
+
+DATA = Path(__file__).parent / 'data'
+# (1) Ceres, with the Horizons osculating elements of 2022-Jun-10 written as an MPCORB line
+ELEMENTS = DATA / 'MPCORB_sample.DAT'
+# Horizons heliocentric ecliptic state vectors of Ceres from 2022-Jun-10 to Jul-10, recorded from
+# https://ssd.jpl.nasa.gov/api/horizons.api?format=text&EPHEM_TYPE=VECTORS&OUT_UNITS=AU-D&COMMAND=%22Ceres%3B%22&CENTER=%27500%4010%27&CSV_FORMAT=%22YES%22&REF_PLANE=ECLIPTIC&REF_SYSTEM=ICRF&TP_TYPE=ABSOLUTE&VEC_LABELS=YES&VEC_CORR=%22NONE%22&VEC_DELTA_T=NO&OBJ_DATA=YES&START_TIME=2022-06-10&STOP_TIME=2022-07-10&STEP_SIZE=10d
+VECTORS  = DATA / 'ceres_vectors.txt'
+
+
+def read_vectors(path:Path) -> tuple[np.ndarray, np.ndarray]:
+    """Julian dates (TDB) and positions (au) of a Horizons vector table."""
+    table = path.read_text().split('$$SOE\n')[1].split('$$EOE')[0]
+    rows  = [line.split(',') for line in table.splitlines()]
+    return np.array([float(row[0]) for row in rows]), np.array([[float(v) for v in row[2:5]] for row in rows])
+
+
+def test_read_elements():
+    elements = read_elements(ELEMENTS, ['Ceres', '2', '1P/Halley'])
+    assert list(elements.index) == ['Ceres']
+    ceres = elements.loc['Ceres']
+    assert ceres['targetname'] == '(1) Ceres'
+    assert ceres['epoch'] == 2459740.5
+    assert (ceres['H'], ceres['G'], ceres['e'], ceres['a']) == (3.33, 0.12, 0.0785751, 2.7663808)
+    assert list(read_elements(ELEMENTS, ['1']).index) == ['1']
+
+
+def test_comets_are_rejected(tmp_path):
+    assert is_comet('1P/Halley') and is_comet('12P') and is_comet('C/2023 A3') and is_comet('p/2019 LD2')
+    assert not is_comet('Ceres') and not is_comet('1997 AE12') and not is_comet('A/2017 U1')
+
+    # A hyperbolic orbit cannot be propagated
+    line = ELEMENTS.read_text()
+    line = line[:70] + f'{1.2:9.7f}' + line[79:166] + 'A/2017 U1'.ljust(28) + line[194:]
+    (tmp_path / 'hyperbolic.DAT').write_text(line)
+    assert read_elements(tmp_path / 'hyperbolic.DAT', ['A/2017 U1']).empty
+
+
+def test_two_body_propagation_matches_horizons():
+    jd_tdb, vectors = read_vectors(VECTORS)
+    positions = heliocentric_position(read_elements(ELEMENTS, ['Ceres']), jd_tdb)[0]
+    # Within 1500 km (under an arcsecond from the Earth) over the 30 days from the epoch of the elements
+    error = np.linalg.norm(positions - almanac.ecliptic_to_equatorial(vectors), axis=-1)
+    assert error.max() < 1e-5
+
+
+def test_no_airmass_below_the_horizon():
+    epochs = {'start': '2022-06-10 00:00', 'stop': '2022-06-11 00:00', 'step': '15min'}
+    ceres, moon = elements_ephemerides(ELEMENTS, ['Ceres'], get_site('809'), epochs, skip_daylight=False)
+    for eph in ceres, moon:
+        elevation = 90 - np.rad2deg(np.arccos(1 / eph['airmass']))
+        assert 0 < eph['airmass'].isna().sum() < len(eph)
+        assert elevation.min() > 0 and eph['airmass'].min() >= 1
+    assert ceres['targetname'].iloc[0] == '(1) Ceres'
+    assert len(ceres) == len(moon) == 97
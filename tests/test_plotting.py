@@ -0,0 +1,32 @@
+import io
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.dates as mdates
+import numpy as np
+import pandas as pd
+from matplotlib.patches import Rectangle
+from elevation_chart import synthetic_night
+from obsfind.plotting import ElevationChart, marker_list
+
+
+def test_reused_chart_moves_twilight_spans():
+    rng     = np.random.default_rng(0)
+    targets = ['A', 'B', 'C']
+    chart   = ElevationChart(marker_list(targets + ['Moon']), 30)
+    try:
+        for night in pd.date_range('2025-08-07', periods=2):
+            twilight, eph_night = synthetic_night(night, targets, rng)
+            png = io.BytesIO()
+            chart.render(twilight.copy(), eph_night, png_buffer=png)
+            assert png.getvalue().startswith(b'\x89PNG')
+
+            # Evening and morning civil, nautical and astronomical twilight
+            edges = mdates.date2num([twilight[col] for col in ['sun_set', 'civil_set', 'nautical_set', 'astronomical_set',
+                                                               'astronomical_rise', 'nautical_rise', 'civil_rise', 'sun_rise']])
+            starts, stops = edges[[0, 1, 2, 4, 5, 6]], edges[[1, 2, 3, 5, 6, 7]]
+            assert all(isinstance(span, Rectangle) for span in chart.spans)
+            assert np.allclose([span.get_x() for span in chart.spans], starts)
+            assert np.allclose([span.get_width() for span in chart.spans], stops - starts)
+            assert all(span.get_y() == 0 and span.get_height() == 1 for span in chart.spans)
+    finally:
+        chart.close()
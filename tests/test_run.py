@@ -0,0 +1,28 @@
+import pandas as pd
+
+
+def test_streamed_output_matches_a_batch_run(run_obsfind, tmp_path):
+    run_obsfind('--outputs', 'eph,summary', '-out', 'batch')
+    run_obsfind('--outputs', 'eph,summary', '-out', 'stream', '--stream')
+
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'stream_summary.csv', index_col=0),
+                                  pd.read_csv(tmp_path / 'batch_summary.csv', index_col=0))
+
+    # Streamed rows are written as the targets arrive, with the fixed output columns
+    batch  = pd.read_csv(tmp_path / 'batch_eph.csv', index_col=0)
+    stream = pd.read_csv(tmp_path / 'stream_eph.csv', index_col=0)
+    assert set(batch['target']) == {'Synthetic A', 'Synthetic B', 'Synthetic C', 'Synthetic D', 'Moon'}
+    assert stream[stream.columns.difference(batch.columns)].isna().all().all()
+    order = ['target', 'datetime']
+    pd.testing.assert_frame_equal(stream[batch.columns].sort_values(order, ignore_index=True),
+                                  batch.sort_values(order, ignore_index=True))
+
+
+def test_multi_site_summary(run_obsfind, tmp_path):
+    run_obsfind('--outputs', 'eph,summary', '-mpc', '809,I11')
+
+    summary = pd.read_csv(tmp_path / 'summary.csv', index_col=0, dtype={'site': str})
+    assert summary.columns[0] == 'site' and set(summary['site']) == {'809', 'I11'}
+    assert summary.index.is_unique and list(summary.index) == list(range(len(summary)))
+    for site in ['809', 'I11']:
+        assert (tmp_path / f'{site}_eph.csv').is_file()
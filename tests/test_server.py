@@ -0,0 +1,104 @@
+import json
+import threading
+import pytest
+import requests
+from horizons_server import running_server
+from obsfind import server as query_server
+from obsfind.server import QueryService, make_server
+
+
+TARGETS = ['Synthetic A', 'Synthetic B', 'Synthetic C']
+
+
+@pytest.fixture(scope='module')
+def base_url():
+    """URL of a query server on a free local port, fetching from a synthetic Horizons stand-in."""
+    with running_server('synthetic') as horizons_url:
+        service = QueryService(TARGETS, workers=2, horizons_url=horizons_url, use_cache=False, step='60min',
+                               keep_ephemerides=4)
+        server  = make_server(service, port=0)
+        thread  = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+
+def ndjson(response:requests.Response) -> list[dict]:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_health(base_url):
+    response = requests.get(f'{base_url}/health')
+    assert response.status_code == 200
+    health = response.json()
+    assert health['status'] == 'ok'
+    assert health['targets'] == len(TARGETS)
+
+
+def test_visible(base_url):
+    response = requests.get(f'{base_url}/visible', params={'mpc-code': '809', 'date': '2025-08-07',
+                                                           'mag-limit': 30, 'targets': ','.join(TARGETS[:2])})
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/x-ndjson'
+    rows = ndjson(response)
+    assert int(response.headers['X-Rows']) == len(rows) > 0
+    assert float(response.headers['X-Query-Time-Ms']) >= 0
+    assert {row['target'] for row in rows} <= set(TARGETS[:2])
+    assert all(row['site'] == '809' for row in rows)
+    # In RA order, as the table of the elevation report
+    assert [row['RA'] for row in rows] == sorted(row['RA'] for row in rows)
+
+
+def test_summary_over_nights_with_default_targets(base_url):
+    response = requests.get(f'{base_url}/summary', params={'start-date': '2025-08-07', 'end-date': '2025-08-09',
+                                                           'mag-limit': 30, 'elevation-limit': 10})
+    assert response.status_code == 200
+    rows = ndjson(response)
+    assert len(rows) == int(response.headers['X-Rows'])
+    assert {row['target'] for row in rows} <= set(TARGETS)
+    assert len({row['datetime_str'] for row in rows}) > 1
+
+
+def test_stricter_constraints_give_fewer_rows(base_url):
+    params = {'date': '2025-08-07', 'mag-limit': 30}
+    loose  = ndjson(requests.get(f'{base_url}/visible', params=params))
+    strict = ndjson(requests.get(f'{base_url}/visible', params={**params, 'elevation-limit': 60}))
+    assert len(strict) <= len(loose)
+
+
+def test_rows_are_streamed_in_chunks(base_url, monkeypatch):
+    monkeypatch.setattr(query_server, 'STREAM_ROWS', 1)
+    response = requests.get(f'{base_url}/summary', params={'start-date': '2025-08-07', 'end-date': '2025-08-09',
+                                                           'mag-limit': 30}, stream=True)
+    assert 'Content-Length' not in response.headers
+    lines = [json.loads(line) for line in response.iter_lines() if line]
+    assert len(lines) == int(response.headers['X-Rows']) > 1
+
+
+@pytest.mark.parametrize('path, params, status, message', [
+    ('/unknown', {}, 404, 'Unknown query /unknown'),
+    ('/visible', {'mag-limit': 'bright'}, 400, 'mag-limit must be a number'),
+    ('/visible', {'mpc-code': 'XYZ'}, 400, 'Unknown MPC code XYZ'),
+    ('/summary', {'start-date': 'someday'}, 400, 'Cannot read date someday'),
+    ('/summary', {'start-date': '2025-08-09', 'end-date': '2025-08-07'}, 400, 'is before start date'),
+])
+def test_errors(base_url, path, params, status, message):
+    response = requests.get(f'{base_url}{path}', params=params)
+    assert response.status_code == status
+    assert response.headers['Content-Type'] == 'application/json'
+    assert message in response.json()['error']
+
+
+@pytest.mark.parametrize('argv', [['--step', '7x'], ['--step', '90'], ['--workers', '0'], ['--keep', '-1'],
+                                  ['--backend', 'elements']])
+def test_invalid_arguments_exit(monkeypatch, argv):
+    monkeypatch.setattr('sys.argv', ['obsfind.server'] + argv)
+    with pytest.raises(SystemExit):
+        query_server.validate_args(query_server.parse_args())
+
+
+def test_step_is_read_as_on_the_command_line(monkeypatch):
+    monkeypatch.setattr('sys.argv', ['obsfind.server', '--step', '1h'])
+    assert query_server.validate_args(query_server.parse_args()).step == '60min'
@@ -0,0 +1,67 @@
+import threading
+import time
+import pytest
+import requests
+from horizons_server import running_server
+from obsfind.ephemeris import get_twilight_times
+from obsfind.session import ObservabilitySession
+
+
+TARGETS = ['Synthetic A', 'Synthetic B']
+OTHERS  = ['Synthetic C', 'Synthetic D']
+NIGHTS  = ('2025-08-07', '2025-08-08')
+
+
+def test_cached_queries_do_not_wait_for_a_fetch():
+    log = []
+    with running_server('synthetic', latency=0.5, log=log) as url, \
+         ObservabilitySession('809', horizons_url=url, use_cache=False, step='60min', keep_ephemerides=4) as session:
+        session.observe(TARGETS, *NIGHTS, mag_limit=30)
+
+        slow = threading.Thread(target=session.observe, args=(OTHERS, *NIGHTS), kwargs={'mag_limit': 30})
+        slow.start()
+        time.sleep(0.1)
+        start  = time.perf_counter()
+        result = session.observe(TARGETS, *NIGHTS, elevation_limit=40, mag_limit=30)
+        cached = time.perf_counter() - start
+        assert slow.is_alive()
+        slow.join()
+
+    assert cached < 0.4
+    assert set(result.targets) <= set(TARGETS)
+
+
+def test_concurrent_queries_share_one_fetch():
+    log = []
+    with running_server('synthetic', latency=0.2, log=log) as url, \
+         ObservabilitySession('809', horizons_url=url, use_cache=False, step='60min') as session:
+        results = [None] * 3
+        def observe(i):
+            results[i] = session.observe(TARGETS, *NIGHTS, mag_limit=30)
+        threads = [threading.Thread(target=observe, args=(i,)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # The targets and the Moon are fetched once, without keeping ephemerides
+    assert len(log) == len(TARGETS) + 1
+    assert all(len(result.summaries) == len(results[0].summaries) for result in results)
+    assert not session._fetching
+
+
+def test_errors_raise_instead_of_exiting(tmp_path):
+    with pytest.raises(ValueError, match='Unknown MPC code'):
+        ObservabilitySession('XYZ', use_cache=False)
+    with pytest.raises(ValueError, match='step'):
+        ObservabilitySession('809', use_cache=False, step='90min')
+    with pytest.raises(ValueError, match='Unknown MPC code'):
+        get_twilight_times('XYZ', ['2025-08-07'])
+
+    # The Moon query fails (nothing recorded): the error reaches the caller, and the fetch can be retried
+    with running_server('replay', recordings=tmp_path) as url, \
+         ObservabilitySession('809', horizons_url=url, use_cache=False, step='60min') as session:
+        for _ in range(2):
+            with pytest.raises(requests.HTTPError):
+                session.observe(TARGETS, *NIGHTS)
+        assert not session._fetching
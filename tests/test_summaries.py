@@ -0,0 +1,66 @@
+import astropy.units as u
+import numpy as np
+import pandas as pd
+from astropy.coordinates import Angle, SkyCoord
+from obsfind.ephemeris import assign_nights
+from obsfind.summaries import sexagesimal, summarize_nights
+
+
+def summarize_target(group, twilight_info=None, tar_name=None):
+    """The per-target summary summarize_nights replaced, as reference."""
+    medians = group.agg({'alpha': 'median', 'Mag': 'median', 'Sky_motion': 'median', 'RA': 'median',
+                         'DEC': 'median', 'lunar_elong': 'median', 'duration_hours': 'median'})
+    night = group['night'].iloc[0]
+    med_coord = SkyCoord(ra=medians['RA']*u.deg, dec=medians['DEC']*u.deg, frame='icrs')
+    return pd.Series({'target'      : tar_name,
+                      'date_str'    : night.strftime('%Y-%m-%d'),
+                      'datetime_str': pd.to_datetime(night),
+                      **medians,
+                      'RA_str'      : med_coord.ra.to_string(unit=u.hour, sep=':', precision=0, pad=True),
+                      'DEC_str'     : med_coord.dec.to_string(sep=':', precision=0, pad=True),
+                      'twlt_stt'    : twilight_info['astronomical_set'],
+                      'twlt_stp'    : twilight_info['astronomical_rise'],
+                      'nght_stt'    : twilight_info['sun_set'],
+                      'nght_stp'    : twilight_info['sun_rise']})
+
+
+def summarize_nights_loop(eph_cut, twilight_list):
+    """
+    The per-night summaries of make_elevation_charts_pdf before summarize_nights, as reference.
+    Nights without rows are skipped, where the loop raised a KeyError.
+    """
+    summary_list = []
+    for _, row in twilight_list.iterrows():
+        eph_night = eph_cut[eph_cut['night'] == row['night']]
+        if eph_night.empty:
+            continue
+        summary_df = (eph_night
+                      .groupby('target', observed=True)[eph_night.columns.difference(['target'])]
+                      .apply(lambda df: summarize_target(df, row, tar_name=df.name))
+                      .reset_index(drop=True))
+        summary_df['lunar_illum'] = row['lunar_illum']
+        summary_df = summary_df[summary_df['target'] != 'Moon']
+        summary_list.append(summary_df.sort_values(by='RA_str'))
+    return pd.concat(summary_list).sort_values(by=['target', 'datetime_str'])
+
+
+def test_summarize_nights_matches_the_loop(night_ephemeris):
+    eph, twilight = assign_nights(*night_ephemeris)
+    expected  = summarize_nights_loop(eph, twilight)
+    summaries = summarize_nights(eph, twilight)
+    result    = summaries[summaries['target'] != 'Moon']
+
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    # The Moon is summarized too, and nights without rows have no summaries
+    assert set(summaries['target']) == {'A', 'B', 'Moon'}
+    assert set(summaries['date_str']) == {'2025-08-06', '2025-08-07'}
+
+
+def test_sexagesimal_matches_astropy():
+    # Declinations and right ascensions in hours, with seconds that round up to the next minute and hour
+    values = np.concatenate([np.random.default_rng(0).uniform(-90, 90, 2000),
+                             [0, -0.1/3600, 59.6/3600, 23 + 59/60 + 59.7/3600, 10 + 59/60 + 59.3/3600]])
+    expected = [Angle(value*u.deg).to_string(sep=':', precision=0, pad=True) for value in values]
+    assert sexagesimal(values) == expected
+    assert sexagesimal([np.nan]) == ['nan']
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+from obsfind.tables import FORMATS, TableWriter, read_table, save_table, table_path
+
+
+def ephemeris(rows:int) -> pd.DataFrame:
+    """Ephemeris-like table, with the compact column types."""
+    return pd.DataFrame({'target'   : pd.Categorical(np.resize(['Synthetic A', 'Moon', 'C/2023 A3'], rows),
+                                                     categories=['C/2023 A3', 'Moon', 'Synthetic A', 'Synthetic B']),
+                         'datetime' : pd.date_range('2025-08-07 22:00', periods=rows, freq='15min'),
+                         'RA'       : np.linspace(0, 359.123456789, rows),
+                         'V'        : np.linspace(15, 22.3, rows).astype('float32'),
+                         'airmass'  : np.where(np.arange(rows) % 4 == 0, np.nan, 1.5).astype('float32')})
+
+
+def read_back(path, like:pd.DataFrame) -> pd.DataFrame:
+    # CSV files do not keep the column types
+    df = read_table(path)
+    return df.astype(like.dtypes.to_dict()) if path.suffix == '.csv' else df
+
+
+@pytest.fixture(params=FORMATS)
+def fmt(request):
+    if request.param != 'csv':
+        pytest.importorskip('pyarrow')
+    return request.param
+
+
+def test_round_trip(fmt, tmp_path):
+    df   = ephemeris(10)
+    path = save_table(df, f'{tmp_path}/', 'eph', 'Ephemeris', fmt)
+    assert path == table_path(f'{tmp_path}/', 'eph', fmt)
+    result = read_back(path, df)
+    pd.testing.assert_frame_equal(result, df)
+    if fmt != 'csv':
+        assert result['V'].dtype == 'float32' and isinstance(result['target'].dtype, pd.CategoricalDtype)
+        pd.testing.assert_frame_equal(read_table(path, columns=['V', 'target']), df[['V', 'target']])
+
+
+def test_empty_table(fmt, tmp_path):
+    df   = ephemeris(0)
+    path = save_table(df, f'{tmp_path}/', 'eph', 'Ephemeris', fmt)
+    result = read_back(path, df)
+    assert result.empty and list(result.columns) == list(df.columns)
+    assert (result.dtypes.astype(str) == df.dtypes.astype(str)).all()
+
+
+def test_writes_in_chunks(fmt, tmp_path):
+    df   = ephemeris(25)
+    path = save_table(df, f'{tmp_path}/', 'eph', 'Ephemeris', fmt, chunk_rows=7)
+    pd.testing.assert_frame_equal(read_back(path, df), df)
+
+    # Chunks written as they come, as the streamed ephemerides
+    path = table_path(f'{tmp_path}/', 'streamed', fmt)
+    with TableWriter(path, fmt) as writer:
+        for start in range(0, 25, 10):
+            writer.write(df.iloc[start:start+10])
+    assert writer.rows == 25
+    pd.testing.assert_frame_equal(read_back(path, df), df)
+
+
+def test_unknown_formats_and_compressions(tmp_path):
+    with pytest.raises(ValueError, match='Unknown table format'):
+        TableWriter(tmp_path / 'eph.xlsx', 'xlsx')
+    with pytest.raises(ValueError, match='not available for csv'):
+        TableWriter(tmp_path / 'eph.csv', 'csv', 'zstd')
@@ -0,0 +1,60 @@
+import ephem
+import numpy as np
+import pandas as pd
+import pytest
+from astropy.time import Time
+from obsfind.ephemeris import (TWILIGHT_DEFINITIONS, TWILIGHT_TOLERANCE, twilight_times_numpy,
+                               twilight_times_ephem)
+
+
+# Crossings where the Sun turns within this much of the horizon (degrees) are ill-conditioned:
+# a thousandth of a degree in the solar model moves them by tens of seconds
+GRAZING_MARGIN = 1.0
+
+NIGHTS     = Time(pd.date_range('2025-01-03', '2025-12-31', freq='11D').strftime('%Y-%m-%d').tolist())
+LATITUDES  = [-59, -45, -30, -10, 0, 10, 30, 45, 55, 59]
+LONGITUDES = [0, 70, 203.743, 289.266]
+
+
+def lowest_sun_altitude(site_lon:float, site_lat:float, sun_set:pd.Timestamp) -> float:
+    """Altitude of the centre of the Sun at its lower culmination after sunset (degrees)."""
+    site      = ephem.Observer()
+    site.lon  = str(site_lon)
+    site.lat  = str(site_lat)
+    site.date = sun_set.to_pydatetime()
+    sun       = ephem.Sun()
+    site.date = site.next_antitransit(sun)
+    sun.compute(site)
+    return np.rad2deg(float(sun.alt))
+
+
+@pytest.mark.parametrize('site_lat', LATITUDES)
+def test_numpy_twilight_agrees_with_ephem(site_lat):
+    for site_lon in LONGITUDES:
+        fast = twilight_times_numpy(site_lon, site_lat, NIGHTS)
+        ref  = twilight_times_ephem(site_lon, site_lat, NIGHTS)
+        assert list(fast.columns) == list(ref.columns)
+        assert (pd.to_datetime(fast['night']) == pd.to_datetime(ref['night'])).all()
+
+        lowest   = np.array([lowest_sun_altitude(site_lon, site_lat, t) for t in pd.to_datetime(ref['sun_set'])])
+        horizons = {'sun': -0.833, **{name: float(angle) for name, angle in TWILIGHT_DEFINITIONS.items()}}
+        for name, horizon in horizons.items():
+            for edge in ['set', 'rise']:
+                column  = f'{name}_{edge}'
+                numpy_t = pd.to_datetime(fast[column])
+                ephem_t = pd.to_datetime(ref[column])
+                # Same nights without the twilight, except where the Sun grazes its altitude
+                clear   = np.abs(lowest - horizon) > GRAZING_MARGIN
+                assert (numpy_t.isna() == ephem_t.isna())[clear].all(), (site_lon, column)
+                both    = clear & numpy_t.notna().to_numpy() & ephem_t.notna().to_numpy()
+                error   = (numpy_t - ephem_t).abs().dt.total_seconds()[both]
+                assert error.max() <= TWILIGHT_TOLERANCE, (site_lon, column, error.idxmax(), error.max())
+
+
+def test_numpy_twilight_polar_nights():
+    # The Sun neither sets in summer nor rises in winter
+    nights = Time(['2025-06-21', '2025-12-21'])
+    fast   = twilight_times_numpy(0, 75, nights)
+    assert pd.isna(fast['sun_set'][0]) and pd.isna(fast['sun_rise'][0])
+    assert pd.notna(fast['sun_set'][1]) and pd.notna(fast['sun_rise'][1])
+    assert pd.notna(fast['astronomical_set'][1])